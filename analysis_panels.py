@@ -0,0 +1,101 @@
+"""
+Histogram and line profile panels of the image viewer
+"""
+
+from typing import Tuple
+
+import numpy as np
+from PySide.QtCore import Qt, QPointF
+from PySide.QtGui import QColor, QPainter, QPainterPath, QPen, QWidget
+
+# curve colours of gray scale and of the B, G, R channels
+CHANNEL_COLORS = {1: (QColor(220, 220, 220),),
+                  3: (QColor(80, 80, 255), QColor(80, 220, 80), QColor(255, 80, 80))}
+
+
+class _PlotPanel(QWidget):
+    """
+    Draws one curve per channel scaled into the widget, the curves are built when the data is set.
+    """
+    def __init__(self, parent: QWidget=None):
+        super(_PlotPanel, self).__init__(parent)
+        self.setMinimumSize(200, 120)
+        self._curves: np.ndarray = None     # (channels, samples) values
+        self._value_range = (0.0, 1.0)
+        self._labels = ("", "")
+
+    def _set_curves(self, curves: np.ndarray, value_range: Tuple[float, float], labels: Tuple[str, str]):
+        self._curves = curves
+        self._value_range = value_range
+        self._labels = labels
+        self.update()
+
+    def clear(self):
+        self._curves = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        if self._curves is None or not self._curves.shape[1]:
+            return
+        rect = self.rect().adjusted(4, 4, -4, -16)
+        low, high = self._value_range
+        samples = self._curves.shape[1]
+        xs = rect.left() + np.arange(samples) * (rect.width() / max(1, samples - 1))
+        colors = CHANNEL_COLORS.get(len(self._curves), CHANNEL_COLORS[1] * len(self._curves))
+        painter.setRenderHint(QPainter.Antialiasing)
+        for curve, color in zip(self._curves, colors):
+            ys = rect.bottom() - (np.nan_to_num(curve, nan=low) - low) * (rect.height() / ((high - low) or 1))
+            path = QPainterPath(QPointF(xs[0], ys[0]))
+            for x, y in zip(xs[1:].tolist(), ys[1:].tolist()):
+                path.lineTo(x, y)
+            painter.setPen(QPen(color, 1))
+            painter.drawPath(path)
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(rect.left(), self.height() - 3, self._labels[0])
+        painter.drawText(self.rect().adjusted(0, 0, -4, -3), Qt.AlignRight | Qt.AlignBottom, self._labels[1])
+
+
+class HistogramPanel(_PlotPanel):
+    """
+    Histogram of the visible region or of the selected ROIs, one curve per channel.
+    """
+    def __init__(self, parent: QWidget=None):
+        super(HistogramPanel, self).__init__(parent)
+        self._log_scale = False
+        self._histogram: np.ndarray = None
+        self._bins = (0.0, 256.0, 256)
+
+    def set_log_scale(self, status: bool):
+        if isinstance(status, bool):
+            self._log_scale = status
+            if self._histogram is not None:
+                self.set_histogram(self._histogram, self._bins)
+        else:
+            raise TypeError("Status must be bool!")
+
+    def set_histogram(self, histogram: np.ndarray, bins: Tuple[float, float, int]):
+        """
+        :param histogram: (channels, bins) counts, see image_analysis.region_histogram()
+        :param bins: (low, high, count) of the bins
+        """
+        self._histogram = histogram
+        self._bins = bins
+        curves = np.log1p(histogram) if self._log_scale else histogram.astype(np.float64)
+        low, high, _ = bins
+        self._set_curves(curves, (0.0, float(curves.max()) if curves.size else 1.0), ("%g" % low, "%g" % high))
+
+
+class ProfilePanel(_PlotPanel):
+    """
+    Values along the profile line, one curve per channel.
+    """
+    def set_profile(self, profile: np.ndarray):
+        """
+        :param profile: (samples, channels) values, see image_analysis.line_profile()
+        """
+        curves = profile.T
+        finite = curves[np.isfinite(curves)]
+        value_range = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+        self._set_curves(curves, value_range, ("%g - %g" % value_range, "%d px" % (len(profile) - 1)))
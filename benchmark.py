@@ -0,0 +1,745 @@
+"""
+Benchmarks of the hot paths of the image viewer, runs headless (QT_QPA_PLATFORM=offscreen).
+
+usage: python benchmark.py [--quick] [--output results.json] [--compare baseline.json]
+
+Results are written as JSON, --compare reports every timing that got slower
+than the baseline by more than --threshold and exits with 1 if there is one.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PySide.QtCore import QEvent, QPointF, QRectF, Qt
+from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsSceneHoverEvent, QGraphicsSceneMouseEvent,
+                          QTransform)
+
+from imageviewer import QImageViewer, RoiType, __version__
+from linked_views import ViewLink
+from image_analysis import RegionHistogram, histogram_bins, line_profile, region_histogram
+import roi_file
+
+# metrics end with one of these, all other fields identify a benchmark case
+METRIC_SUFFIXES = ("_ms", "_bytes", "_count")
+
+
+def measure(func: Callable, repeat: int) -> float:
+    """
+    Mean time of func() in ms.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def make_viewer() -> QImageViewer:
+    viewer = QImageViewer()
+    # synthetic moves come faster than frames, each one is passed to the tool
+    viewer.move_interval = 0
+    viewer.resize(1024, 680)
+    viewer.show()
+    QApplication.processEvents()
+    return viewer
+
+
+def add_matrix(viewer: QImageViewer, count: int):
+    """
+    Add a square-ish matrix of count ROIs.
+    """
+    cols = int(count ** 0.5)
+    rows = -(-count // cols)
+    viewer.add_roi_matrix(RoiType.Rect, rows=rows, cols=cols, dx=25, dy=15, x=20, y=20, width=20, height=10)
+
+
+def roi_viewer(count: int) -> QImageViewer:
+    """
+    A viewer with a square-ish matrix of count ROIs.
+    """
+    viewer = make_viewer()
+    add_matrix(viewer, count)
+    return viewer
+
+
+def mouse_event(event_type: QEvent.Type, x: float, y: float) -> QGraphicsSceneMouseEvent:
+    event = QGraphicsSceneMouseEvent(event_type)
+    event.setScenePos(QPointF(x, y))
+    event.setButton(Qt.LeftButton)
+    return event
+
+
+def send(viewer: QImageViewer, event_type: QEvent.Type, x: float, y: float):
+    """
+    Dispatch a synthetic mouse event to the current tool through the event filter.
+    """
+    viewer.eventFilter(viewer.scene, mouse_event(event_type, x, y))
+
+
+def hover_event(x: float, y: float) -> QGraphicsSceneHoverEvent:
+    event = QGraphicsSceneHoverEvent(QEvent.GraphicsSceneHoverMove)
+    event.setScenePos(QPointF(x, y))
+    return event
+
+
+def bench_set_image(sizes=((640, 480), (1920, 1080), (5472, 3648)), repeat: int=10) -> List[Dict]:
+    """
+    set_image() for gray and color images, by copy and zero copy, and refresh() after a resize.
+    High bit depth and float images also time a change of the window/level.
+    """
+    viewer = make_viewer()
+    results = []
+    for width, height in sizes:
+        images = {"gray_uint8": np.random.randint(0, 256, (height, width), np.uint8),
+                  "bgr_uint8": np.random.randint(0, 256, (height, width, 3), np.uint8),
+                  "bgra_uint8": np.random.randint(0, 256, (height, width, 4), np.uint8),
+                  "gray_uint16": np.random.randint(0, 4096, (height, width), np.uint16),
+                  "gray_int16": np.random.randint(-2048, 2048, (height, width), np.int16),
+                  "depth_float32": np.random.rand(height, width).astype(np.float32) * 10}
+        for kind, image in images.items():
+            for zero_copy in (False, True):
+                if image.dtype != np.uint8 and zero_copy:
+                    continue    # the window/level maps a scaled copy anyway
+                result = {"name": "set_image",
+                          "size": "%dx%d" % (width, height),
+                          "kind": kind,
+                          "zero_copy": zero_copy,
+                          "time_ms": measure(lambda: viewer.set_image(image, zero_copy=zero_copy), repeat),
+                          "refresh_ms": measure(viewer.refresh, repeat)}
+                if image.dtype != np.uint8:
+                    low, high, _ = viewer.get_window_level()
+                    windows = iter([(low, high * 0.5 + low * 0.5, 1.0), (None, None, 2.2)] * repeat)
+                    result["window_ms"] = measure(lambda: viewer.set_window_level(*next(windows)), repeat)
+                    viewer.set_window_level()
+                results.append(result)
+    return results
+
+
+def bench_set_image_async(sizes=((1920, 1080), (5472, 3648)), repeat: int=5) -> List[Dict]:
+    """
+    set_image_async() of BGR images, the GUI thread is only busy with the call and the pixmap swap.
+    """
+    viewer = make_viewer()
+    results = []
+    for width, height in sizes:
+        image = np.random.randint(0, 256, (height, width, 3), np.uint8)
+        for zero_copy in (False, True):
+            call_ms = total_ms = gui_ms = 0.0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                future = viewer.set_image_async(image, zero_copy=zero_copy)
+                call_ms += (time.perf_counter() - start) * 1000
+                while not future.done():
+                    QApplication.processEvents()
+                total_ms += (time.perf_counter() - start) * 1000
+                gui_ms += future.result()["pixmap"] + future.result()["scene"]
+            results.append({"name": "set_image_async",
+                            "size": "%dx%d" % (width, height),
+                            "zero_copy": zero_copy,
+                            "call_ms": call_ms / repeat,
+                            "gui_ms": gui_ms / repeat,
+                            "total_ms": total_ms / repeat})
+    return results
+
+
+def bench_update_region(sizes=((1920, 1080), (5472, 3648)), lines: int=16, repeat: int=10) -> List[Dict]:
+    """
+    A scan advancing by a strip of lines, set_image() of the whole frame versus update_image_region().
+    """
+    viewer = make_viewer()
+    results = []
+    for width, height in sizes:
+        for kind, image in (("bgr_uint8", np.zeros((height, width, 3), np.uint8)),
+                            ("gray_uint16", np.zeros((height, width), np.uint16))):
+            strip = np.random.randint(0, 256, (lines,) + image.shape[1:]).astype(image.dtype)
+            rows = iter(range(10 ** 9))
+
+            def full():
+                y = next(rows) * lines % (height - lines)
+                image[y:y + lines] = strip
+                viewer.set_image(image)
+
+            def region():
+                viewer.update_image_region(0, next(rows) * lines % (height - lines), strip)
+
+            viewer.set_image(image)
+            results.append({"name": "update_region",
+                            "size": "%dx%d" % (width, height),
+                            "kind": kind,
+                            "set_image_ms": measure(full, repeat),
+                            "region_ms": measure(region, repeat)})
+    return results
+
+
+def bench_add_roi_matrix(counts=(1000, 10000, 100000)) -> List[Dict]:
+    results = []
+    for count in counts:
+        viewer = make_viewer()
+        results.append({"name": "add_roi_matrix",
+                        "rois": count,
+                        "time_ms": measure(lambda: add_matrix(viewer, count), 1),
+                        "clear_ms": measure(viewer.clear_roi, 1)})
+    return results
+
+
+def bench_tools(counts=(1000, 10000), repeat: int=20) -> List[Dict]:
+    """
+    Arrow selection, pan and zoom driven by synthetic mouse events through the event filter.
+    """
+    results = []
+    for count in counts:
+        viewer = roi_viewer(count)
+        bounds = viewer.scene.itemsBoundingRect()
+        cx, cy = bounds.center().x(), bounds.center().y()
+
+        def click_background():
+            send(viewer, QEvent.GraphicsSceneMousePress, -100, -100)
+            send(viewer, QEvent.GraphicsSceneMouseRelease, -100, -100)
+
+        def rubber_band():
+            send(viewer, QEvent.GraphicsSceneMousePress, cx - 1000, cy - 1000)
+            send(viewer, QEvent.GraphicsSceneMouseMove, cx - 12, cy - 12)
+            send(viewer, QEvent.GraphicsSceneMouseRelease, cx - 12, cy - 12)
+            click_background()
+
+        viewer._check_button(viewer.btn_arrow)
+        click_ms = measure(click_background, repeat)
+        band_ms = measure(rubber_band, repeat)
+
+        moves = 50
+        viewer._check_button(viewer.btn_pan)
+
+        def pan():
+            send(viewer, QEvent.GraphicsSceneMousePress, cx, cy)
+            for i in range(moves):
+                send(viewer, QEvent.GraphicsSceneMouseMove, cx + i % 2, cy + i % 2)
+            send(viewer, QEvent.GraphicsSceneMouseRelease, cx, cy)
+
+        pan_ms = measure(pan, max(1, repeat // 4)) / moves
+
+        viewer._check_button(viewer.btn_zoom)
+
+        def zoom():
+            send(viewer, QEvent.GraphicsSceneMouseRelease, cx, cy)
+            viewer.zoom_fit()
+
+        zoom_ms = measure(zoom, repeat)
+        results.append({"name": "tools",
+                        "rois": count,
+                        "arrow_click_ms": click_ms,
+                        "arrow_rubber_band_ms": band_ms,
+                        "pan_move_ms": pan_ms,
+                        "zoom_ms": zoom_ms})
+        viewer.clear_roi()
+    return results
+
+
+def bench_event_dispatch(moves: int=1000, repeat: int=5) -> List[Dict]:
+    """
+    Event filter cost of events no tool handles, and a burst of mouse moves coalesced to one per frame.
+    """
+    results = []
+    viewer = make_viewer()
+    events = [hover_event(i % 500, i % 300) for i in range(moves)]
+    for tool_btn in (viewer.btn_arrow, viewer.btn_pan):
+        viewer._check_button(tool_btn)
+        viewer.move_interval = 16
+
+        def hover():
+            for event in events:
+                viewer.eventFilter(viewer.scene, event)
+
+        def burst():
+            # moves within a few ms, as a fast mouse delivers them
+            send(viewer, QEvent.GraphicsSceneMousePress, 100, 100)
+            for i in range(moves // 10):
+                send(viewer, QEvent.GraphicsSceneMouseMove, 100 + i % 20, 100 + i % 20)
+            send(viewer, QEvent.GraphicsSceneMouseRelease, 100, 100)
+
+        before = viewer.get_event_stats()
+        burst_ms = measure(burst, repeat)
+        after = viewer.get_event_stats()
+        results.append({"name": "event_dispatch",
+                        "tool": tool_btn.objectName(),
+                        "hover_event_ms": measure(hover, repeat) / moves,
+                        "burst_ms": burst_ms,
+                        "burst_received_count": (after["received"] - before["received"]) // repeat,
+                        "burst_handled_count": (after["handled"] - before["handled"]) // repeat})
+    return results
+
+
+def bench_pan(counts=(0, 1000, 10000, 50000), moves: int=100) -> List[Dict]:
+    """
+    Pan frames, a mouse move through the pan tool plus a repaint of the viewport, zoomed in 4x.
+    Panning only moves the camera, so move_ms doesn't depend on the number of ROIs. frame_ms of
+    ROI items still grows with the count by the scene lookup of the exposed items, in ROI store
+    mode it doesn't.
+    """
+    results = []
+    image = np.random.randint(0, 256, (1000, 1400, 3), np.uint8)
+    for store_mode in (False, True):
+        for count in counts:
+            viewer = make_viewer()
+            viewer.set_roi_store_mode(store_mode)
+            if count:
+                add_matrix(viewer, count)
+            viewer.set_image(image)
+            viewer.zoom_fit()
+            viewer.view.scale(4, 4)
+            viewer._check_button(viewer.btn_pan)
+            viewport = viewer.view.viewport()
+            center = viewer.view.mapToScene(viewport.rect().center())
+            cx, cy = center.x(), center.y()
+            send(viewer, QEvent.GraphicsSceneMousePress, cx, cy)
+            steps = iter(range(2 * moves))
+
+            def move():
+                # back and forth, the grabbed point stays at (cx, cy)
+                step = 10 if next(steps) % 2 else -10
+                send(viewer, QEvent.GraphicsSceneMouseMove, cx + step, cy + step)
+
+            def frame():
+                move()
+                viewport.repaint()
+
+            results.append({"name": "pan",
+                            "store_mode": store_mode,
+                            "rois": count,
+                            "move_ms": measure(move, moves),
+                            "frame_ms": measure(frame, moves)})
+            send(viewer, QEvent.GraphicsSceneMouseRelease, cx, cy)
+            viewer.clear_roi()
+    return results
+
+
+def bench_instrumentation(counts=(0, 1000), moves: int=50) -> List[Dict]:
+    """
+    Overhead of the instrumentation, pan frames with it disabled and enabled.
+    """
+    results = []
+    for count in counts:
+        viewer = roi_viewer(count) if count else make_viewer()
+        viewer.set_image(np.random.randint(0, 256, (1080, 1920, 3), np.uint8))
+        viewer._check_button(viewer.btn_pan)
+        viewport = viewer.view.viewport()
+        steps = iter(range(10 ** 9))
+
+        def frame():
+            step = 10 if next(steps) % 2 else -10
+            send(viewer, QEvent.GraphicsSceneMousePress, 500, 300)
+            send(viewer, QEvent.GraphicsSceneMouseMove, 500 + step, 300 + step)
+            send(viewer, QEvent.GraphicsSceneMouseRelease, 500 + step, 300 + step)
+            viewport.repaint()
+
+        result = {"name": "instrumentation", "rois": count}
+        for status in (False, True):
+            viewer.set_instrumentation(status)
+            result["%s_frame_ms" % ("enabled" if status else "disabled")] = measure(frame, moves)
+        result["stats_ms"] = measure(viewer.get_perf_stats, 10)
+        viewer.set_instrumentation(False)
+        viewer.clear_roi()
+        results.append(result)
+    return results
+
+
+def bench_zoom_levels(sizes=((1920, 1080), (5472, 3648)), repeat: int=5) -> List[Dict]:
+    """
+    Showing a zoom level resampled from the source image, rendered and from the cache.
+    The level is rendered on a worker, the GUI thread is only busy with the request and the pixmap swap.
+    """
+    viewer = make_viewer()
+    results = []
+    for width, height in sizes:
+        viewer.set_image(np.random.randint(0, 256, (height, width, 3), np.uint8))
+        viewer.zoom_fit()
+        viewer.view.scale(3, 3)
+        call_ms = render_ms = 0.0
+        for _ in range(repeat):
+            viewer._zoom_cache.clear()
+            start = time.perf_counter()
+            viewer._show_zoom_level()
+            call_ms += (time.perf_counter() - start) * 1000
+            while viewer._zoom_rendering is not None:
+                QApplication.processEvents()
+            render_ms += (time.perf_counter() - start) * 1000
+
+        results.append({"name": "zoom_levels",
+                        "size": "%dx%d" % (width, height),
+                        "call_ms": call_ms / repeat,
+                        "render_ms": render_ms / repeat,
+                        "cached_ms": measure(viewer._show_zoom_level, repeat)})
+    return results
+
+
+def bench_linked_views(sizes=((1920, 1080), (5472, 3648)), views: int=2, repeat: int=5) -> List[Dict]:
+    """
+    Showing an image in several views, separate and linked by a ViewLink sharing one cache,
+    and blinking between two images.
+    """
+    results = []
+    for width, height in sizes:
+        images = [np.random.randint(0, 256, (height, width, 3), np.uint8) for _ in range(2)]
+        for linked in (False, True):
+            viewers = [make_viewer() for _ in range(views)]
+            link = ViewLink(viewers) if linked else None
+            positions = iter(range(10 ** 9))
+
+            def show():
+                img = images[next(positions) % 2]
+                for viewer in viewers:
+                    viewer.set_image(img)
+
+            result = {"name": "linked_views",
+                      "size": "%dx%d" % (width, height),
+                      "linked": linked,
+                      "set_image_ms": measure(show, repeat)}
+            if linked:
+                result["conversions_count"] = len(link.cache)
+                link.start_blink(viewers[0], images)
+                result["blink_ms"] = measure(link._blink, repeat)
+                link.stop_blink()
+            results.append(result)
+    return results
+
+
+def bench_analysis(sizes=((1920, 1080), (5472, 3648)), step: int=4, repeat: int=10) -> List[Dict]:
+    """
+    Histogram of a region of half the image size counted over the whole region, moved by a pan
+    step and taken from the cache, a profile along its diagonal, and the cost of a request on the
+    GUI thread with both panels shown.
+    """
+    results = []
+    viewer = make_viewer()
+    viewer.show_histogram(True)
+    viewer.show_profile(True)
+    for width, height in sizes:
+        img = np.random.randint(0, 256, (height, width, 3), np.uint8)
+        region = (width // 4, height // 4, width * 3 // 4, height * 3 // 4)
+        bins = histogram_bins(img, (0, 255))
+        histograms = RegionHistogram()
+        steps = iter(range(10 ** 9))
+
+        def pan():
+            # more positions than cached histograms, so that each step is moved, not cached
+            offset = next(steps) % 50 * step
+            histograms.get(0, img, (region[0] + offset, region[1] + offset,
+                                    region[2] + offset, region[3] + offset), bins)
+
+        pan()
+        viewer.set_image(img)
+        viewer.set_profile_line(*region)
+        results.append({"name": "analysis",
+                        "size": "%dx%d" % (width, height),
+                        "full_ms": measure(lambda: region_histogram(img, region, bins), repeat),
+                        "pan_ms": measure(pan, repeat),
+                        "cached_ms": measure(lambda: histograms.get(0, img, region, bins), repeat),
+                        "profile_ms": measure(lambda: line_profile(img, region), repeat),
+                        "request_ms": measure(viewer._request_analysis, repeat)})
+    viewer.show_histogram(False)
+    viewer.show_profile(False)
+    return results
+
+
+def bench_overlay(sizes=((1920, 1080), (5472, 3648)), patch: int=64, repeat: int=10) -> List[Dict]:
+    """
+    set_overlay() of a label mask and update_overlay() of a patch versus setting the whole mask again.
+    """
+    viewer = make_viewer()
+    results = []
+    for width, height in sizes:
+        viewer.set_image(np.random.randint(0, 256, (height, width, 3), np.uint8))
+        mask = np.random.randint(0, 4, (height, width), np.uint8)
+        colors = [(0, 0, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255)]
+        values = np.random.randint(0, 4, (patch, patch), np.uint8)
+        positions = iter(range(10 ** 9))
+
+        def update_patch():
+            offset = next(positions) * 7 % (min(width, height) - patch)
+            viewer.update_overlay(offset, offset, values)
+
+        def update_full():
+            offset = next(positions) * 7 % (min(width, height) - patch)
+            mask[offset:offset + patch, offset:offset + patch] = values
+            viewer.set_overlay(mask, colors)
+
+        results.append({"name": "overlay",
+                        "size": "%dx%d" % (width, height),
+                        "set_ms": measure(lambda: viewer.set_overlay(mask, colors), repeat),
+                        "update_patch_ms": measure(update_patch, repeat * 10),
+                        "update_full_ms": measure(update_full, repeat)})
+        viewer.clear_overlay()
+    return results
+
+
+def bench_labels(counts=(10, 50, 200), repeat: int=20) -> List[Dict]:
+    """
+    Frames updating every label, QGraphicsTextItems by update_text() versus the label layer.
+    """
+    results = []
+    for count in counts:
+        viewer = make_viewer()
+        viewport = viewer.view.viewport()
+        for i in range(count):
+            position = (10 + 120 * (i % 8), 10 + 20 * (i // 8))
+            viewer.add_text("text%d" % i, "0", position=position)
+            viewer.set_label("label%d" % i, "0", position=position)
+        values = iter(range(10 ** 9))
+
+        def text_frame():
+            value = "%.3f" % next(values)
+            for i in range(count):
+                viewer.update_text("text%d" % i, value)
+            viewport.repaint()
+
+        def label_frame():
+            value = "%.3f" % next(values)
+            for i in range(count):
+                viewer.set_label("label%d" % i, value)
+            viewer.label_layer.flush()
+            viewport.repaint()
+
+        results.append({"name": "labels",
+                        "labels": count,
+                        "text_item_frame_ms": measure(text_frame, repeat),
+                        "label_layer_frame_ms": measure(label_frame, repeat)})
+    return results
+
+
+def bench_roi_paint(count: int=10000, scales=(0.1, 0.5, 1, 4), repeat: int=5) -> List[Dict]:
+    """
+    Repaint of ellipse ROIs at several zoom levels, without item cache and with the device coordinate cache.
+    Zoomed out, the level of detail drops the handles and draws ellipses as rects or points.
+    """
+    results = []
+    viewer = make_viewer()
+    cols = int(count ** 0.5)
+    viewer.add_roi_matrix(RoiType.Ellipse, rows=-(-count // cols), cols=cols, dx=25, dy=15, x=20, y=20,
+                          width=20, height=10)
+    center = viewer.scene.itemsBoundingRect().center()
+    viewport = viewer.view.viewport()
+    for cache_mode, name in ((QGraphicsItem.NoCache, "none"), (QGraphicsItem.DeviceCoordinateCache, "device")):
+        viewer.set_roi_cache_mode(cache_mode)
+        for scale in scales:
+            viewer.view.resetMatrix()
+            viewer.view.scale(scale, scale)
+            viewer.view.centerOn(center)
+            viewport.repaint()     # fills the cache
+            results.append({"name": "roi_paint",
+                            "rois": count,
+                            "cache": name,
+                            "scale": scale,
+                            "repaint_ms": measure(viewport.repaint, repeat)})
+    viewer.clear_roi()
+    return results
+
+
+def bench_roi_transform(counts=(1000, 5000), repeat: int=5) -> List[Dict]:
+    """
+    Moving and aligning all ROIs selected, transform_rois() / align_rois() versus setRect() of each item.
+    """
+    results = []
+    for count in counts:
+        viewer = roi_viewer(count)
+        for roi in viewer._rois:
+            roi.setSelected(True)
+
+        def per_item():
+            for roi in viewer._selected_rois():
+                roi.setRect(roi.rect().translated(3, 2))
+
+        results.append({"name": "roi_transform",
+                        "rois": count,
+                        "per_item_move_ms": measure(per_item, repeat),
+                        "move_ms": measure(lambda: viewer.transform_rois(None, QTransform().translate(3, 2)), repeat),
+                        "align_ms": measure(lambda: viewer.align_rois(None, "left"), repeat),
+                        "distribute_ms": measure(lambda: viewer.distribute_rois(None, "vertical"), repeat)})
+        viewer.clear_roi()
+    return results
+
+
+def bench_roi_io(counts=(1000, 10000)) -> List[Dict]:
+    """
+    save_rois() and load_rois() of the viewer.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "rois.roi")
+        for count in counts:
+            viewer = roi_viewer(count)
+            results.append({"name": "roi_io",
+                            "rois": count,
+                            "save_ms": measure(lambda: viewer.save_rois(path), 1),
+                            "load_ms": measure(lambda: viewer.load_rois(path), 1)})
+            viewer.clear_roi()
+    return results
+
+
+def bench_roi_hit_test(counts=(1000, 10000, 50000), repeat: int=200) -> List[Dict]:
+    """
+    Point and rubber band queries, linear scan over sceneBoundingRect() versus the spatial index.
+    """
+    results = []
+    for count in counts:
+        viewer = roi_viewer(count)
+        rois = list(viewer._rois)
+        bounds = viewer.scene.itemsBoundingRect()
+        points = [(random.uniform(bounds.left(), bounds.right()), random.uniform(bounds.top(), bounds.bottom()))
+                  for _ in range(repeat)]
+        points_iter = iter(points * 2)
+
+        def linear_point():
+            x, y = next(points_iter)
+            point = QRectF(x, y, 0, 0)
+            for roi in rois:
+                if viewer.is_overlap(roi.sceneBoundingRect(), point):
+                    break
+
+        def index_point():
+            viewer._roi_index.query_point(*next(points_iter))
+
+        band = QRectF(bounds.center().x(), bounds.center().y(), 200, 200)
+
+        def linear_rect():
+            return [roi for roi in rois if viewer.is_overlap(roi.sceneBoundingRect(), band)]
+
+        def index_rect():
+            return viewer._roi_index.query_rect(band.left(), band.top(), band.right(), band.bottom())
+
+        results.append({"name": "roi_hit_test",
+                        "rois": count,
+                        "linear_point_ms": measure(linear_point, min(repeat, 20)),
+                        "index_point_ms": measure(index_point, repeat),
+                        "linear_rect_ms": measure(linear_rect, min(repeat, 20)),
+                        "index_rect_ms": measure(index_rect, repeat)})
+        viewer.clear_roi()
+    return results
+
+
+def bench_roi_file(counts=(1000, 10000, 50000), repeat: int=5) -> List[Dict]:
+    """
+    Saving and loading ROIs, the former pickled list of tuples versus the binary ROI file.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        pickle_path = os.path.join(folder, "rois.pickle")
+        binary_path = os.path.join(folder, "rois.roi")
+        for count in counts:
+            records = np.zeros(count, roi_file.RECORD_DTYPE)
+            records["type"] = np.random.randint(0, 2, count)
+            records["x"], records["y"] = np.random.rand(2, count) * 1000
+            records["w"], records["h"] = 20, 10
+            tuples = [(RoiType(int(r["type"])), float(r["x"]), float(r["y"]), int(r["w"]), int(r["h"]))
+                      for r in records]
+
+            def pickle_save():
+                with open(pickle_path, "wb") as f:
+                    pickle.dump(tuples, f)
+
+            def pickle_load():
+                with open(pickle_path, "rb") as f:
+                    pickle.load(f)
+
+            results.append({"name": "roi_file",
+                            "rois": count,
+                            "pickle_save_ms": measure(pickle_save, repeat),
+                            "pickle_load_ms": measure(pickle_load, repeat),
+                            "pickle_bytes": os.path.getsize(pickle_path),
+                            "binary_save_ms": measure(lambda: roi_file.save_rois(binary_path, records), repeat),
+                            "binary_load_ms": measure(lambda: roi_file.load_rois(binary_path), repeat),
+                            "binary_bytes": os.path.getsize(binary_path)})
+    return results
+
+
+def print_results(results: List[Dict]):
+    for result in results:
+        print(", ".join("%s: %.4f" % (k, v) if isinstance(v, float) else "%s: %s" % (k, v)
+                        for k, v in result.items()))
+
+
+def case_key(result: Dict) -> str:
+    return json.dumps({k: v for k, v in result.items() if not k.endswith(METRIC_SUFFIXES)}, sort_keys=True)
+
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    """
+    Timings which are slower than the baseline by more than threshold (0.2 is 20 %).
+    """
+    previous = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            if metric.endswith("_ms") and old.get(metric) and value > old[metric] * (1 + threshold):
+                regressions.append("%s %s: %.4f -> %.4f ms" % (case_key(result), metric, old[metric], value))
+    return regressions
+
+
+def run(quick: bool=False) -> List[Dict]:
+    small = (1000,)
+    results = []
+    for bench, kwargs in ((bench_set_image, {"sizes": ((640, 480), (1920, 1080))} if quick else {}),
+                          (bench_set_image_async, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_update_region, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_add_roi_matrix, {"counts": small} if quick else {}),
+                          (bench_tools, {"counts": small} if quick else {}),
+                          (bench_event_dispatch, {"moves": 200} if quick else {}),
+                          (bench_pan, {"counts": (0, 1000), "moves": 20} if quick else {}),
+                          (bench_instrumentation, {"counts": (0,), "moves": 20} if quick else {}),
+                          (bench_zoom_levels, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_linked_views, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_analysis, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_overlay, {"sizes": ((1920, 1080),)} if quick else {}),
+                          (bench_roi_hit_test, {"counts": small} if quick else {}),
+                          (bench_labels, {"counts": (50,)} if quick else {}),
+                          (bench_roi_paint, {"count": 1000, "scales": (0.5, 2)} if quick else {}),
+                          (bench_roi_transform, {"counts": small} if quick else {}),
+                          (bench_roi_io, {"counts": small} if quick else {}),
+                          (bench_roi_file, {"counts": small} if quick else {})):
+        found = bench(**kwargs)
+        print_results(found)
+        results += found
+    return results
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the image viewer")
+    parser.add_argument("--quick", action="store_true", help="small cases only")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slow down, default 0.2 (20 %%)")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = run(args.quick)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": __version__,
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("slower:", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""
+Window/level mapping of high bit depth and float images to 8 bit for display
+"""
+
+from functools import lru_cache
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+# dtypes which are mapped by a lookup table, float images are mapped arithmetically
+LUT_DTYPES = (np.dtype(np.uint8), np.dtype(np.uint16), np.dtype(np.int16))
+DISPLAY_DTYPES = LUT_DTYPES + (np.dtype(np.float32),)
+
+
+def auto_window(img: np.ndarray) -> Tuple[float, float]:
+    """
+    (min, max) of the image, NaN is ignored.
+    """
+    if img.dtype.kind == "f":
+        low, high = float(np.nanmin(img)), float(np.nanmax(img))
+        if np.isnan(low):
+            return 0.0, 1.0
+        return low, high
+    return float(img.min()), float(img.max())
+
+
+def _map(values: np.ndarray, low: float, high: float, gamma: float) -> np.ndarray:
+    """
+    values <= low to 0, values >= high to 255, in between (normalized ** (1 / gamma)) * 255.
+    An empty window (high <= low, e.g. the automatic window of a constant image) is a step at low.
+    """
+    if high > low:
+        normalized = np.clip((values - np.float32(low)) * np.float32(1.0 / (high - low)), 0, 1)
+    else:
+        normalized = (values > np.float32(low)).astype(np.float32)
+    if gamma != 1:
+        np.power(normalized, np.float32(1 / gamma), out=normalized)
+    # NaN (e.g. missing depth) is shown black
+    return np.nan_to_num(normalized * 255 + 0.5, copy=False).astype(np.uint8)
+
+
+@lru_cache(maxsize=16)
+def window_lut(dtype: str, low: float, high: float, gamma: float) -> np.ndarray:
+    """
+    Lookup table of all values of an integer dtype, 256 entries for uint8, 65536 for 16 bit.
+    Int16 values are indexed by their bits, i.e. by img.view(np.uint16).
+    """
+    dtype = np.dtype(dtype)
+    index_dtype = np.uint8 if dtype.itemsize == 1 else np.uint16
+    values = np.arange(1 << (8 * dtype.itemsize), dtype=np.int64).astype(index_dtype).view(dtype)
+    lut = _map(values.astype(np.float32), low, high, gamma)
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_window(img: np.ndarray, low: float, high: float, gamma: float=1.0) -> np.ndarray:
+    """
+    Map an image to uint8 for display.
+    :param img: uint8, uint16, int16 or float32 image, any number of channels
+    :param low: value shown black
+    :param high: value shown white
+    :param gamma: > 1 brightens the mid tones
+    :return: uint8 image of the same shape
+    """
+    if img.dtype == np.uint8:
+        if (low, high, gamma) == (0, 255, 1):
+            return img
+        return cv2.LUT(img, window_lut(img.dtype.str, low, high, gamma))
+    if img.dtype in LUT_DTYPES:
+        lut = window_lut(img.dtype.str, low, high, gamma)
+        return lut[img.view(np.uint16)]
+    if img.dtype == np.float32:
+        return _map(img, low, high, gamma)
+    raise TypeError("Image must be an 8 or 16 bit integer or a 32 bit float image!")
@@ -0,0 +1,194 @@
+"""
+Live frame stream of the image viewer
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PySide.QtCore import QObject, QTimer
+from PySide.QtGui import QImage
+
+from display_lut import DISPLAY_DTYPES, apply_window, auto_window
+from image_convert import scaled_qimage
+
+Window = Tuple[Optional[float], Optional[float], float]    # (low, high, gamma), None limits are automatic
+
+
+class FrameStream(QObject):
+    """
+    Latest-frame-wins stream from any producer thread to the GUI thread.
+
+    push() only stores the frame in a single slot and wakes the worker thread,
+    which converts and scales it to a QImage. Other than 8 bit frames are scaled
+    in their own dtype and mapped to 8 bit by the window/level, like set_image()
+    does. A timer on the GUI thread hands at most one converted frame per tick
+    to the display callback. Frames that are overwritten before they are
+    converted or displayed are dropped.
+    """
+    def __init__(self, display: Callable[[QImage, np.ndarray, Tuple[float, float]], None],
+                 size: Callable[[], Tuple[int, int]], parent: QObject=None,
+                 window: Callable[[], Window]=None):
+        """
+        :param display: called on the GUI thread with (QImage, frame, automatic window of the frame)
+        :param size: returns the (width, height) the frames are scaled to, called on the GUI thread
+        :param parent:
+        :param window: returns the window/level of the frames, called on the GUI thread
+        """
+        super(FrameStream, self).__init__(parent)
+        self._display = display
+        self._size = size
+        self._window = window if window is not None else lambda: (None, None, 1.0)
+        self._target_size = size()
+        self._target_window = self._window()
+
+        self._condition = threading.Condition()
+        self._pending: Optional[Tuple[np.ndarray, float]] = None
+        self._ready: Optional[Tuple[QImage, np.ndarray, float]] = None
+        self._worker: Optional[threading.Thread] = None
+        self._running = False
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._tick)
+        self.reset_stats()
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def start(self, interval: int=16):
+        """
+        Start the worker and the display timer.
+        :param interval: display timer interval in ms, 16 ms is about once per frame at 60 Hz
+        :return:
+        """
+        if self._running:
+            self._timer.setInterval(interval)
+            return
+        self._running = True
+        self._target_size = self._size()
+        self._target_window = self._window()
+        self._worker = threading.Thread(target=self._convert_loop, name="FrameStream", daemon=True)
+        self._worker.start()
+        self._timer.start(interval)
+
+    def stop(self):
+        """
+        Stop the worker and the display timer, pending frames are discarded.
+        """
+        self._timer.stop()
+        with self._condition:
+            self._running = False
+            self._pending = None
+            self._ready = None
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+
+    def push(self, frame: np.ndarray):
+        """
+        Offer a new frame, thread safe and never blocks on conversion.
+        :param frame: gray scale, BGR or BGRA image of uint8, uint16, int16 or float32
+        :return:
+        """
+        if not isinstance(frame, np.ndarray):
+            raise TypeError("Image must be an openCV image(numpy ndarray)!")
+        if not (frame.ndim == 2 or (frame.ndim == 3 and frame.shape[2] in (3, 4))):
+            raise TypeError("Image must be an openCV image(gray scale, BGR or BGRA)!")
+        if frame.dtype not in DISPLAY_DTYPES:
+            raise TypeError("Image must be an 8 or 16 bit integer or a 32 bit float image!")
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Stream is not started!")
+            self._stats["received"] += 1
+            if self._pending is not None:
+                self._stats["dropped"] += 1
+            self._pending = (frame, time.perf_counter())
+            self._condition.notify()
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats = {"received": 0,
+                           "dropped": 0,
+                           "displayed": 0,
+                           "latency_ms": 0.0,
+                           "mean_latency_ms": 0.0}
+            self._latency_sum = 0.0
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Frame counters and the push to display latency in ms.
+        """
+        with self._condition:
+            return dict(self._stats)
+
+    def _convert_loop(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                frame, pushed = self._pending
+                self._pending = None
+                width, height = self._target_size
+                window = self._target_window
+
+            try:
+                q_image, buffer, auto = self._convert(frame, width, height, window)
+            except TypeError:
+                # a frame which can't be shown is counted as dropped
+                with self._condition:
+                    self._stats["dropped"] += 1
+                continue
+
+            with self._condition:
+                if self._ready is not None:
+                    self._stats["dropped"] += 1
+                self._ready = (q_image, buffer, frame, auto, pushed)
+
+    @staticmethod
+    def _convert(frame: np.ndarray, width: int, height: int,
+                 window: Window) -> Tuple[QImage, np.ndarray, Tuple[float, float]]:
+        """
+        :return: (QImage, buffer, automatic window of the frame)
+        """
+        if frame.dtype == np.uint8 and window == (None, None, 1.0):
+            q_image, buffer = scaled_qimage(frame, width, height)
+            return q_image, buffer, (0.0, 255.0)
+        # scale in the own dtype, the window/level is applied to the scaled frame only
+        im_h, im_w = frame.shape[:2]
+        ratio = min(1.0, width / im_w, height / im_h)
+        if ratio < 1:
+            size = (max(1, round(im_w * ratio)), max(1, round(im_h * ratio)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        auto = auto_window(frame) if frame.dtype != np.uint8 else (0.0, 255.0)
+        low, high, gamma = window
+        display = apply_window(frame, auto[0] if low is None else low, auto[1] if high is None else high, gamma)
+        q_image, buffer = scaled_qimage(display, width, height)
+        return q_image, buffer, auto
+
+    def _tick(self):
+        # the view size can only be read on the GUI thread
+        size = self._size()
+        window = self._window()
+        with self._condition:
+            self._target_size = size
+            self._target_window = window
+            ready = self._ready
+            self._ready = None
+        if ready is None:
+            return
+
+        # the buffer stays referenced while the QImage is displayed
+        q_image, buffer, frame, auto, pushed = ready
+        self._display(q_image, frame, auto)
+
+        latency = (time.perf_counter() - pushed) * 1000
+        with self._condition:
+            self._stats["displayed"] += 1
+            self._stats["latency_ms"] = latency
+            self._latency_sum += latency
+            self._stats["mean_latency_ms"] = self._latency_sum / self._stats["displayed"]
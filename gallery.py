@@ -0,0 +1,299 @@
+"""
+Gallery of image files: a thumbnail strip above an image viewer
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Sequence
+
+import cv2
+import numpy as np
+from PySide.QtCore import Qt, QSize, Signal
+from PySide.QtGui import QIcon, QListView, QListWidget, QListWidgetItem, QPixmap, QVBoxLayout, QWidget
+
+from image_convert import wrap_ndarray
+from display_lut import apply_window, auto_window
+from imageviewer import QImageViewer
+
+IMAGE_EXTENSIONS = (".bmp", ".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+def load_image(path: str) -> np.ndarray:
+    """
+    Decode an image file in its own bit depth, BGR(A) or gray scale.
+    """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise IOError("Can't read image %s!" % path)
+    return img
+
+
+def load_thumbnail(path: str, size: int) -> np.ndarray:
+    """
+    Decode an image file reduced to fit in size x size, as 8 bit BGR.
+    """
+    # JPEG files are decoded at 1/8 of their size directly
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if img is None or max(img.shape[:2]) < size:
+        img = load_image(path)
+    if img.dtype != np.uint8:
+        img = apply_window(img, *auto_window(img))
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    ratio = size / max(img.shape[:2])
+    if ratio < 1:
+        img = cv2.resize(img, (max(1, round(img.shape[1] * ratio)), max(1, round(img.shape[0] * ratio))),
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+
+class FrameCache:
+    """
+    LRU of decoded images bounded by their total number of bytes.
+    """
+    def __init__(self, max_bytes: int=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frames: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key: int):
+        return key in self._frames
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: int) -> np.ndarray:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key: int, frame: np.ndarray):
+        if key in self._frames:
+            self._bytes -= self._frames.pop(key).nbytes
+        self._frames[key] = frame
+        self._bytes += frame.nbytes
+        # the newest frame stays even if it alone exceeds the limit
+        while len(self._frames) > 1 and self._bytes > self.max_bytes:
+            _, old = self._frames.popitem(last=False)
+            self._bytes -= old.nbytes
+
+    def clear(self):
+        self._frames.clear()
+        self._bytes = 0
+
+
+class QImageGallery(QWidget):
+    """
+    Thumbnail strip of image files above a QImageViewer showing the current one.
+
+    Thumbnails and full images are decoded on separate thread pools (openCV releases the GIL),
+    so a long folder of thumbnails doesn't hold up the current image. The prefetch neighbours
+    on each side of the current image are decoded in advance into a FrameCache, so paging
+    through the images shows cached frames at once.
+    """
+    current_changed = Signal(int)
+
+    _thumbnail_ready = Signal(int, int, object)     # generation, index, BGR ndarray or exception
+    _image_ready = Signal(int, int, object)         # generation, index, ndarray or exception
+
+    def __init__(self, *, thumbnail_size: int=96, prefetch: int=2, cache_bytes: int=512 * 1024 * 1024,
+                 workers: int=None, loader: Callable[[str], np.ndarray]=load_image):
+        """
+        :param thumbnail_size: max width and height of thumbnails
+        :param prefetch: number of images before and after the current one which are decoded in advance
+        :param cache_bytes: memory bound of the decoded images
+        :param workers: size of the thread pool decoding full images
+        :param loader: decodes a file to an image accepted by QImageViewer.set_image()
+        """
+        super(QImageGallery, self).__init__()
+        self.thumbnail_size = thumbnail_size
+        self._prefetch = prefetch
+        self._loader = loader
+        self._paths: List[str] = []
+        self._current = -1
+        self._generation = 0
+        self._cache = FrameCache(cache_bytes)
+        self._pending: Dict[int, Future] = {}
+        self._thumbnail_futures: List[Future] = []
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4)
+        self._thumbnail_executor = ThreadPoolExecutor(max_workers=2)
+
+        # layout
+        self.v_box = QVBoxLayout()
+        self.setLayout(self.v_box)
+        self.strip = QListWidget()
+        self.strip.setViewMode(QListView.IconMode)
+        self.strip.setFlow(QListView.LeftToRight)
+        self.strip.setWrapping(False)
+        self.strip.setMovement(QListView.Static)
+        self.strip.setUniformItemSizes(True)
+        self.strip.setIconSize(QSize(thumbnail_size, thumbnail_size))
+        self.strip.setFixedHeight(thumbnail_size + 40)
+        self.v_box.addWidget(self.strip)
+        self.viewer = QImageViewer()
+        self.v_box.addWidget(self.viewer)
+
+        # connections
+        self.strip.currentRowChanged.connect(self.show_index)
+        self._thumbnail_ready.connect(self._on_thumbnail_ready)
+        self._image_ready.connect(self._on_image_ready)
+
+    def set_paths(self, paths: Sequence[str]):
+        """
+        Show a list of image files, the first one is opened.
+        :param paths:
+        :return:
+        """
+        self._generation += 1
+        for future in list(self._pending.values()) + self._thumbnail_futures:
+            future.cancel()
+        self._pending.clear()
+        self._cache.clear()
+        self._paths = list(paths)
+        self._current = -1
+
+        self.strip.blockSignals(True)
+        self.strip.clear()
+        placeholder = QPixmap(self.thumbnail_size, self.thumbnail_size)
+        placeholder.fill(Qt.lightGray)
+        for path in self._paths:
+            item = QListWidgetItem(QIcon(placeholder), os.path.basename(path))
+            item.setToolTip(path)
+            self.strip.addItem(item)
+        self.strip.blockSignals(False)
+
+        generation = self._generation
+        self._thumbnail_futures = [self._thumbnail_executor.submit(self._load_thumbnail, generation, index, path)
+                                   for index, path in enumerate(self._paths)]
+        if self._paths:
+            self.show_index(0)
+
+    def open_folder(self, folder: str, extensions: Sequence[str]=IMAGE_EXTENSIONS):
+        """
+        Show the image files of a folder sorted by name.
+        """
+        names = sorted(name for name in os.listdir(folder) if name.lower().endswith(tuple(extensions)))
+        self.set_paths([os.path.join(folder, name) for name in names])
+
+    def paths(self) -> List[str]:
+        return list(self._paths)
+
+    def current_index(self) -> int:
+        return self._current
+
+    def set_prefetch(self, count: int):
+        """
+        Number of images before and after the current one which are decoded in advance.
+        """
+        if isinstance(count, int) and count >= 0:
+            self._prefetch = count
+            self._schedule_prefetch()
+        else:
+            raise TypeError("Count must be a non negative int!")
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """
+        :return: number and bytes of the cached images, number of pending decodes
+        """
+        return {"images": len(self._cache), "bytes": self._cache.nbytes, "pending": len(self._pending)}
+
+    def next(self):
+        if self._current + 1 < len(self._paths):
+            self.show_index(self._current + 1)
+
+    def previous(self):
+        if self._current > 0:
+            self.show_index(self._current - 1)
+
+    def show_index(self, index: int):
+        """
+        Show the image at index, at once if it is cached, otherwise as soon as it is decoded.
+        """
+        if not 0 <= index < len(self._paths) or index == self._current:
+            return
+        self._current = index
+        if self.strip.currentRow() != index:
+            self.strip.blockSignals(True)
+            self.strip.setCurrentRow(index)
+            self.strip.blockSignals(False)
+        frame = self._cache.get(index)
+        if frame is not None:
+            self.viewer.set_image_async(frame)
+        else:
+            self._request(index)
+        self._schedule_prefetch()
+        self.current_changed.emit(index)
+
+    def _schedule_prefetch(self):
+        if self._current < 0:
+            return
+        wanted = {self._current}
+        for offset in range(1, self._prefetch + 1):
+            wanted.update((self._current - offset, self._current + offset))
+        # drop prefetches which are out of the window now
+        for index in list(self._pending):
+            if index not in wanted and self._pending[index].cancel():
+                del self._pending[index]
+        # nearest first
+        for index in sorted(wanted, key=lambda i: abs(i - self._current)):
+            if 0 <= index < len(self._paths) and index not in self._cache:
+                self._request(index)
+
+    def _request(self, index: int):
+        if index not in self._pending:
+            self._pending[index] = self._executor.submit(self._load_image, self._generation, index,
+                                                         self._paths[index])
+
+    def _load_image(self, generation: int, index: int, path: str):
+        # runs on a worker thread
+        try:
+            result = self._loader(path)
+        except Exception as e:
+            result = e
+        self._image_ready.emit(generation, index, result)
+
+    def _load_thumbnail(self, generation: int, index: int, path: str):
+        # runs on a worker thread
+        try:
+            result = load_thumbnail(path, self.thumbnail_size)
+        except Exception as e:
+            result = e
+        self._thumbnail_ready.emit(generation, index, result)
+
+    def _on_image_ready(self, generation: int, index: int, result):
+        if generation != self._generation:
+            return
+        self._pending.pop(index, None)
+        if isinstance(result, Exception):
+            self.strip.item(index).setText("%s (%s)" % (os.path.basename(self._paths[index]), result))
+            return
+        self._cache.put(index, result)
+        if index == self._current:
+            self.viewer.set_image_async(result)
+
+    def _on_thumbnail_ready(self, generation: int, index: int, result):
+        if generation != self._generation or isinstance(result, Exception):
+            return
+        q_image, buffer, swapped = wrap_ndarray(result)
+        if swapped:
+            q_image = q_image.rgbSwapped()
+        # QPixmap copies the pixels, the buffer isn't needed afterwards
+        self.strip.item(index).setIcon(QIcon(QPixmap.fromImage(q_image)))
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key_PageDown, Qt.Key_Right):
+            self.next()
+            event.accept()
+        elif event.key() in (Qt.Key_PageUp, Qt.Key_Left):
+            self.previous()
+            event.accept()
+        else:
+            super(QImageGallery, self).keyPressEvent(event)
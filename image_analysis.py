@@ -0,0 +1,323 @@
+"""
+Histogram and line profile of the shown image, computed on a worker thread
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PySide.QtCore import QObject, Signal
+
+from roi import RoiType
+from image_convert import StageTimer
+
+Rect = Tuple[int, int, int, int]            # (x0, y0, x1, y1) in image pixels, x1 and y1 exclusive
+Bins = Tuple[float, float, int]             # (low, high, count) of the histogram bins
+
+
+def histogram_bins(img: np.ndarray, window: Tuple[float, float]) -> Bins:
+    """
+    Bins of the histogram of an image, fixed per frame so that histograms of its regions add up.
+    :param window: (min, max) of the image for other than 8 bit images, see display_lut.auto_window()
+    """
+    if img.dtype == np.uint8:
+        return 0.0, 256.0, 256
+    low, high = window
+    if img.dtype.kind in "iu":
+        # one bin per value for small ranges
+        high += 1
+        return low, high, int(min(256, max(1, high - low)))
+    return low, high if high > low else low + 1, 256
+
+
+def _channels(img: np.ndarray) -> int:
+    # the alpha channel of BGRA images is left out
+    return 1 if img.ndim == 2 else min(3, img.shape[2])
+
+
+def _grid(rect: Rect, step: int) -> Rect:
+    """
+    rect with its left and top moved to the next multiple of step, the first counted pixel.
+    """
+    x0, y0, x1, y1 = rect
+    return -(-x0 // step) * step, -(-y0 // step) * step, x1, y1
+
+
+def region_histogram(img: np.ndarray, rect: Rect, bins: Bins, mask: np.ndarray=None, step: int=1) -> np.ndarray:
+    """
+    Histogram of a region of an image, NaN is not counted and values beyond the bins fall into the end bins.
+    :param mask: boolean mask of the counted pixels, only its pixels are counted, see roi_mask()
+    :param step: count only the pixels whose row and column are multiples of step, e.g. of a large image source,
+                 histograms of adjacent regions still add up
+    :return: (channels, bins) int64
+    """
+    x0, y0, x1, y1 = _grid(rect, step)
+    low, high, count = bins
+    channels = _channels(img)
+    result = np.zeros((channels, count), np.int64)
+    if x1 <= x0 or y1 <= y0:
+        return result
+    region = np.asarray(img[y0:y1:step, x0:x1:step])
+    if region.dtype == np.uint8 and count == 256:
+        cv_mask = None if mask is None else mask.view(np.uint8)
+        for c in range(channels):
+            result[c] = cv2.calcHist([region], [c], cv_mask, [256], [0, 256])[:, 0]
+        return result
+
+    scale = count / (high - low)
+    for c in range(channels):
+        values = region if region.ndim == 2 else region[:, :, c]
+        if mask is not None:
+            values = values[mask]
+        values = values.astype(np.float32).ravel()
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        index = np.clip((values - np.float32(low)) * np.float32(scale), 0, count - 1).astype(np.intp)
+        result[c] = np.bincount(index, minlength=count)
+    return result
+
+
+def _subtract(a: Rect, b: Rect) -> List[Rect]:
+    """
+    Rects covering a without b.
+    """
+    ax0, ay0, ax1, ay1 = a
+    bx0, by0, bx1, by1 = b
+    ix0, iy0, ix1, iy1 = max(ax0, bx0), max(ay0, by0), min(ax1, bx1), min(ay1, by1)
+    if ix0 >= ix1 or iy0 >= iy1:
+        return [a]
+    rects = [(ax0, ay0, ax1, iy0), (ax0, iy1, ax1, ay1), (ax0, iy0, ix0, iy1), (ix1, iy0, ax1, iy1)]
+    return [r for r in rects if r[2] > r[0] and r[3] > r[1]]
+
+
+def _area(rect: Rect) -> int:
+    return (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+
+def roi_mask(rect: Rect, rois: Sequence[Tuple[int, float, float, float, float]], step: int=1) -> np.ndarray:
+    """
+    Mask of the pixels of rect inside any of the ROIs, ellipses contain the pixels whose centres
+    are inside like roi_stats.ellipse_mask().
+    :param rois: (RoiType value, x, y, w, h) in image pixels
+    :param step: only the pixels counted by region_histogram() with this step are tested,
+                 the mask has the size of the sampled grid
+    """
+    x0, y0, x1, y1 = _grid(rect, step)
+    cols = np.arange(x0, x1, step)
+    rows = np.arange(y0, y1, step)
+    mask = np.zeros((len(rows), len(cols)), np.bool_)
+    for roi_type, x, y, w, h in rois:
+        rx0, ry0 = int(round(x)), int(round(y))
+        rw, rh = int(round(w)), int(round(h))
+        if rw <= 0 or rh <= 0:
+            continue
+        # the sampled columns and rows inside the ROI
+        c0, c1 = np.searchsorted(cols, [rx0, rx0 + rw])
+        r0, r1 = np.searchsorted(rows, [ry0, ry0 + rh])
+        if c0 >= c1 or r0 >= r1:
+            continue
+        if roi_type == RoiType.Ellipse.value:
+            xx = (cols[c0:c1] - rx0 + 0.5 - rw / 2) / (rw / 2)
+            yy = (rows[r0:r1] - ry0 + 0.5 - rh / 2) / (rh / 2)
+            mask[r0:r1, c0:c1] |= xx[None, :] ** 2 + yy[:, None] ** 2 <= 1
+        else:
+            mask[r0:r1, c0:c1] = True
+    return mask
+
+
+def line_profile(img: np.ndarray, line: Tuple[float, float, float, float]) -> np.ndarray:
+    """
+    Values along a line, bilinearly interpolated at one sample per pixel of its length.
+    :param line: (x0, y0, x1, y1) in image pixels, pixel centres are at integer coordinates
+    :return: (samples, channels) float32
+    """
+    im_h, im_w = img.shape[:2]
+    channels = _channels(img)
+    x0, y0, x1, y1 = line
+    samples = int(np.ceil(np.hypot(x1 - x0, y1 - y0))) + 1
+    xs = np.clip(np.linspace(x0, x1, samples), 0, im_w - 1)
+    ys = np.clip(np.linspace(y0, y1, samples), 0, im_h - 1)
+    # read only the bounding box of the line, which matters for large image sources
+    bx0, by0 = int(xs.min()), int(ys.min())
+    bx1, by1 = min(int(xs.max()) + 2, im_w), min(int(ys.max()) + 2, im_h)
+    region = np.asarray(img[by0:by1, bx0:bx1])
+    if region.ndim == 2:
+        region = region[:, :, None]
+    region = region[:, :, :channels]
+    xs -= bx0
+    ys -= by0
+    xi = np.minimum(xs.astype(np.intp), region.shape[1] - 1)
+    yi = np.minimum(ys.astype(np.intp), region.shape[0] - 1)
+    xn = np.minimum(xi + 1, region.shape[1] - 1)
+    yn = np.minimum(yi + 1, region.shape[0] - 1)
+    fx = (xs - xi).astype(np.float32)[:, None]
+    fy = (ys - yi).astype(np.float32)[:, None]
+    # only the 4 neighbours of each sample are converted to float
+    top = region[yi, xi].astype(np.float32) * (1 - fx) + region[yi, xn].astype(np.float32) * fx
+    bottom = region[yn, xi].astype(np.float32) * (1 - fx) + region[yn, xn].astype(np.float32) * fx
+    return top * (1 - fy) + bottom * fy
+
+
+class RegionHistogram:
+    """
+    Histograms of image regions, cached per frame.
+
+    When the region of a frame moves, e.g. the view is panned, the histogram of the last region
+    is updated by the strips which left and entered the region instead of counting the whole
+    region again. Not thread safe, it is used by one worker.
+    """
+    def __init__(self, size: int=16):
+        """
+        :param size: number of cached histograms
+        """
+        self.size = size
+        self._cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        # (frame, bins): (rect, histogram) of the last region without a mask
+        self._last: Dict[Tuple, Tuple[Rect, np.ndarray]] = {}
+        self.stats = {"cached": 0, "incremental": 0, "full": 0}
+
+    def clear(self):
+        self._cache.clear()
+        self._last.clear()
+
+    def get(self, frame: Hashable, img: np.ndarray, rect: Rect, bins: Bins,
+            mask: np.ndarray=None, mask_key: Hashable=None, step: int=1) -> np.ndarray:
+        """
+        :param frame: key of the image content, changes when the image changes
+        :param mask_key: key of the mask, required with a mask
+        :param step: see region_histogram()
+        :return: see region_histogram(), don't change it
+        """
+        key = (frame, bins, rect, mask_key, step)
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            self.stats["cached"] += 1
+            return result
+
+        last = self._last.get((frame, bins, step)) if mask is None else None
+        if last is not None:
+            last_rect, last_hist = last
+            removed = _subtract(last_rect, rect)
+            added = _subtract(rect, last_rect)
+            if sum(map(_area, removed)) + sum(map(_area, added)) < _area(rect):
+                result = last_hist.copy()
+                for strip in removed:
+                    result -= region_histogram(img, strip, bins, step=step)
+                for strip in added:
+                    result += region_histogram(img, strip, bins, step=step)
+                self.stats["incremental"] += 1
+        if result is None:
+            result = region_histogram(img, rect, bins, mask, step)
+            self.stats["full"] += 1
+
+        if mask is None:
+            # only the latest frame is moved incrementally
+            self._last = {(frame, bins, step): (rect, result)}
+        result.setflags(write=False)
+        self._cache[key] = result
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+        return result
+
+
+class ImageAnalysis(QObject):
+    """
+    Computes the histogram of an image region and a line profile on a worker thread.
+
+    Requests are latest-wins: while a request is computed, newer ones replace each other in a
+    single slot and only the last one is computed next. Results are handed to the display
+    callback on the GUI thread. Histograms are cached per frame, see RegionHistogram, and
+    profiles are cached per frame and line. An exception of the worker is handed to the
+    callback in the "error" of the result.
+    """
+    _computed = Signal(int, object)     # generation, result
+
+    def __init__(self, display: Callable[[Dict], None], parent: QObject=None):
+        """
+        :param display: called on the GUI thread with the result of a request, see request()
+        :param parent:
+        """
+        super(ImageAnalysis, self).__init__(parent)
+        self._display = display
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        pool = self._pool
+        self.destroyed.connect(lambda *args: pool.shutdown(wait=False))
+        self._histograms = RegionHistogram()
+        self._profiles: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._generation = 0
+        self._busy = False
+        self._pending: Optional[Dict] = None
+        self._computed.connect(self._on_computed)
+
+    def request(self, job: Dict):
+        """
+        Compute on the worker, runs on the GUI thread.
+        :param job: "frame": key of the image content,
+                    "image": ndarray or ImageSource, it is read on the worker,
+                    "region": Rect of the histogram or None,
+                    "bins": Bins of the frame,
+                    "step": sampling step of the histogram, see region_histogram(),
+                    "rois": (RoiType value, x, y, w, h) restricting the region or None,
+                    "line": (x0, y0, x1, y1) of the profile or None
+        :return:
+        """
+        if self._busy:
+            self._pending = job
+            return
+        self._busy = True
+        self._pool.submit(self._compute, self._generation, job)
+
+    def cancel(self):
+        """
+        Drop the pending request and the result of a running one, e.g. when the panels are hidden.
+        The caches are keyed by frame, so they need no clearing when the image changes.
+        """
+        self._generation += 1
+        self._pending = None
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: histograms taken from the cache, moved incrementally and counted over the whole region
+        """
+        return dict(self._histograms.stats)
+
+    def _compute(self, generation: int, job: Dict):
+        # runs on the worker thread
+        timer = StageTimer()
+        result = {"frame": job["frame"], "region": job["region"], "bins": job["bins"], "step": job.get("step", 1),
+                  "histogram": None, "line": job["line"], "profile": None, "error": None}
+        try:
+            img, region = job["image"], job["region"]
+            if region is not None:
+                rois = job.get("rois")
+                mask = roi_mask(region, rois, result["step"]) if rois else None
+                result["histogram"] = self._histograms.get(job["frame"], img, region, job["bins"],
+                                                           mask, tuple(rois) if rois else None, result["step"])
+                timer.lap("histogram")
+            if job["line"] is not None:
+                key = (job["frame"], job["line"])
+                profile = self._profiles.get(key)
+                if profile is None:
+                    profile = self._profiles[key] = line_profile(img, job["line"])
+                    while len(self._profiles) > 16:
+                        self._profiles.popitem(last=False)
+                result["profile"] = profile
+                timer.lap("profile")
+        except Exception as e:
+            # e.g. a read error of an image source, the panels keep the last result
+            result["error"] = e
+        result["timings"] = timer.timings
+        self._computed.emit(generation, result)
+
+    def _on_computed(self, generation: int, result):
+        # runs on the GUI thread
+        self._busy = False
+        if self._pending is not None:
+            job, self._pending = self._pending, None
+            self.request(job)
+        if generation != self._generation:
+            return
+        self._display(result)
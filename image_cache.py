@@ -0,0 +1,92 @@
+"""
+Cache of converted images shared by several image viewers
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+
+import numpy as np
+
+from tiles import TileCache
+from zoom_cache import ZoomCache
+
+
+class SharedImageCache:
+    """
+    Conversions, zoom levels and tiles of images shown by several viewers.
+
+    A viewer using the cache (see QImageViewer.set_shared_cache()) looks up the conversion of
+    an image before converting it, so an image shown in several views of the same size is
+    converted and uploaded once and the views share its pixmap. Zoom levels are keyed by an
+    image token, which is the same for an image and window/level in all views, and tiled
+    images share pyramids and tiles. Memory grows with the distinct images, not with the views.
+    Images are identified by object, an image which is changed in place needs forget().
+    """
+    def __init__(self, images: int=8, zoom_levels: int=8, zoom_bytes: int=512 << 20, tile_bytes: int=256 << 20):
+        """
+        :param images: number of distinct images whose conversions are kept
+        :param zoom_levels: number of zoom levels kept for all images
+        :param zoom_bytes: memory bound of the zoom levels
+        :param tile_bytes: memory bound of the tiles of tiled images
+        """
+        self.images = images
+        self.zoom_cache = ZoomCache(zoom_levels, zoom_bytes)
+        self.tile_cache = TileCache(tile_bytes, images)
+        self._states: "OrderedDict[Tuple, Dict]" = OrderedDict()     # (id(image), params): state
+        self._tokens: "OrderedDict[Tuple, Tuple]" = OrderedDict()    # (id(image), window): (image, token)
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, img: np.ndarray, params: Tuple) -> Dict:
+        """
+        :param params: (zero_copy, view size, window) of the conversion
+        :return: the state of a conversion by QImageViewer._convert_image() or None
+        """
+        key = (id(img), params)
+        state = self._states.get(key)
+        # the state references its image, so the id isn't reused while it is kept
+        if state is None or state["image"] is not img:
+            return None
+        self._states.move_to_end(key)
+        return state
+
+    def put(self, state: Dict):
+        """
+        Keep the state of a conversion, its image token is set.
+        """
+        img = state["image"]
+        zero_copy, view_size, window = state["params"]
+        state["token"] = self.token(img, window)
+        self._states[(id(img), state["params"])] = state
+        while len({key[0] for key in self._states}) > self.images:
+            self._states.popitem(last=False)
+
+    def token(self, img: np.ndarray, window: Tuple) -> Hashable:
+        """
+        Key of the zoom levels of an image shown with a window/level.
+        """
+        key = (id(img), window)
+        entry = self._tokens.get(key)
+        if entry is None or entry[0] is not img:
+            entry = self._tokens[key] = (img, object())
+        self._tokens.move_to_end(key)
+        while len(self._tokens) > self.images:
+            self._tokens.popitem(last=False)
+        return entry[1]
+
+    def forget(self, img: np.ndarray):
+        """
+        Drop the conversions of an image, e.g. after it was changed in place.
+        Its zoom levels are not used anymore, they are evicted by newer ones.
+        """
+        for key in [key for key, state in self._states.items() if state["image"] is img]:
+            del self._states[key]
+        for key in [key for key, entry in self._tokens.items() if entry[0] is img]:
+            del self._tokens[key]
+
+    def clear(self):
+        self._states.clear()
+        self._tokens.clear()
+        self.zoom_cache.clear()
+        self.tile_cache.clear()
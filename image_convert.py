@@ -0,0 +1,130 @@
+"""
+Conversion of openCV images (numpy ndarray) to QImage
+"""
+
+import sys
+import time
+from typing import Callable, Dict, Tuple
+
+import cv2
+import numpy as np
+from PySide.QtCore import Qt
+from PySide.QtGui import QImage, qRgb
+
+# formats which only exist in newer Qt versions
+FORMAT_GRAYSCALE8 = getattr(QImage, "Format_Grayscale8", None)
+FORMAT_BGR888 = getattr(QImage, "Format_BGR888", None)
+
+GRAY_COLOR_TABLE = [qRgb(i, i, i) for i in range(256)]
+
+
+class StageTimer:
+    """
+    Collect the elapsed time of consecutive stages in milliseconds.
+    """
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = (now - self._last) * 1000
+        self._last = now
+
+
+def wrap_ndarray(img: np.ndarray) -> Tuple[QImage, np.ndarray, bool]:
+    """
+    Wrap the buffer of an openCV image in a QImage without copying the pixels.
+    The returned buffer must be kept alive as long as the QImage is used.
+    :param img: uint8 gray scale, BGR or BGRA image
+    :return: (QImage, buffer, swapped), swapped means red and blue are still exchanged
+             and rgbSwapped() has to be called on the (scaled) result.
+    """
+    if img.dtype != np.uint8:
+        raise TypeError("Image must be an 8 bit image!")
+    if img.ndim not in (2, 3):
+        raise TypeError("Image must be an openCV image(gray scale, BGR or BGRA)!")
+
+    # QImage only needs contiguous lines, the line stride can be arbitrary
+    if img.strides[-1] != img.itemsize or (img.ndim == 3 and img.strides[1] != img.shape[2]):
+        img = np.ascontiguousarray(img)
+    im_h, im_w = img.shape[:2]
+    bytes_per_line = img.strides[0]
+    swapped = False
+
+    if img.ndim == 2:
+        if FORMAT_GRAYSCALE8 is not None:
+            q_image = QImage(img.data, im_w, im_h, bytes_per_line, FORMAT_GRAYSCALE8)
+        else:
+            q_image = QImage(img.data, im_w, im_h, bytes_per_line, QImage.Format_Indexed8)
+            q_image.setColorTable(GRAY_COLOR_TABLE)
+    elif img.ndim == 3 and img.shape[2] == 3:
+        if FORMAT_BGR888 is not None:
+            q_image = QImage(img.data, im_w, im_h, bytes_per_line, FORMAT_BGR888)
+        else:
+            q_image = QImage(img.data, im_w, im_h, bytes_per_line, QImage.Format_RGB888)
+            swapped = True
+    elif img.ndim == 3 and img.shape[2] == 4:
+        # 0xffRRGGBB is stored as B, G, R, A on little endian machines
+        if sys.byteorder != "little":
+            img = np.ascontiguousarray(img[:, :, ::-1])
+            bytes_per_line = img.strides[0]
+        q_image = QImage(img.data, im_w, im_h, bytes_per_line, QImage.Format_RGB32)
+    else:
+        raise TypeError("Image must be an openCV image(gray scale, BGR or BGRA)!")
+
+    return q_image, img, swapped
+
+
+def scaled_qimage(img: np.ndarray, width: int, height: int,
+                  timer: StageTimer=None) -> Tuple[QImage, np.ndarray]:
+    """
+    Wrap an openCV image and scale it down to fit in width x height.
+    The image is only scaled when it is larger than the given size.
+    :param img: uint8 gray scale, BGR or BGRA image
+    :param width: target width
+    :param height: target height
+    :param timer: optional StageTimer to record "qimage", "scale" and "convert"
+    :return: (QImage, buffer), the buffer must be kept alive as long as the QImage is used
+    """
+    q_image, buffer, swapped = wrap_ndarray(img)
+    if timer:
+        timer.lap("qimage")
+    return fit_qimage(q_image, width, height, swapped, timer), buffer
+
+
+def fit_qimage(q_image: QImage, width: int, height: int, swapped: bool=False, timer: StageTimer=None) -> QImage:
+    """
+    Scale a QImage down to fit in width x height, smaller images keep their size.
+    :param swapped: red and blue are exchanged, they are swapped after scaling
+    :param timer: optional StageTimer to record "scale" and "convert"
+    :return:
+    """
+    if q_image.height() > height or q_image.width() > width:
+        q_image = q_image.scaled(width, height, Qt.KeepAspectRatio)
+    if timer:
+        timer.lap("scale")
+    if swapped:
+        q_image = q_image.rgbSwapped()    # bgr to rgb
+    if timer:
+        timer.lap("convert")
+    return q_image
+
+
+def resized_qimage(img: np.ndarray, width: int, height: int,
+                   display: Callable[[np.ndarray], np.ndarray]=None) -> Tuple[QImage, np.ndarray]:
+    """
+    Resample an openCV image to width x height with area interpolation and wrap the result.
+    :param img: gray scale, BGR or BGRA image, uint8 unless display is given
+    :param display: maps the resampled image to uint8, e.g. a window/level
+    :return: (QImage, buffer), the buffer must be kept alive as long as the QImage is used
+    """
+    im_h, im_w = img.shape[:2]
+    interpolation = cv2.INTER_AREA if width <= im_w and height <= im_h else cv2.INTER_LINEAR
+    resized = cv2.resize(np.asarray(img), (width, height), interpolation=interpolation)
+    if display is not None:
+        resized = display(resized)
+    q_image, buffer, swapped = wrap_ndarray(resized)
+    if swapped:
+        q_image = q_image.rgbSwapped()
+    return q_image, buffer
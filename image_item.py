@@ -0,0 +1,63 @@
+"""
+Pixmap item whose pixels can be changed in place
+"""
+
+from PySide.QtCore import Qt, QRectF
+from PySide.QtGui import QGraphicsItem, QImage, QPainter, QPixmap
+
+
+def paint_image(pix_map: QPixmap, x: int, y: int, image: QImage):
+    """
+    Replace the pixels of a pixmap at (x, y) by image, alpha included.
+    """
+    painter = QPainter(pix_map)
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    painter.drawImage(x, y, image)
+    painter.end()
+
+
+class ImagePixmapItem(QGraphicsItem):
+    """
+    Shows a QPixmap like QGraphicsPixmapItem, but keeps the QPixmap object it is given.
+
+    QGraphicsPixmapItem holds its own copy, so painting into the pixmap detaches a full copy
+    and setPixmap() repaints the whole item. paint_region() paints into the pixmap held here
+    and repaints only the changed rect, it updates the shown image and overlay regions.
+    """
+    def __init__(self, parent: QGraphicsItem=None):
+        super(ImagePixmapItem, self).__init__(parent)
+        self._pixmap = QPixmap()
+        self._mode = Qt.FastTransformation
+
+    def pixmap(self) -> QPixmap:
+        return self._pixmap
+
+    def setPixmap(self, pix_map: QPixmap):
+        if pix_map.size() != self._pixmap.size():
+            self.prepareGeometryChange()
+        self._pixmap = pix_map
+        self.update()
+
+    def transformationMode(self) -> Qt.TransformationMode:
+        return self._mode
+
+    def setTransformationMode(self, mode: Qt.TransformationMode):
+        if mode != self._mode:
+            self._mode = mode
+            self.update()
+
+    def paint_region(self, x: int, y: int, image: QImage):
+        """
+        Replace the pixels of the pixmap at (x, y) by image and repaint only that rect.
+        """
+        paint_image(self._pixmap, x, y, image)
+        self.update(QRectF(x, y, image.width(), image.height()))
+
+    def boundingRect(self):
+        return QRectF(self._pixmap.rect())
+
+    def paint(self, painter, option, widget=None):
+        if self._pixmap.isNull():
+            return
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self._mode == Qt.SmoothTransformation)
+        painter.drawPixmap(0, 0, self._pixmap)
@@ -0,0 +1,164 @@
+"""
+Lazily read image sources for images larger than memory
+"""
+
+import os
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+
+class ImageSource:
+    """
+    Pixel source which is read region by region.
+
+    A source looks like a read only 2-D (gray scale) or 3-D (BGR/BGRA) ndarray:
+    it has shape and dtype and can be sliced by source[rows, cols], which only
+    reads the requested region. New formats subclass ImageSource, implement
+    shape, dtype and read_region() and are added by register_source().
+    Writable sources implement writable and write_region() as well.
+    """
+    shape: Tuple[int, ...] = ()
+    dtype = np.dtype(np.uint8)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def read_region(self, rows: slice, cols: slice) -> np.ndarray:
+        """
+        Read a region of the image.
+        :param rows: slice of rows, the step may be larger than 1
+        :param cols: slice of columns, the step may be larger than 1
+        :return: ndarray of the region
+        """
+        raise NotImplementedError
+
+    @property
+    def writable(self) -> bool:
+        return False
+
+    def write_region(self, rows: slice, cols: slice, patch: np.ndarray):
+        """
+        Write a region of the image, e.g. through to the file.
+        :param rows: slice of rows with step 1
+        :param cols: slice of columns with step 1
+        :param patch: pixels of the region
+        """
+        raise TypeError("Image source is read only!")
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = key[0] if len(key) > 0 else slice(None)
+        cols = key[1] if len(key) > 1 else slice(None)
+        if not isinstance(rows, slice) or not isinstance(cols, slice):
+            raise TypeError("Image sources can only be sliced!")
+        region = self.read_region(rows, cols)
+        if len(key) > 2:
+            region = region[(slice(None), slice(None)) + key[2:]]
+        return region
+
+
+class MemmapSource(ImageSource):
+    """
+    Source backed by a memory mapped (or any other sliceable) array.
+    Only the pages of the sliced regions are read from disk.
+    """
+    def __init__(self, array: np.ndarray):
+        if array.ndim not in (2, 3):
+            raise TypeError("Image must be gray scale or color!")
+        self._array = array
+        self.shape = array.shape
+        self.dtype = np.dtype(array.dtype)
+
+    @classmethod
+    def from_npy(cls, path: str, mode: str="r"):
+        """
+        :param mode: "r" or "r+" to write changed regions through to the file
+        """
+        return cls(np.load(path, mmap_mode=mode))
+
+    @classmethod
+    def from_raw(cls, path: str, shape: Tuple[int, ...], dtype=np.uint8, offset: int=0, mode: str="r"):
+        """
+        :param path: file of headerless pixels in row major order
+        :param shape: (height, width) or (height, width, channels)
+        :param dtype: pixel type
+        :param offset: size of a header to skip in bytes
+        :param mode: "r" or "r+" to write changed regions through to the file
+        """
+        return cls(np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=tuple(shape)))
+
+    def read_region(self, rows: slice, cols: slice) -> np.ndarray:
+        return np.asarray(self._array[rows, cols])
+
+    @property
+    def writable(self) -> bool:
+        # zarr arrays have no flags, they are opened read only
+        flags = getattr(self._array, "flags", None)
+        return flags is not None and flags.writeable
+
+    def write_region(self, rows: slice, cols: slice, patch: np.ndarray):
+        if not self.writable:
+            raise TypeError("Image source is read only!")
+        self._array[rows, cols] = patch
+
+
+class TiffSource(MemmapSource):
+    """
+    Source of the first page of a TIFF file, requires tifffile.
+    Uncompressed files are memory mapped, others are read chunk by chunk through zarr.
+    """
+    def __init__(self, path: str):
+        try:
+            import tifffile
+        except ImportError:
+            raise ImportError("tifffile is required to read TIFF files!")
+
+        try:
+            array = tifffile.memmap(path, mode="r")
+        except ValueError:
+            # compressed or tiled file, can't be memory mapped
+            import zarr
+            store = tifffile.imread(path, aszarr=True)
+            array = zarr.open(store, mode="r")
+            if not hasattr(array, "shape"):
+                # pyramid files give a group, take the full resolution level
+                array = array[0]
+        super(TiffSource, self).__init__(array)
+
+
+_openers: Dict[str, Callable[..., ImageSource]] = {".npy": MemmapSource.from_npy,
+                                                   ".raw": MemmapSource.from_raw,
+                                                   ".tif": TiffSource,
+                                                   ".tiff": TiffSource}
+
+
+def register_source(extension: str, opener: Callable[..., ImageSource]):
+    """
+    Register an opener for files with the given extension.
+    :param extension: file extension including the dot, e.g. ".npy"
+    :param opener: called with the file path and the keyword arguments of open_source()
+    :return:
+    """
+    _openers[extension.lower()] = opener
+
+
+def open_source(path: str, **kwargs) -> ImageSource:
+    """
+    Open an image file as a lazily read source.
+    :param path: image file
+    :param kwargs: passed to the opener, e.g. shape and dtype of raw files
+    :return:
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        opener = _openers[extension]
+    except KeyError:
+        raise TypeError("No image source registered for %s files!" % extension)
+    return opener(path, **kwargs)
@@ -7,28 +7,79 @@ Required Modules: PySide, numpy, openCV(3.2)
 Author: Leo Cai
 """
 
-from typing import List, Dict, Tuple, Set
-import pickle
+import math
+import numbers
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Hashable, List, Dict, Iterable, Tuple, Set, Union
 
 import cv2
 import numpy as np
 from PySide.QtGui import *
-from PySide.QtCore import Qt, QEvent, QPointF, QRectF
+from PySide.QtCore import Qt, QEvent, QPointF, QRectF, QTimer, Signal
 
 from ui_imageviewer import ImageViewerUI
 from roi import RoiType, QGraphicsRoiItem
+from image_convert import StageTimer, wrap_ndarray, fit_qimage, resized_qimage
+from image_item import paint_image
+from frame_stream import FrameStream
+from tiles import TiledImageItem, TilePyramid
+from image_source import ImageSource, open_source
+from spatial_index import GridIndex
+from roi_store import RoiStore, RoiBatchItem
+from roi_stats import roi_statistics
+from labels import LabelLayer
+from overlay import Colormap, OverlayItem, colormap_lut
+from image_analysis import ImageAnalysis, histogram_bins
+from perf_stats import PerfStats
+from display_lut import DISPLAY_DTYPES, auto_window, apply_window
+from zoom_cache import ZoomCache, zoom_step, step_scale
+from image_cache import SharedImageCache
+import roi_file
 
 __version__ = "0.1"
 
+# ROI items, an array of ROI store ids or None for the selected ROIs
+RoiSelection = Union[Iterable[QGraphicsRoiItem], np.ndarray, None]
+
 
 class QImageViewer(ImageViewerUI):
+    zoom_range = (1 / 64, 64)   # limits of the view scale
+    zoom_settle_time = 150      # ms without zooming until the image is resampled
+    resize_settle_time = 100    # ms without resizing until the image is scaled to the new view size
+    stats_interval = 500        # ms between two stats_updated signals while instrumented
+    move_interval = 16          # ms, mouse moves reach the tool at most once per interval, 0 passes every move
+
+    stats_updated = Signal(object)      # dict of get_perf_stats()
+    view_changed = Signal()             # the view was panned or zoomed
+    analysis_updated = Signal(object)   # dict of get_analysis()
+
+    _image_converted = Signal(int, object, object)     # generation, future, (state, timer) or exception
+    _zoom_rendered = Signal(object, int, object)        # image token, width, (QImage, buffer) or exception
+
     def __init__(self):
         super(QImageViewer, self).__init__()
         # data parameters
         self._image = np.array([])
+        self._image_buffer = None   # keeps the buffer of a wrapped image alive
+        self._converted: Tuple[QImage, bool] = None     # full size QImage of _image and if it is rgb swapped
+        # window/level of the display, None is the min/max of the image for other than 8 bit images
+        self._window: Tuple[float, float, float] = (None, None, 1.0)
+        self._auto_window = (0.0, 255.0)
+        self._fitted: np.ndarray = None     # _image scaled to the view before the window is applied
+        self._zero_copy = False
+        self._tiled = False
+        self._ingest_timings: Dict[str, float] = {}
         self._roi_color: Qt.GlobalColor = Qt.green
         self._rois: Set[QGraphicsRectItem] = set()
         self._duplicated_rois: Set[QGraphicsRectItem] = set()
+        self._roi_index = GridIndex()   # scene bounding rects of self._rois
+        # ROI store mode, only the selected ROIs are items in self._rois
+        self._store_mode = False
+        self._roi_store = RoiStore()
+        self._roi_cache_mode = QGraphicsItem.NoCache
         self._texts: Dict[str, QGraphicsTextItem] = {}
 
         # GUI parameters
@@ -48,18 +99,119 @@ class QImageViewer(ImageViewerUI):
                            "y": 0,
                            "rect": QGraphicsRectItem(0, 0, 0, 0)}
 
+        # tiled backend for large images, drawn below the pixmap item
+        self.tile_item = TiledImageItem()
+        self.tile_item.setZValue(-1)
+        self.scene.addItem(self.tile_item)
+        self.view.horizontalScrollBar().valueChanged.connect(self._update_tiles)
+        self.view.verticalScrollBar().valueChanged.connect(self._update_tiles)
+
+        # draws the ROIs of the store
+        self.roi_batch_item = RoiBatchItem(self._roi_store)
+        self.scene.addItem(self.roi_batch_item)
+
+        # plain text labels for high frequency updates, above the ROIs
+        self.label_layer = LabelLayer()
+        self.label_layer.setZValue(1)
+        self.scene.addItem(self.label_layer)
+
+        # colour mapped mask over the image, sampled at the display resolution of the image
+        self.overlay_item = OverlayItem()
+        self.overlay_group.addToGroup(self.overlay_item)
+
+        # smooth zoom, the image is resampled from the source for the zoom level when zooming settles
+        self._base_pixmap = QPixmap()   # the image as scaled by set_image()
+        self._image_token = object()    # key of the zoom levels of the shown image
+        self._zoom_cache = ZoomCache()
+        self._shared: SharedImageCache = None
+        self._zoom_settle = QTimer(self)
+        self._zoom_settle.setSingleShot(True)
+        self._zoom_settle.setInterval(self.zoom_settle_time)
+        self._zoom_settle.timeout.connect(self._show_zoom_level)
+        self.view.viewport().setAttribute(Qt.WA_AcceptTouchEvents)
+        self.view.viewport().grabGesture(Qt.PinchGesture)
+        self.view.viewport().installEventFilter(self)
+
+        # resize events are coalesced, only the last one scales the image
+        self._resize_settle = QTimer(self)
+        self._resize_settle.setSingleShot(True)
+        self._resize_settle.setInterval(self.resize_settle_time)
+        self._resize_settle.timeout.connect(self._apply_resize)
+
+        # set_image_async(), images are converted on workers and swapped in on the GUI thread
+        self._image_pool = ThreadPoolExecutor(max_workers=2)
+        self._image_generation = 0
+        self._pending_image: Future = None
+        self._image_converted.connect(self._on_image_converted)
+        # zoom levels are rendered on the same pool, one at a time
+        self._zoom_rendering: Tuple[Hashable, int] = None
+        self._zoom_rendered.connect(self._on_zoom_rendered)
+
+        # instrumentation, timings are only recorded while enabled
+        self._perf = PerfStats()
+        self.view.stats = self._perf
+        self._stats_timer = QTimer(self)
+        self._stats_timer.setInterval(self.stats_interval)
+        self._stats_timer.timeout.connect(self._emit_stats)
+        self.hud_item = QGraphicsSimpleTextItem()
+        self.hud_item.setFlag(QGraphicsItem.ItemIgnoresTransformations)
+        self.hud_item.setBrush(QColor(255, 255, 0))
+        self.hud_item.setVisible(False)
+        self.overlay_group.addToGroup(self.hud_item)
+        self.view.horizontalScrollBar().valueChanged.connect(self._place_hud)
+        self.view.verticalScrollBar().valueChanged.connect(self._place_hud)
+        self.view.horizontalScrollBar().valueChanged.connect(self.view_changed)
+        self.view.verticalScrollBar().valueChanged.connect(self.view_changed)
+
+        # live stream, frames are converted on a worker thread and shown by a timer
+        self._stream = FrameStream(self._show_frame, lambda: (self.view.width(), self.view.height()), self,
+                                   lambda: self._window)
+
+        # histogram and profile panels, computed on a worker while shown
+        self._analysis = ImageAnalysis(self._show_analysis, self)
+        self._analysis_result: Dict = None
+        self._show_histogram = False
+        self._show_profile = False
+        self._frame_serial = 0      # changes with the image content, keys the analysis caches
+        self._frame_image = None
+        self._profile_line: Tuple[float, float, float, float] = None     # in image pixels
+        self.profile_line_item = QGraphicsLineItem()
+        line_pen = QPen(QColor(255, 255, 0))
+        line_pen.setCosmetic(True)
+        self.profile_line_item.setPen(line_pen)
+        self.profile_line_item.setVisible(False)
+        self.overlay_group.addToGroup(self.profile_line_item)
+        self.view_changed.connect(self._request_analysis)
+        self.scene.selectionChanged.connect(self._request_analysis)
+
         # tool function dict
         self._tool_function = {"Arrow": self._arrow,
                                "Rect": lambda *args: self._draw_roi(RoiType.Rect, *args),
                                "Ellipse": lambda *args: self._draw_roi(RoiType.Ellipse, *args),
+                               "Line": self._draw_profile_line,
                                "Zoom": self.zoom,
                                "Fit": self.zoom_fit,
                                "Pan": self._pan}
 
+        # scene events dispatched to the tools, other events pass through the event filter at once
+        tool_events = (QEvent.GraphicsSceneMousePress, QEvent.GraphicsSceneMouseMove,
+                       QEvent.GraphicsSceneMouseRelease)
+        self._event_handlers = {(tool, event_type): self._tool_function[tool]
+                                for tool in ("Arrow", "Rect", "Ellipse", "Line", "Zoom", "Pan")
+                                for event_type in tool_events}
+        self._event_counts = {"received": 0, "handled": 0, "coalesced": 0}
+        # mouse moves are coalesced, the latest one is delivered by the timer
+        self._pending_move: Tuple[str, Callable, QGraphicsSceneMouseEvent] = None
+        self._last_move = 0.0
+        self._move_timer = QTimer(self)
+        self._move_timer.setSingleShot(True)
+        self._move_timer.timeout.connect(self._flush_move)
+
         # checkable
         self._checkable_btns = {"Arrow": self.btn_arrow,
                                 "Rect": self.btn_rect,
                                 "Ellipse": self.btn_ellipse,
+                                "Line": self.btn_line,
                                 "Zoom": self.btn_zoom,
                                 "Pan": self.btn_pan}
 
@@ -71,6 +223,7 @@ class QImageViewer(ImageViewerUI):
         self.btn_arrow.clicked.connect(lambda: self._check_button(self.btn_arrow))
         self.btn_rect.clicked.connect(lambda: self._check_button(self.btn_rect))
         self.btn_ellipse.clicked.connect(lambda: self._check_button(self.btn_ellipse))
+        self.btn_line.clicked.connect(lambda: self._check_button(self.btn_line))
         self.btn_zoom.clicked.connect(lambda: self._check_button(self.btn_zoom))
         self.btn_pan.clicked.connect(lambda: self._check_button(self.btn_pan))
         self.btn_zoom_fit.clicked.connect(self.zoom_fit)
@@ -78,23 +231,27 @@ class QImageViewer(ImageViewerUI):
     def resizeEvent(self, event):
         """
         Reset Image when window is resized.
+        Resizing is debounced, the image is scaled once when no resize came for resize_settle_time.
         :param event:
         :return:
         """
-        self.zoom_fit()
-        self.refresh()
+        self._resize_settle.start()
         event.accept()
 
     def changeEvent(self, event):
         """
-        Reset Image when window is changed.
+        Reset Image when the window state is changed (maximized, minimized, ...).
         :param event:
         :return:
         """
-        self.zoom_fit()
-        # self.refresh()
+        if event.type() == QEvent.WindowStateChange:
+            self._resize_settle.start()
         event.accept()
 
+    def _apply_resize(self):
+        self.refresh()
+        self.zoom_fit()
+
     def keyPressEvent(self, event):
         if not event.isAutoRepeat():
             if event.key() == Qt.Key_Space:
@@ -135,24 +292,75 @@ class QImageViewer(ImageViewerUI):
                     self.view.viewport().setCursor(self.zoom_in_cursor)
 
             elif event.key() == Qt.Key_Delete:
-                selected_rois = set()
-                for i, item in enumerate(self._rois):
-                    if item.isSelected():
-                        selected_rois.add(item)
-                self.remove_rois(selected_rois)
+                self.remove_rois(set(self._selected_rois()))
         else:
             event.ignore()
 
     def eventFilter(self, obj, event):
-        super(QGraphicsScene, self.scene).eventFilter(obj, event)
+        event_type = event.type()
         if obj is self.scene:
-            modifiers = QApplication.keyboardModifiers()
-            try:
-                self._tool_function[self._current_tool](event, modifiers)
-            except KeyError:
-                pass
+            self._event_counts["received"] += 1
+            if event_type == QEvent.GraphicsSceneWheel:
+                # wheel zoom works with every tool
+                self._dispatch("Wheel", self._wheel_zoom, event)
+                return True
+            handler = self._event_handlers.get((self._current_tool, event_type))
+            if handler is None:
+                return False
+            if event_type == QEvent.GraphicsSceneMouseMove:
+                self._coalesce_move(self._current_tool, handler, event)
+            else:
+                # a press or release comes after the moves before it
+                self._flush_move()
+                self._dispatch(self._current_tool, handler, event)
+            return False
+        if event_type == QEvent.Gesture and obj is self.view.viewport():
+            return self._pinch_zoom(event)
         return QWidget.eventFilter(self, obj, event)
 
+    def _dispatch(self, tool: str, handler: Callable, event: QEvent):
+        start = time.perf_counter() if self._perf.enabled else None
+        handler(event, event.modifiers())
+        self._event_counts["handled"] += 1
+        if start is not None:
+            self._perf.record_tool(tool, (time.perf_counter() - start) * 1000)
+
+    def _coalesce_move(self, tool: str, handler: Callable, event: QGraphicsSceneMouseEvent):
+        """
+        Pass a mouse move to the tool at once if none was passed within move_interval,
+        otherwise keep it until the interval is over, a later move replaces it.
+        """
+        elapsed = (time.perf_counter() - self._last_move) * 1000
+        if self._pending_move is None and elapsed >= self.move_interval:
+            self._last_move = time.perf_counter()
+            self._dispatch(tool, handler, event)
+            return
+        if self._pending_move is not None:
+            self._event_counts["coalesced"] += 1
+        # the event is deleted after the filter returns, keep a copy
+        move = QGraphicsSceneMouseEvent(QEvent.GraphicsSceneMouseMove)
+        move.setScenePos(event.scenePos())
+        move.setScreenPos(event.screenPos())
+        move.setButtons(event.buttons())
+        move.setModifiers(event.modifiers())
+        self._pending_move = (tool, handler, move)
+        if not self._move_timer.isActive():
+            self._move_timer.start(max(0, round(self.move_interval - elapsed)))
+
+    def _flush_move(self):
+        self._move_timer.stop()
+        if self._pending_move is not None:
+            tool, handler, move = self._pending_move
+            self._pending_move = None
+            self._last_move = time.perf_counter()
+            self._dispatch(tool, handler, move)
+
+    def get_event_stats(self) -> Dict[str, int]:
+        """
+        :return: scene events received by the event filter, passed to a tool and mouse moves dropped by coalescing
+        """
+        return dict(self._event_counts)
+
     @staticmethod
     def is_overlap(rect1: QRectF, rect2: QRectF):
         if rect1.x() + rect1.width() > rect2.x() and\
@@ -184,7 +392,7 @@ class QImageViewer(ImageViewerUI):
             for item in self._rois:
                 item.set_mutable(status)
 
-            if self._current_tool == "Rect" or self._current_tool == "Ellipse":
+            if self._current_tool in ("Rect", "Ellipse", "Line"):
                 cursor = Qt.CrossCursor
             elif self._current_tool == "Zoom":
                 cursor = self.zoom_in_cursor
@@ -204,14 +412,13 @@ class QImageViewer(ImageViewerUI):
             pos = event.scenePos()
             if modifier == Qt.ControlModifier:
 
-                if not any([roi.isSelected() for roi in self._rois]):
-                    for roi in self._rois:
-                        if self.is_overlap(roi.sceneBoundingRect(), QRectF(pos.x(), pos.y(), 0, 0)):
-                            roi.setSelected(True)
-                            break
+                if not self._selected_rois():
+                    for roi in self._rois_at(pos):
+                        roi.setSelected(True)
+                        break
 
                 self._duplicated_rois = self._duplicate_roi()
-                for roi in self._rois:
+                for roi in self._selected_rois():
                     roi.setSelected(False)
                     roi.set_show_handle(False)
 
@@ -221,11 +428,7 @@ class QImageViewer(ImageViewerUI):
 
             else:
                 # to check if mouse pressed in an ROI
-                is_in_roi = False
-                for roi in self._rois:
-                    is_in_roi = self.is_overlap(roi.sceneBoundingRect(), QRectF(pos.x(), pos.y(), 0, 0))
-                    if is_in_roi:
-                        break
+                is_in_roi = bool(self._rois_at(pos))
 
                 if not is_in_roi:
                     # trigger the selecting mode if not in roi
@@ -259,33 +462,152 @@ class QImageViewer(ImageViewerUI):
 
                 if self._selecting["x"] == end_point.x() and self._selecting["y"] == end_point.y():
                     # deselect all rois when click mouse in background
-                    for roi in self._rois:
+                    for roi in self._selected_rois():
                         roi.setSelected(False)
                         roi.set_show_handle(False)
                         roi.update()
 
                 else:
-                    for roi in self._rois:
-                        if self.is_overlap(roi.sceneBoundingRect(), self._selecting["rect"].rect()):
-                            # overlapped means selected roi
-                            roi.setSelected(True)
-                            roi.set_show_handle(True)
-                        else:
-                            # not selected
+                    rect = self._selecting["rect"].rect()
+                    # overlapped means selected roi
+                    selected = self._roi_index.query_rect(rect.left(), rect.top(), rect.right(), rect.bottom())
+                    if self._store_mode:
+                        ids = self._roi_store.query_rect(rect.left(), rect.top(), rect.right(), rect.bottom(),
+                                                         self._roi_margin())
+                        selected.update(self._promote_rois(ids))
+                    for roi in self._selected_rois():
+                        if roi not in selected:
                             roi.setSelected(False)
                             roi.set_show_handle(False)
-
-                        # repaint roi
+                            roi.update()
+                    for roi in selected:
+                        roi.setSelected(True)
+                        roi.set_show_handle(True)
                         roi.update()
 
+            else:
+                # selected rois may have been dragged
+                for roi in self._selected_rois():
+                    self._index_roi(roi)
+
             self._selecting["flag"] = False
             self._rois = self._rois | self._duplicated_rois
 
             for roi in self._duplicated_rois:
                 roi.setSelected(False)
                 roi.set_show_handle(False)
+                roi.geometry_changed = self._index_roi
+                self._index_roi(roi)
             self._duplicated_rois = set()
 
+            if self._store_mode:
+                # only selected rois stay interactive
+                self._demote_rois([roi for roi in self._rois if not roi.isSelected()])
+
+    def _selected_rois(self) -> List[QGraphicsRoiItem]:
+        return [item for item in self.scene.selectedItems() if item in self._rois]
+
+    @staticmethod
+    def _roi_margin() -> float:
+        # sceneBoundingRect() of an roi is larger than its rect by the handles
+        return QGraphicsRoiItem.handleSize + QGraphicsRoiItem.handleSpace
+
+    def _rois_at(self, pos: QPointF) -> List[QGraphicsRoiItem]:
+        """
+        ROI items under pos, in store mode the stored ROIs under pos are made interactive.
+        """
+        rois = self._roi_index.query_point(pos.x(), pos.y())
+        if not rois and self._store_mode:
+            ids = self._roi_store.query_point(pos.x(), pos.y(), self._roi_margin())
+            rois = self._promote_rois(ids[-1:])
+        return rois
+
+    def _promote_rois(self, ids) -> List[QGraphicsRoiItem]:
+        """
+        Create interactive items for the stored ROIs of ids, the rows are hidden from the batch item.
+        """
+        store = self._roi_store
+        rows = store.data[store.rows(ids)]
+        result = self._add_roi_items(roi_file.to_records(rows))
+        for roi, roi_id in zip(result, rows["id"].tolist()):
+            roi.store_id = roi_id
+        store.set_selected(rows["id"], True)
+        self.roi_batch_item.store_changed()
+        return result
+
+    def _demote_rois(self, rois: List[QGraphicsRoiItem]):
+        """
+        Write the geometry of ROI items back to the store and remove the items.
+        """
+        if not rois:
+            return
+        store = self._roi_store
+        for roi in rois:
+            rect = roi.rect().translated(roi.pos())
+            color = roi.pen().color().rgba()
+            store_id = getattr(roi, "store_id", None)
+            row = store.rows(store_id) if store_id is not None else []
+            if not len(row):
+                # a new item, or its row was removed from the store
+                store.add(roi.roi_type, rect.x(), rect.y(), rect.width(), rect.height(), color)
+                continue
+            data = store.data
+            data["x"][row] = rect.x()
+            data["y"][row] = rect.y()
+            data["w"][row] = rect.width()
+            data["h"][row] = rect.height()
+            data["color"][row] = color
+            data["selected"][row] = False
+        store.touch()
+        self._remove_roi_items(set(rois))
+        self.roi_batch_item.store_changed()
+
+    def set_roi_store_mode(self, status: bool):
+        """
+        Keep ROIs in a NumPy structured array instead of one item per ROI.
+        Not selected ROIs are drawn by a single batch item, only selected ROIs are interactive items.
+        add_roi() returns the ROI id instead of the item in store mode.
+        :param status:
+        :return:
+        """
+        if not isinstance(status, bool):
+            raise TypeError("Status must be bool!")
+        if status == self._store_mode:
+            return
+        self._store_mode = status
+        if status:
+            self._demote_rois(list(self._rois))
+        else:
+            for roi in self._promote_rois(self._roi_store.data["id"]):
+                # the items own their ROIs again
+                roi.store_id = None
+            self._roi_store.clear()
+            self.roi_batch_item.store_changed()
+
+    def set_roi_cache_mode(self, mode: QGraphicsItem.CacheMode):
+        """
+        Cache mode of the ROI items, e.g. QGraphicsItem.DeviceCoordinateCache caches each painted
+        ROI in a pixmap at the cost of memory. Whether it pays off depends on the paint engine and
+        the zoom, see bench_roi_paint() of benchmark.py.
+        :param mode: QGraphicsItem.NoCache (default), ItemCoordinateCache or DeviceCoordinateCache
+        :return:
+        """
+        if mode not in (QGraphicsItem.NoCache, QGraphicsItem.ItemCoordinateCache,
+                        QGraphicsItem.DeviceCoordinateCache):
+            raise TypeError("Mode must be a QGraphicsItem.CacheMode!")
+        self._roi_cache_mode = mode
+        with self._bulk_scene_update():
+            for roi in self._rois:
+                roi.setCacheMode(mode)
+
+    def _index_roi(self, roi: QGraphicsRoiItem):
+        """
+        Update the spatial index after an ROI is moved or resized.
+        ROIs call this when their rect changes, dragged ROIs are updated on mouse release.
+        """
+        rect = roi.sceneBoundingRect()
+        self._roi_index.insert(roi, (rect.left(), rect.top(), rect.right(), rect.bottom()))
+
     def _draw_roi(self, roi_type: RoiType, *args):
         event = args[0]
         # self.view.viewport().setCursor(Qt.CrossCursor)
@@ -293,7 +615,7 @@ class QImageViewer(ImageViewerUI):
 
         if event.type() == QEvent.GraphicsSceneMousePress:
             pos = event.scenePos()
-            drawing_roi = self.add_roi(roi_type, pos.x(), pos.y(), 0, 0)
+            drawing_roi = self._add_roi_item(roi_type, pos.x(), pos.y(), 0, 0)
             self._drawing["flag"] = True
             self._drawing["x"] = pos.x()
             self._drawing["y"] = pos.y()
@@ -308,6 +630,27 @@ class QImageViewer(ImageViewerUI):
 
                 drawing_roi.setRect(x0, y0, width, height)
 
+        elif event.type() == QEvent.GraphicsSceneMouseRelease:
+            self._drawing["flag"] = False
+            if self._store_mode:
+                self._demote_rois([drawing_roi])
+
+    def _draw_profile_line(self, *args):
+        event = args[0]
+        pos = event.scenePos()
+        ox, oy, sx, sy = self._scene_to_image()
+        x, y = (pos.x() - ox) * sx, (pos.y() - oy) * sy
+
+        if event.type() == QEvent.GraphicsSceneMousePress:
+            self._drawing["flag"] = True
+            self._drawing["x"] = x
+            self._drawing["y"] = y
+            self.set_profile_line(x, y, x, y)
+
+        elif event.type() == QEvent.GraphicsSceneMouseMove:
+            if self._drawing["flag"]:
+                self.set_profile_line(self._drawing["x"], self._drawing["y"], x, y)
+
         elif event.type() == QEvent.GraphicsSceneMouseRelease:
             self._drawing["flag"] = False
 
@@ -323,6 +666,7 @@ class QImageViewer(ImageViewerUI):
                                             roi.sceneBoundingRect().y(),
                                             roi.rect().width(),
                                             roi.rect().height())
+                roi_copy.setCacheMode(self._roi_cache_mode)
                 self.scene.addItem(roi_copy)
                 result.add(roi_copy)
         return result
@@ -340,15 +684,9 @@ class QImageViewer(ImageViewerUI):
 
         elif event.type() == QEvent.GraphicsSceneMouseMove:
             if self._panning["flag"]:
+                # keep the scene point grabbed on press under the cursor, only the camera moves
                 pos = event.scenePos()
-                dx = pos.x() - self._panning['x']
-                dy = pos.y() - self._panning['y']
-                self.pix_map_item.moveBy(dx, dy)
-                self.text_group.moveBy(dx, dy)
-                for item in self._rois:
-                    item.moveBy(dx, dy)
-                self._panning["x"] = pos.x()
-                self._panning["y"] = pos.y()
+                self._scroll_by(pos.x() - self._panning["x"], pos.y() - self._panning["y"])
 
         elif event.type() == QEvent.GraphicsSceneMouseRelease:
             self._panning["flag"] = False
@@ -364,59 +702,1022 @@ class QImageViewer(ImageViewerUI):
 
         if event.type() == QEvent.GraphicsSceneMouseRelease:
             factor = 1 / 1.2 if modifiers == Qt.AltModifier else 1.2
-            self.view.scale(factor, factor)
-            pos = event.scenePos()
-            self.view.centerOn(pos.x(), pos.y())
+            self._zoom_by(factor, event.scenePos(), anchored=False)
+
+    def _wheel_zoom(self, event, *args):
+        self._zoom_by(1.2 ** (event.delta() / 120), event.scenePos())
+        event.accept()
+
+    def _pinch_zoom(self, event) -> bool:
+        pinch = event.gesture(Qt.PinchGesture)
+        if pinch is None:
+            return False
+        viewport = self.view.viewport()
+        pos = self.view.mapToScene(viewport.mapFromGlobal(pinch.centerPoint().toPoint()))
+        self._zoom_by(pinch.scaleFactor(), pos)
+        event.accept()
+        return True
+
+    def _zoom_by(self, factor: float, pos: QPointF, anchored: bool=True):
+        """
+        Scale the view by factor.
+        The image is drawn fast while zooming and resampled from the source when zooming settles,
+        a zoom level which is still in the cache is shown at once.
+        :param pos: scene point which stays under the cursor if anchored, otherwise it is centered
+        :param anchored:
+        :return:
+        """
+        scale = self.view.transform().m11()
+        low, high = self.zoom_range
+        if (factor > 1 and scale * factor > high) or (factor < 1 and scale * factor < low):
+            return
+        view_pos = self.view.mapFromScene(pos)
+        self.view.scale(factor, factor)
+        self._update_scene_rect(pos)
+        if anchored:
+            # scroll pos from the center back to the cursor
+            delta = self.view.mapFromScene(pos) - view_pos
+            self.view.horizontalScrollBar().setValue(self.view.horizontalScrollBar().value() + delta.x())
+            self.view.verticalScrollBar().setValue(self.view.verticalScrollBar().value() + delta.y())
+        if not self._show_zoom_level(cached_only=True):
+            self._set_smooth(False)
+            self._zoom_settle.start()
+        self._update_tiles()
+        self.view_changed.emit()
+
+    def get_view_state(self) -> Tuple[float, float, float]:
+        """
+        :return: (zoom, x, y), view pixels per image pixel and the image point in the center of the view
+        """
+        ox, oy, sx, sy = self._scene_to_image()
+        center = self.view.mapToScene(self.view.viewport().rect().center())
+        return self.view.transform().m11() / sx, (center.x() - ox) * sx, (center.y() - oy) * sy
+
+    def set_view_state(self, zoom: float, x: float, y: float):
+        """
+        Zoom and pan the view, e.g. to the state of another view showing an image of the same size.
+        :param zoom: view pixels per image pixel
+        :param x: image point shown in the center of the view
+        :param y:
+        :return:
+        """
+        ox, oy, sx, sy = self._scene_to_image()
+        low, high = self.zoom_range
+        scale = min(max(zoom * sx, low), high)
+        self.view.setTransform(QTransform.fromScale(scale, scale))
+        self._update_scene_rect(QPointF(x / sx + ox, y / sy + oy))
+        if not self._show_zoom_level(cached_only=True):
+            self._set_smooth(False)
+            self._zoom_settle.start()
+        self._update_tiles()
+
+    def _show_zoom_level(self, cached_only: bool=False) -> bool:
+        """
+        Show the image resampled for the current zoom, levels are cached by pixmap width.
+        The whole image is resampled, not only the visible part, so panning a level needs no
+        resampling. A level which isn't cached is rendered on a worker, the current pixmap stays
+        shown until it is swapped in. Levels are capped at the source resolution and at the bytes
+        of the zoom cache, beyond them the pixels are magnified by the view.
+        :param cached_only: don't render a level which isn't cached
+        :return: False if the level isn't cached and cached_only
+        """
+        base = self._base_pixmap
+        if base.isNull() or not self._image.size or self._stream.is_running():
+            return True
+        im_h, im_w = self._image.shape[:2]
+        scale = self.view.transform().m11()
+        # widest level of 4 bytes per pixel the zoom cache holds
+        max_width = int(math.sqrt(self._zoom_cache.max_bytes / 4 * im_w / im_h))
+        width = min(im_w, max_width, round(base.width() * step_scale(zoom_step(scale))))
+        if width <= base.width():
+            pix_map = base
+        else:
+            pix_map = self._zoom_cache.get((self._image_token, width))
+            if pix_map is None:
+                if not cached_only:
+                    self._render_zoom_level(width, max(1, round(width * im_h / im_w)))
+                return False
+        self.pix_map_item.setPixmap(pix_map)
+        self.pix_map_item.setScale(base.width() / pix_map.width())
+        # smooth when the view scales the pixmap down, sharp source pixels when it magnifies
+        self._set_smooth(scale * self.pix_map_item.scale() < 1)
+        return True
+
+    def _render_zoom_level(self, width: int, height: int):
+        """
+        Resample the image to width x height on a worker, see _on_zoom_rendered().
+        """
+        key = (self._image_token, width)
+        if self._zoom_rendering == key:
+            return
+        self._zoom_rendering = key
+        img = self._image
+        # the window in effect now, the worker doesn't read the viewer
+        window = self.get_window_level() if self._fitted is not None else None
+        display = partial(apply_window, low=window[0], high=window[1], gamma=window[2]) if window else None
+
+        def render():
+            try:
+                result = resized_qimage(img, width, height, display)
+            except Exception as e:
+                result = e
+            self._zoom_rendered.emit(key[0], width, result)
+
+        self._image_pool.submit(render)
+
+    def _on_zoom_rendered(self, token: Hashable, width: int, result):
+        # runs on the GUI thread
+        if self._zoom_rendering == (token, width):
+            self._zoom_rendering = None
+        if isinstance(result, Exception) or token is not self._image_token:
+            # e.g. out of memory, the level isn't shown, or the image changed meanwhile
+            return
+        self._zoom_cache.put((token, width), QPixmap.fromImage(result[0]))
+        # show it unless the zoom changed meanwhile, a level still zooming is rendered when it settles
+        self._show_zoom_level(cached_only=self._zoom_settle.isActive())
+
+    def _set_smooth(self, status: bool):
+        self.pix_map_item.setTransformationMode(Qt.SmoothTransformation if status else Qt.FastTransformation)
+
+    def _set_base_pixmap(self, pix_map: QPixmap, token: Hashable=None) -> bool:
+        """
+        Show a newly converted image, cached zoom levels are dropped unless the cache is shared.
+        :param token: key of the zoom levels of the image, see SharedImageCache.token(), default is a new one
+        :return: True if the size of the image in the scene changed
+        """
+        old_size = self._image_rect().size()
+        self._base_pixmap = pix_map
+        self._image_token = token if token is not None else object()
+        if self._shared is None:
+            self._zoom_cache.clear()
+        self.pix_map_item.setScale(1)
+        self.pix_map_item.setPixmap(pix_map)
+        self._relayout_overlay()
+        return self._image_rect().size() != old_size
 
     def zoom_fit(self, *args):
         self.setFocus()
         self.view.resetMatrix()
-        self.pix_map_item.setPos(0, 0)
-        self.text_group.setPos(0, 0)
+        image_rect = self._image_rect()
+        if self.tile_item.pyramid() is not None:
+            # the tiled image is in source pixels, fit it into the view
+            self.view.fitInView(image_rect, Qt.KeepAspectRatio)
+        self._update_scene_rect(image_rect.center())
+        self._zoom_settle.stop()
+        self._show_zoom_level()
+        self._update_tiles()
+        self.view_changed.emit()
+
+    def _image_rect(self) -> QRectF:
+        if self.tile_item.pyramid() is not None:
+            return self.tile_item.sceneBoundingRect()
+        return self.pix_map_item.sceneBoundingRect()
+
+    def _update_scene_rect(self, center: QPointF=None):
+        """
+        Let the view scroll over the image grown by the viewport size on each side,
+        so that the camera can pan the image anywhere in the view.
+        :param center: scene point shown in the center of the view, default is the current center
+        :return:
+        """
+        viewport = self.view.viewport().rect()
+        if center is None:
+            center = self.view.mapToScene(viewport.center())
+        transform = self.view.transform()
+        mx = viewport.width() / transform.m11()
+        my = viewport.height() / transform.m22()
+        self.view.setSceneRect(self._image_rect().adjusted(-mx, -my, mx, my))
+        self.view.centerOn(center)
+
+    def _scroll_by(self, dx: float, dy: float):
+        """
+        Move the camera so that the scene moves by (dx, dy) scene units in the view.
+        """
+        transform = self.view.transform()
+        h_bar = self.view.horizontalScrollBar()
+        v_bar = self.view.verticalScrollBar()
+        h_bar.setValue(h_bar.value() - round(dx * transform.m11()))
+        v_bar.setValue(v_bar.value() - round(dy * transform.m22()))
 
     def refresh(self):
-        if self._image.any():
+        """
+        Scale the current image to the view again, the converted QImage is reused.
+        """
+        if self.tile_item.pyramid() is not None:
+            # tiles don't depend on the view size
+            self._update_tiles()
+        elif self._stream.is_running():
+            pass    # the next frame is scaled to the new size
+        elif self._converted is not None:
+            im, swapped = self._converted
+            pix_map = QPixmap.fromImage(fit_qimage(im, self.view.width(), self.view.height(), swapped))
+            resized = self._set_base_pixmap(pix_map)
+            self._update_scene_rect(self._image_rect().center() if resized else None)
+            self._zoom_settle.start()
+        elif self._image.size:
             self.set_image(self._image)
 
+    def _update_tiles(self, *args):
+        if self.tile_item.pyramid() is not None:
+            self.tile_item.update_visible(self.view)
+
+    def _scene_to_image(self) -> Tuple[float, float, float, float]:
+        """
+        Mapping from scene to image pixel coordinates: image = (scene - (ox, oy)) * (sx, sy)
+        :return: (ox, oy, sx, sy)
+        """
+        if self.tile_item.pyramid() is not None:
+            pos = self.tile_item.pos()
+            return pos.x(), pos.y(), 1.0, 1.0
+        rect = self.pix_map_item.sceneBoundingRect()
+        if self.pix_map_item.pixmap().isNull() or not self._image.size:
+            return rect.x(), rect.y(), 1.0, 1.0
+        # the pixmap may be scaled down to the view
+        return rect.x(), rect.y(), self._image.shape[1] / rect.width(), self._image.shape[0] / rect.height()
+
+    def roi_statistics(self, rois: Iterable[QGraphicsRoiItem]=None, *, workers: int=None) -> np.ndarray:
+        """
+        Count, sum, mean, std, min and max of the image pixels inside ROIs, computed in one batched pass.
+        Multi channel images give per channel values.
+        :param rois: ROI items, default is all ROIs: the items of the viewer followed by the rows of the ROI store
+        :param workers: size of a thread pool used for large ROI counts
+        :return: structured array (see roi_stats.stats_dtype), one row per ROI in the order above,
+                 x, y, w and h are the clipped ROI bounds in image pixels
+        """
+        records = self._roi_records(rois)
+        types = records["type"]
+        rects = np.column_stack((records["x"], records["y"], records["w"], records["h"]))
+
+        ox, oy, sx, sy = self._scene_to_image()
+        rects -= (ox, oy, 0, 0)
+        rects *= (sx, sy, sx, sy)
+        if not self._image.size or not len(rects):
+            return roi_statistics(np.zeros((0, 0), np.uint8), types, rects)
+
+        # only the region covered by the ROIs is read, which matters for large image sources
+        im_h, im_w = self._image.shape[:2]
+        x0 = int(np.clip(np.floor(rects[:, 0].min()), 0, im_w))
+        y0 = int(np.clip(np.floor(rects[:, 1].min()), 0, im_h))
+        x1 = int(np.clip(np.ceil((rects[:, 0] + rects[:, 2]).max()) + 1, x0, im_w))
+        y1 = int(np.clip(np.ceil((rects[:, 1] + rects[:, 3]).max()) + 1, y0, im_h))
+        region = np.asarray(self._image[y0:y1, x0:x1])
+        rects -= (x0, y0, 0, 0)
+        result = roi_statistics(region, types, rects, workers)
+        result["x"] += x0
+        result["y"] += y0
+        return result
+
     def get_image(self):
-        # return the current image.
+        # return the current image, an ImageSource if the image was opened from a file.
         return self._image
 
-    def set_image(self, img: np.ndarray):
-        if isinstance(img, np.ndarray):
+    def open_image(self, path: str, **kwargs):
+        """
+        Open an image file lazily and show it tiled, see image_source.open_source().
+        :param path: .npy, .raw, .tif/.tiff or any registered file type
+        :param kwargs: opener arguments, e.g. shape and dtype for raw files
+        :return:
+        """
+        self.set_image(open_source(path, **kwargs))
+
+    @staticmethod
+    def _check_image(img: Union[np.ndarray, ImageSource]):
+        if isinstance(img, (np.ndarray, ImageSource)):
             shape = img.shape
-            if len(shape) == 2:
-                # gray scale image
-                self._image = img
-                im = cv2.cvtColor(self._image, code=cv2.COLOR_GRAY2RGB)
-            elif len(shape) == 3 and (shape[2] == 3):
-                # color image
-                self._image = img
-                im = img
-            else:
-                raise TypeError("Image must be an openCV image(gray scale or BGR)!")
+            if not (len(shape) == 2 or (len(shape) == 3 and shape[2] in (3, 4))):
+                raise TypeError("Image must be an openCV image(gray scale, BGR or BGRA)!")
+            if img.dtype not in DISPLAY_DTYPES:
+                raise TypeError("Image must be an 8 or 16 bit integer or a 32 bit float image!")
         else:
             raise TypeError("Image must be an openCV image(numpy ndarray)!")
 
-        # cv2 image to QImage
-        im_h, im_w, _ = im.shape
-        bytes_per_line = im_w*3
-        im = QImage(im.data, im_w, im_h, bytes_per_line, QImage.Format_RGB888).rgbSwapped()   # bgr to rgb
-        # QImage to QPixmap
-        pix_map = QPixmap.fromImage(im)
+    def set_image(self, img: Union[np.ndarray, ImageSource], *, zero_copy: bool=None, tiled: bool=None):
+        """
+        Show an openCV image in the view.
+        :param img: gray scale, BGR or BGRA image of uint8, uint16, int16 or float32.
+                    Other than 8 bit images are mapped to 8 bit by the window/level, see set_window_level().
+                    An ImageSource is always shown tiled and only the visible regions are read.
+        :param zero_copy: wrap the ndarray buffer instead of copying it, see set_zero_copy()
+        :param tiled: show the image by a tiled pyramid in full resolution, see set_tiled()
+        :return:
+        """
+        zero_copy = self._zero_copy if zero_copy is None else zero_copy
+        tiled = self._tiled if tiled is None else tiled
+        timer = StageTimer()
+        if isinstance(img, ImageSource):
+            tiled = True
+        self._check_image(img)
+        self._cancel_pending_image()
+
+        if tiled:
+            self._image = img
+            self._set_tiled_image(img)
+            self._frame_changed()
+            timer.lap("pyramid")
+            self._set_ingest_timings(timer.timings)
+            return
+
+        view_size = (self.view.width(), self.view.height())
+        state = self._cached_state(img, (zero_copy, view_size, self._window))
+        if state is None:
+            state = self._convert_image(img, zero_copy, view_size, self._window, timer)
+            if self._shared is not None:
+                self._shared.put(state)
+        self._show_converted(state, timer)
+        self._set_ingest_timings(timer.timings)
+
+    def set_image_async(self, img: Union[np.ndarray, ImageSource], *, zero_copy: bool=None) -> Future:
+        """
+        Like set_image(), but the conversion and scaling run on a worker thread,
+        only swapping in the pixmap runs on the GUI thread.
+        A newer set_image() or set_image_async() supersedes a pending request, its future is cancelled.
+        Tiled images are shown at once, their tiles are built on workers anyway.
+        :param img: see set_image()
+        :param zero_copy: see set_image(), the ndarray must not be changed until the future is done
+        :return: Future of the ingest timings, done when the image is shown
+        """
+        zero_copy = self._zero_copy if zero_copy is None else zero_copy
+        self._check_image(img)
+        future = Future()
+        if self._tiled or isinstance(img, ImageSource):
+            self.set_image(img, zero_copy=zero_copy)
+            future.set_result(self._ingest_timings)
+            return future
+
+        self._cancel_pending_image()
+        view_size = (self.view.width(), self.view.height())
+        window = self._window
+        state = self._cached_state(img, (zero_copy, view_size, window))
+        if state is not None:
+            # converted for a linked view already
+            timer = StageTimer()
+            self._show_converted(state, timer)
+            self._set_ingest_timings(timer.timings)
+            future.set_result(timer.timings)
+            return future
+        self._pending_image = future
+        generation = self._image_generation
+
+        def convert():
+            if future.cancelled():
+                return
+            timer = StageTimer()
+            try:
+                result = (self._convert_image(img, zero_copy, view_size, window, timer), timer)
+            except Exception as e:
+                result = e
+            if not future.cancelled():
+                self._image_converted.emit(generation, future, result)
+
+        self._image_pool.submit(convert)
+        return future
+
+    def _cancel_pending_image(self):
+        self._image_generation += 1
+        if self._pending_image is not None:
+            self._pending_image.cancel()
+            self._pending_image = None
+
+    def _on_image_converted(self, generation: int, future: Future, result):
+        # runs on the GUI thread
+        if generation != self._image_generation or future.cancelled():
+            return
+        self._pending_image = None
+        if isinstance(result, Exception):
+            future.set_exception(result)
+            return
+        state, timer = result
+        timer.lap("queued")
+        try:
+            if self._shared is not None:
+                self._shared.put(state)
+            self._show_converted(state, timer)
+        except Exception as e:
+            # e.g. the pixmap can't be allocated, waiting callers get the error instead of hanging
+            future.set_exception(e)
+            return
+        self._set_ingest_timings(timer.timings)
+        future.set_result(timer.timings)
+
+    def _cached_state(self, img: np.ndarray, params: Tuple) -> Dict:
+        if self._shared is None:
+            return None
+        return self._shared.get(img, params)
+
+    def set_shared_cache(self, cache: SharedImageCache=None):
+        """
+        Share conversions, pixmaps, zoom levels and tiles with other viewers using the same cache,
+        see SharedImageCache. None gives the viewer caches of its own again.
+        :param cache:
+        :return:
+        """
+        if cache is not None and not isinstance(cache, SharedImageCache):
+            raise TypeError("Cache must be a SharedImageCache or None!")
+        self._shared = cache
+        self._zoom_cache = cache.zoom_cache if cache is not None else ZoomCache()
+        self.tile_item.set_cache(cache.tile_cache if cache is not None else None)
+        self._image_token = object()
+
+    @staticmethod
+    def _convert_image(img: np.ndarray, zero_copy: bool, view_size: Tuple[int, int],
+                       window: Tuple[float, float, float], timer: StageTimer) -> Dict:
+        """
+        Convert an image to a QImage scaled to fit in view_size.
+        Doesn't touch the viewer, so it can run on a worker thread.
+        :return: the image, the view sized QImage and what the viewer keeps of the conversion
+        """
+        view_w, view_h = view_size
+        shape = img.shape
+        state = {"image": img, "converted": None, "fitted": None, "auto_window": (0.0, 255.0), "buffer": None,
+                 "params": (zero_copy, view_size, window)}
+        if img.dtype != np.uint8 or window != (None, None, 1.0):
+            # scale in the own dtype, the window/level is applied to the scaled image only
+            if img.dtype != np.uint8:
+                state["auto_window"] = auto_window(img)
+            timer.lap("range")
+            im_h, im_w = shape[:2]
+            ratio = min(1.0, view_w / im_w, view_h / im_h)
+            if ratio < 1:
+                size = (max(1, round(im_w * ratio)), max(1, round(im_h * ratio)))
+                fitted = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            else:
+                fitted = img
+            state["fitted"] = fitted
+            timer.lap("scale")
+            display = apply_window(fitted, *QImageViewer._resolve_window(window, state["auto_window"]))
+            timer.lap("window")
+            im, state["buffer"], swapped = wrap_ndarray(display)
+            if swapped:
+                im = im.rgbSwapped()
+        elif zero_copy:
+            # wrap the buffer and scale first, so that only view sized copies are made
+            im, state["buffer"], swapped = wrap_ndarray(img)
+            state["converted"] = (im, swapped)
+            timer.lap("qimage")
+            im = fit_qimage(im, view_w, view_h, swapped, timer)
+        else:
+            # bgr to rgb by openCV, which releases the GIL on a worker thread unlike rgbSwapped()
+            im = QImageViewer._to_rgb(img)
+            timer.lap("convert")
+
+            # cv2 image to QImage
+            im_h, im_w = shape[:2]
+            bytes_per_line = im_w*3
+            state["buffer"] = im
+            im = QImage(im.data, im_w, im_h, bytes_per_line, QImage.Format_RGB888)
+            state["converted"] = (im, False)
+            timer.lap("qimage")
 
-        # scale
-        view_w, view_h = self.view.width(), self.view.height()
-        if im_h > view_h or im_w > view_w:
             # only auto scale when image is larger than view
-            pix_map = pix_map.scaled(view_w, view_h, Qt.KeepAspectRatio)
+            im = fit_qimage(im, view_w, view_h)
+            timer.lap("scale")
+        state["q_image"] = im
+        return state
 
-        # update image in the view
-        self.pix_map_item.setPixmap(pix_map)
+    @staticmethod
+    def _to_rgb(img: np.ndarray) -> np.ndarray:
+        if img.ndim == 2:
+            return cv2.cvtColor(img, code=cv2.COLOR_GRAY2RGB)
+        if img.shape[2] == 4:
+            return cv2.cvtColor(img, code=cv2.COLOR_BGRA2RGB)
+        return cv2.cvtColor(img, code=cv2.COLOR_BGR2RGB)
+
+    def _show_converted(self, state: Dict, timer: StageTimer):
+        """
+        Swap in an image converted by _convert_image(), runs on the GUI thread.
+        """
+        if self.tile_item.pyramid() is not None:
+            self.tile_item.clear()
+        self._image = state["image"]
+        self._image_buffer = state["buffer"]
+        self._converted = state["converted"]
+        self._fitted = state["fitted"]
+        self._auto_window = state["auto_window"]
+        # a state shared by linked views is uploaded once
+        pix_map = state.get("pixmap")
+        if pix_map is None:
+            pix_map = state["pixmap"] = QPixmap.fromImage(state["q_image"])
+        timer.lap("pixmap")
+
+        # update image in the view, a new image size centers the image
+        resized = self._set_base_pixmap(pix_map, state.get("token"))
+        self._update_scene_rect(self._image_rect().center() if resized else None)
+        # resample for the current zoom later, so that consecutive images aren't delayed
+        if not self._show_zoom_level(cached_only=True):
+            self._zoom_settle.start()
+        self._frame_changed()
+        timer.lap("scene")
+
+    def update_image_region(self, x: int, y: int, patch: np.ndarray):
+        """
+        Replace a region of the current image, e.g. the new lines of a scan.
+        Only the region is converted, scaled and painted into the shown pixmap or tiles,
+        and only its part of the view is repainted. The automatic window keeps the limits
+        found by set_image(). A writable ImageSource, e.g. MemmapSource.from_npy(path, "r+"),
+        is written through, read only sources and tiled read only arrays raise a TypeError.
+        :param x: left of the region in image pixels
+        :param y: top of the region in image pixels
+        :param patch: image of the dtype and number of channels of the current image
+        :return:
+        """
+        if not self._image.size:
+            raise RuntimeError("No image is set!")
+        if not isinstance(patch, np.ndarray):
+            raise TypeError("Patch must be an openCV image(numpy ndarray)!")
+        if patch.dtype != self._image.dtype or patch.shape[2:] != self._image.shape[2:]:
+            raise TypeError("Patch must have the dtype and channels of the image!")
+        height, width = patch.shape[:2]
+        im_h, im_w = self._image.shape[:2]
+        if x < 0 or y < 0 or x + width > im_w or y + height > im_h:
+            raise ValueError("Patch must be inside the image!")
+        if not width or not height:
+            return
+        timer = StageTimer()
+        if isinstance(self._image, ImageSource):
+            self._image.write_region(slice(y, y + height), slice(x, x + width), patch)
+        elif self._image.flags.writeable:
+            self._image[y:y + height, x:x + width] = patch
+        elif self.tile_item.pyramid() is not None:
+            # a tiled image is too large to be copied
+            raise TypeError("Tiled image must be writable!")
+        else:
+            # e.g. a read only buffer shown by zero copy, show a changed copy
+            image = self._image.copy()
+            image[y:y + height, x:x + width] = patch
+            self.set_image(image)
+            return
+        timer.lap("write")
+        self._frame_changed(in_place=True)
+
+        if self.tile_item.pyramid() is not None:
+            self.tile_item.update_region(x, y, width, height)
+            timer.lap("tiles")
+            self._set_ingest_timings(timer.timings)
+            return
+        # keep a converted full size copy in step, refresh() scales it again
+        if self._converted is not None and not np.shares_memory(self._image_buffer, self._image):
+            im, swapped = self._converted
+            if im.format() == QImage.Format_RGB888 and not swapped:
+                # converted to rgb by openCV
+                self._image_buffer[y:y + height, x:x + width] = self._to_rgb(patch)
+            else:
+                # a contiguous copy wrapped by zero copy
+                self._image_buffer[y:y + height, x:x + width] = patch
+            timer.lap("convert")
+
+        base = self._base_pixmap
+        shown = self.pix_map_item.pixmap()
+        for pix_map in (base, shown) if shown is not base else (base,):
+            self._paint_image_region(pix_map, x, y, width, height, fit=pix_map is base)
+        # other zoom levels are rendered again when shown
+        if self._shared is not None:
+            self._shared.forget(self._image)
+        else:
+            self._zoom_cache.clear()
+        self._image_token = object()
+        if shown is not base:
+            self._zoom_cache.put((self._image_token, shown.width()), shown)
+        timer.lap("paint")
+        self._set_ingest_timings(timer.timings)
+
+    def _paint_image_region(self, pix_map: QPixmap, x: int, y: int, width: int, height: int, fit: bool):
+        """
+        Resample a region of the image for a pixmap showing the whole image and paint it in,
+        the shown pixmap repaints only the region.
+        :param fit: the pixmap is the base pixmap, the view sized image (_fitted) is updated, too
+        """
+        if pix_map.isNull():
+            return
+        im_h, im_w = self._image.shape[:2]
+        sx, sy = pix_map.width() / im_w, pix_map.height() / im_h
+        # pixmap pixels covering the region and the image pixels they are sampled from
+        px0, py0 = math.floor(x * sx), math.floor(y * sy)
+        px1 = min(pix_map.width(), math.ceil((x + width) * sx))
+        py1 = min(pix_map.height(), math.ceil((y + height) * sy))
+        ix0, iy0 = math.floor(px0 / sx), math.floor(py0 / sy)
+        ix1, iy1 = min(im_w, math.ceil(px1 / sx)), min(im_h, math.ceil(py1 / sy))
+        region = self._image[iy0:iy1, ix0:ix1]
+        if (ix1 - ix0, iy1 - iy0) != (px1 - px0, py1 - py0):
+            shrink = px1 - px0 <= ix1 - ix0 and py1 - py0 <= iy1 - iy0
+            region = cv2.resize(region, (px1 - px0, py1 - py0),
+                                interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+        if self._fitted is not None:
+            if fit and self._fitted is not self._image:
+                self._fitted[py0:py1, px0:px1] = region
+            region = self._apply_window(region)
+        q_image, buffer, swapped = wrap_ndarray(np.ascontiguousarray(region))
+        if swapped:
+            q_image = q_image.rgbSwapped()
+        if pix_map is self.pix_map_item.pixmap():
+            self.pix_map_item.paint_region(px0, py0, q_image)
+        else:
+            paint_image(pix_map, px0, py0, q_image)
+
+    def _apply_window(self, img: np.ndarray) -> np.ndarray:
+        return apply_window(img, *self.get_window_level())
+
+    def _show_windowed(self):
+        """
+        Map the view sized image by the window/level again.
+        """
+        im, self._image_buffer, swapped = wrap_ndarray(self._apply_window(self._fitted))
+        if swapped:
+            im = im.rgbSwapped()
+        self._set_base_pixmap(QPixmap.fromImage(im))
+        self._zoom_settle.start()
+
+    def set_window_level(self, low: float=None, high: float=None, gamma: float=1.0):
+        """
+        Display range of the image: low is shown black, high white and values in between with gamma.
+        Integer images are mapped by a lookup table, float images arithmetically. Changing the window
+        only maps the view sized image again, the image isn't ingested again. Of a tiled image only
+        the shown tiles are built again.
+        :param low: None is 0 for 8 bit images, the minimum of the image otherwise,
+                    of a tiled image the minimum of its coarsest pyramid level
+        :param high: None is 255 for 8 bit images, the maximum of the image otherwise
+        :param gamma: > 1 brightens the mid tones
+        :return:
+        """
+        # numpy scalars, e.g. img.min(), are numbers.Real, too
+        for value in (low, high):
+            if value is not None and not isinstance(value, numbers.Real):
+                raise TypeError("Window limits must be numbers or None!")
+        if not isinstance(gamma, numbers.Real):
+            raise TypeError("Gamma must be a number!")
+        if gamma <= 0:
+            raise ValueError("Gamma must be positive!")
+        self._window = (None if low is None else float(low), None if high is None else float(high), float(gamma))
+        if self._fitted is not None:
+            self._show_windowed()
+        elif self.tile_item.pyramid() is not None:
+            # only the shown tiles are built again
+            self.tile_item.set_window(self.get_window_level())
+        elif self._image.size:
+            # an 8 bit image shown without window so far
+            self.set_image(self._image)
+
+    def get_window_level(self) -> Tuple[float, float, float]:
+        """
+        :return: (low, high, gamma) in effect, automatic limits are resolved
+        """
+        return self._resolve_window(self._window, self._auto_window)
 
-        # keep the scene in the center of the view
-        bounds = self.scene.itemsBoundingRect()
-        self.view.setSceneRect(bounds)
+    @staticmethod
+    def _resolve_window(window: Tuple[float, float, float],
+                        auto: Tuple[float, float]) -> Tuple[float, float, float]:
+        low, high, gamma = window
+        return auto[0] if low is None else low, auto[1] if high is None else high, gamma
+
+    def _set_tiled_image(self, img: np.ndarray):
+        self._image_buffer = None
+        self._converted = None
+        self._fitted = None
+        self._set_base_pixmap(QPixmap())
+        if img.dtype == np.uint8:
+            self._auto_window = (0.0, 255.0)
+        else:
+            # the range of the coarsest level, reading the whole image would defeat the tiling
+            pyramid = TilePyramid(img, self.tile_item.tile_size)
+            self._auto_window = auto_window(pyramid.read_tile((pyramid.max_level, 0, 0)))
+        self.tile_item.clear()
+        self.tile_item.set_window(self.get_window_level())
+        self.tile_item.set_source(img)
+        self._relayout_overlay()
+        self.zoom_fit()
+
+    def set_overlay(self, mask: np.ndarray, colormap: Colormap=cv2.COLORMAP_JET, alpha: float=0.5, *,
+                    zero_transparent: bool=True):
+        """
+        Show a mask or heat map colour mapped over the image.
+        The mask is sampled at the resolution the image is displayed at and mapped by a lookup
+        table cached by colormap and alpha, no full resolution overlay is made.
+        :param mask: 2-D bool, integer (0 - 255) or float (0 - 1) array of the size of the image, it is copied
+        :param colormap: a cv2.COLORMAP_* value or a list of (r, g, b) colours indexed by the mask values
+        :param alpha: opacity 0 - 1
+        :param zero_transparent: don't colour mask value 0
+        :return:
+        """
+        if not isinstance(mask, np.ndarray) or mask.ndim != 2:
+            raise TypeError("Mask must be a 2-D numpy array!")
+        if mask.dtype.kind not in "biuf":
+            raise TypeError("Mask must be a bool, integer or float array!")
+        if self._image.size and mask.shape != self._image.shape[:2]:
+            raise ValueError("Mask must have the size of the image!")
+        if not isinstance(alpha, (int, float)) or not 0 <= alpha <= 1:
+            raise TypeError("Alpha must be a number between 0 and 1!")
+        lut = colormap_lut(colormap, alpha, zero_transparent)
+        self.overlay_item.set_mask(mask.copy(), lut, *self._overlay_geometry(mask))
+
+    def update_overlay(self, x: int, y: int, patch: np.ndarray):
+        """
+        Replace a region of the overlay mask, only the display pixels of the region are mapped and uploaded.
+        :param x: left of the region in mask pixels
+        :param y: top of the region in mask pixels
+        :param patch: 2-D array of the new mask values
+        :return:
+        """
+        mask = self.overlay_item.mask()
+        if mask is None:
+            raise RuntimeError("No overlay is set!")
+        if not isinstance(patch, np.ndarray) or patch.ndim != 2:
+            raise TypeError("Patch must be a 2-D numpy array!")
+        height, width = patch.shape
+        if x < 0 or y < 0 or x + width > mask.shape[1] or y + height > mask.shape[0]:
+            raise ValueError("Patch must be inside the mask!")
+        mask[y:y + height, x:x + width] = patch
+        self.overlay_item.update_region(x, y, width, height)
+
+    def clear_overlay(self):
+        self.overlay_item.clear()
+
+    def _overlay_geometry(self, mask: np.ndarray) -> Tuple[Tuple[int, int], QRectF]:
+        """
+        :return: display size of the overlay, which is the size of the shown pixmap or of the
+            tiled image fitted to the view, and its scene rect, which is the rect of the image
+        """
+        image_rect = self._image_rect()
+        if not self._base_pixmap.isNull():
+            return (self._base_pixmap.width(), self._base_pixmap.height()), image_rect
+        mask_h, mask_w = mask.shape
+        if image_rect.isEmpty():
+            # no image, the mask is shown in scene pixels
+            return (mask_w, mask_h), QRectF(0, 0, mask_w, mask_h)
+        ratio = min(1.0, self.view.width() / mask_w, self.view.height() / mask_h)
+        return (max(1, round(mask_w * ratio)), max(1, round(mask_h * ratio))), image_rect
+
+    def _relayout_overlay(self):
+        mask = self.overlay_item.mask()
+        if mask is not None:
+            self.overlay_item.relayout(*self._overlay_geometry(mask))
+        self._place_profile_line()
+
+    def show_histogram(self, status: bool):
+        """
+        Show the histogram panel. While shown, the histogram of the visible region, or of the
+        selected ROIs if there are any, follows the image and the view, see ImageAnalysis.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._show_histogram = status
+            self.histogram_panel.setVisible(status)
+            self._request_analysis()
+        else:
+            raise TypeError("Status must be bool!")
+
+    def show_profile(self, status: bool):
+        """
+        Show the profile panel of the values along the profile line, which is drawn by the Line
+        tool or set by set_profile_line().
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._show_profile = status
+            self.profile_panel.setVisible(status)
+            self._request_analysis()
+        else:
+            raise TypeError("Status must be bool!")
+
+    def set_profile_line(self, x0: float, y0: float, x1: float, y1: float):
+        """
+        :param x0: start of the profile line in image pixels
+        :param y0:
+        :param x1: end of the profile line in image pixels
+        :param y1:
+        :return:
+        """
+        self._profile_line = (float(x0), float(y0), float(x1), float(y1))
+        self._place_profile_line()
+        self._request_analysis()
+
+    def clear_profile_line(self):
+        self._profile_line = None
+        self._place_profile_line()
+        self.profile_panel.clear()
+
+    def get_analysis(self) -> Dict:
+        """
+        :return: the latest result of the panels: "frame", "region" (x0, y0, x1, y1), "bins"
+                 (low, high, count) and sampling "step" of the "histogram" (channels, count), "line"
+                 and "profile" (samples, channels), the "timings" in ms and the "error" raised while
+                 computing or None, None before the first result
+        """
+        return self._analysis_result
+
+    def _place_profile_line(self):
+        if self._profile_line is None:
+            self.profile_line_item.setVisible(False)
+            return
+        ox, oy, sx, sy = self._scene_to_image()
+        x0, y0, x1, y1 = self._profile_line
+        self.profile_line_item.setLine(x0 / sx + ox, y0 / sy + oy, x1 / sx + ox, y1 / sy + oy)
+        self.profile_line_item.setVisible(True)
+
+    def _frame_changed(self, in_place: bool=False):
+        """
+        The shown image was replaced or changed, the analysis caches are keyed by the frame serial.
+        :param in_place: the content changed although the image object is the same
+        """
+        if in_place or self._image is not self._frame_image:
+            self._frame_image = self._image
+            self._frame_serial += 1
+        self._place_profile_line()
+        self._request_analysis()
+
+    def _request_analysis(self, *args):
+        """
+        Request the histogram and profile of the shown panels, newer requests replace pending ones.
+        """
+        if not (self._show_histogram or self._show_profile) or not self._image.size:
+            return
+        im_h, im_w = self._image.shape[:2]
+        ox, oy, sx, sy = self._scene_to_image()
+        region = rois = None
+        if self._show_histogram:
+            selected = self._selected_rois()
+            if selected:
+                records = self._roi_records(selected)
+                rects = np.column_stack((records["x"] - ox, records["y"] - oy, records["w"], records["h"]))
+                rects *= (sx, sy, sx, sy)
+                rois = tuple(zip(records["type"].tolist(), *rects.T.tolist()))
+                x0, y0 = rects[:, 0].min(), rects[:, 1].min()
+                x1, y1 = (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max()
+            else:
+                visible = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+                x0, y0 = (visible.left() - ox) * sx, (visible.top() - oy) * sy
+                x1, y1 = (visible.right() - ox) * sx, (visible.bottom() - oy) * sy
+            region = (int(np.clip(np.floor(x0), 0, im_w)), int(np.clip(np.floor(y0), 0, im_h)),
+                      int(np.clip(np.ceil(x1), 0, im_w)), int(np.clip(np.ceil(y1), 0, im_h)))
+        line = self._profile_line if self._show_profile else None
+        if region is None and line is None:
+            return
+        # a tiled image is sampled at the pyramid level shown, instead of reading the region in full resolution
+        step = 1 << self.tile_item.level_for_view(self.view) if self.tile_item.pyramid() is not None else 1
+        self._analysis.request({"frame": self._frame_serial,
+                                "image": self._image,
+                                "region": region,
+                                "bins": histogram_bins(self._image, self._auto_window),
+                                "step": step,
+                                "rois": rois,
+                                "line": line})
+
+    def _show_analysis(self, result: Dict):
+        # runs on the GUI thread
+        self._analysis_result = result
+        if result["histogram"] is not None and self._show_histogram:
+            self.histogram_panel.set_histogram(result["histogram"], result["bins"])
+        if result["profile"] is not None and self._show_profile:
+            self.profile_panel.set_profile(result["profile"])
+        self.analysis_updated.emit(result)
+
+    def set_tiled(self, status: bool):
+        """
+        Enable or disable the tiled backend of set_image().
+        A tiled image is shown in source pixel coordinates, only the tiles which are visible
+        at the current zoom are built (on a worker pool) and uploaded.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._tiled = status
+            if self._image.size:
+                self.set_image(self._image)
+        else:
+            raise TypeError("Status must be bool!")
+
+    def set_zero_copy(self, status: bool):
+        """
+        Enable or disable the zero copy ingestion of set_image().
+        In zero copy mode the ndarray buffer is wrapped in a QImage directly
+        and only the view sized result of the scaling is copied.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._zero_copy = status
+        else:
+            raise TypeError("Status must be bool!")
+
+    def _set_ingest_timings(self, timings: Dict[str, float]):
+        self._ingest_timings = timings
+        if self._perf.enabled:
+            self._perf.record_ingest(timings)
+
+    def get_ingest_timings(self) -> Dict[str, float]:
+        """
+        Timings of the stages of the last set_image() call in milliseconds.
+        :return: {stage: milliseconds}, stages are in the order they ran
+        """
+        return dict(self._ingest_timings)
+
+    def set_instrumentation(self, status: bool):
+        """
+        Record timings of image ingest, viewport paints and the tools, see get_perf_stats().
+        While enabled, stats_updated is emitted every stats_interval ms. Disabled, the
+        timing is skipped and costs a flag check.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._perf.enabled = status
+            if status:
+                self._stats_timer.start()
+            else:
+                self._stats_timer.stop()
+                self.hud_item.setVisible(False)
+        else:
+            raise TypeError("Status must be bool!")
+
+    def reset_perf_stats(self):
+        self._perf.reset()
+
+    def get_perf_stats(self, items: bool=False) -> Dict:
+        """
+        :param items: count the scene items, which wraps every item and is left out of stats_updated
+        :return: {"fps": painted frames per second,
+                  "paint", "ingest": {stage: ...}, "tools": {tool: ...}: count, last_ms, mean_ms and max_ms,
+                  "rois": number of ROIs, "items": number of scene items if requested,
+                  "events": see get_event_stats(), "stream": see get_stream_stats() while streaming}
+        """
+        stats = self._perf.as_dict()
+        # selected stored ROIs are items, too
+        stats["rois"] = len(self._rois) + int(np.count_nonzero(~self._roi_store.data["selected"]))
+        if items:
+            stats["items"] = len(self.scene.items())
+        stats["events"] = self.get_event_stats()
+        if self._stream.is_running():
+            stats["stream"] = self._stream.get_stats()
+        return stats
+
+    def show_hud(self, status: bool):
+        """
+        Show frame rate and timings in the top left corner of the view, enables the instrumentation.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            if status:
+                self.set_instrumentation(True)
+            self.hud_item.setVisible(status)
+            self._place_hud()
+        else:
+            raise TypeError("Status must be bool!")
+
+    def _emit_stats(self):
+        stats = self.get_perf_stats()
+        if self.hud_item.isVisible():
+            ingest = stats["ingest"].get("total", {}).get("last_ms", 0.0)
+            self.hud_item.setText("%.0f fps  paint %.2f ms  ingest %.2f ms  %d ROIs" %
+                                  (stats["fps"], stats["paint"]["last_ms"], ingest, stats["rois"]))
+            self._place_hud()
+        self.stats_updated.emit(stats)
+
+    def _place_hud(self, *args):
+        if self.hud_item.isVisible():
+            self.hud_item.setPos(self.view.mapToScene(8, 8))
+
+    def start_stream(self, interval: int=16):
+        """
+        Start the live stream mode, frames are then given by push_frame().
+        :param interval: minimum time between two displayed frames in ms
+        :return:
+        """
+        self._stream.start(interval)
+
+    def stop_stream(self):
+        self._stream.stop()
+
+    def push_frame(self, frame: np.ndarray):
+        """
+        Push a frame to the live stream, can be called from any thread.
+        Only the latest frame is kept, older frames which are not shown yet are dropped.
+        :param frame: gray scale, BGR or BGRA image of uint8, uint16, int16 or float32,
+                      other than 8 bit frames are shown by the window/level, see set_window_level()
+        :return:
+        """
+        self._stream.push(frame)
+
+    def get_stream_stats(self) -> Dict[str, float]:
+        """
+        :return: received, dropped and displayed frame counters, last and mean latency in ms
+        """
+        return self._stream.get_stats()
+
+    def _show_frame(self, q_image: QImage, frame: np.ndarray, auto_window: Tuple[float, float]):
+        """
+        Show a converted frame of the live stream, runs on the GUI thread.
+        """
+        self._image = frame
+        self._image_buffer = frame
+        self._auto_window = auto_window
+        self._converted = None
+        self._fitted = None
+        resized = self._set_base_pixmap(QPixmap.fromImage(q_image))
+        if resized:
+            # the scene bounds only change with the size of the frame
+            self._update_scene_rect(self._image_rect().center())
+        self._frame_changed(in_place=True)
 
     def add_text(self, name: str,
                  txt: str, *,
@@ -436,6 +1737,27 @@ class QImageViewer(ImageViewerUI):
         self.scene.removeItem(self._texts[name])
         self._texts.pop(name)
 
+    def set_label(self, name: str, txt: str=None, *,
+                  color: Tuple[int, int, int]=None,
+                  position: Tuple[float, float]=None):
+        """
+        Add or update a plain text label, much cheaper than add_text() and update_text() for
+        labels which change every frame. Changes are drawn once per frame and only the changed
+        labels are repainted.
+        :param name: key of the label
+        :param txt: None keeps the current text
+        :param color: (r, g, b), None keeps the current colour, black for a new label
+        :param position: (x, y) in scene coordinates, None keeps the current position, (0, 0) for a new label
+        :return:
+        """
+        self.label_layer.set_label(name, txt, position=position, color=color)
+
+    def remove_label(self, name: str):
+        self.label_layer.remove_label(name)
+
+    def clear_labels(self):
+        self.label_layer.clear()
+
     def show_toolbar(self, status: bool):
         if isinstance(status, bool):
             if status:
@@ -457,27 +1779,113 @@ class QImageViewer(ImageViewerUI):
     #     return pos
 
     def add_roi(self, roi_type: RoiType, x: int, y: int, width: int, height: int):
-        roi = QGraphicsRoiItem(roi_type, x, y, width, height)
-        roi.setPen(QPen(self._roi_color))
+        if self._store_mode:
+            roi_id = self._roi_store.add(roi_type, x, y, width, height, QColor(self._roi_color).rgba())
+            self.roi_batch_item.store_changed()
+            return roi_id
+        return self._add_roi_item(roi_type, x, y, width, height)
+
+    def _add_roi_item(self, roi_type: RoiType, x: float, y: float, width: float, height: float):
         status = True if self._current_tool == "Arrow" else False
-        roi.set_mutable(status)
+        roi = QGraphicsRoiItem(roi_type, x, y, width, height, mutable=status)
+        roi.setPen(QPen(self._roi_color))
+        roi.setCacheMode(self._roi_cache_mode)
         self.scene.addItem(roi)
         self._rois.add(roi)
+        roi.geometry_changed = self._index_roi
+        self._index_roi(roi)
         return roi
 
+    @contextmanager
+    def _bulk_scene_update(self):
+        """
+        Suspend the BSP index of the scene and repaints of the view while many items are changed.
+        The index is rebuilt once when leaving the context.
+        """
+        index_method = self.scene.itemIndexMethod()
+        updates = self.view.viewport().updatesEnabled()
+        self.scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        self.view.viewport().setUpdatesEnabled(False)
+        try:
+            yield
+        finally:
+            self.scene.setItemIndexMethod(index_method)
+            self.view.viewport().setUpdatesEnabled(updates)
+            self.view.viewport().update()
+
+    def _add_roi_items(self, records: np.ndarray) -> List[QGraphicsRoiItem]:
+        """
+        Create ROI items for records (see roi_file.RECORD_DTYPE) in scene coordinates.
+        Pens are shared by colour and the scene index is suspended while inserting.
+        """
+        roi_types = {roi_type.value: roi_type for roi_type in RoiType}
+        default_color = QColor(self._roi_color).rgba()
+        colors = records["color"].tolist() if "color" in records.dtype.names else [default_color] * len(records)
+        pens = {}
+        mutable = self._current_tool == "Arrow"
+        cache_mode = self._roi_cache_mode
+        margin = self._roi_margin()
+        result = []
+        with self._bulk_scene_update():
+            for roi_type, x, y, w, h, color in zip(records["type"].tolist(),
+                                                   records["x"].tolist(), records["y"].tolist(),
+                                                   records["w"].tolist(), records["h"].tolist(), colors):
+                roi = QGraphicsRoiItem(roi_types[roi_type], x, y, w, h, mutable=mutable)
+                pen = pens.get(color)
+                if pen is None:
+                    pen = pens[color] = QPen(QColor.fromRgba(color))
+                roi.setPen(pen)
+                if cache_mode != QGraphicsItem.NoCache:
+                    roi.setCacheMode(cache_mode)
+                self.scene.addItem(roi)
+                roi.geometry_changed = self._index_roi
+                self._roi_index.insert(roi, (x - margin, y - margin, x + w + margin, y + h + margin))
+                result.append(roi)
+        self._rois.update(result)
+        return result
+
+    def add_rois(self, rois: np.ndarray) -> Union[List[QGraphicsRoiItem], np.ndarray]:
+        """
+        Add many ROIs at once, much faster than calling add_roi() for each.
+        :param rois: structured array with type (RoiType value), x, y, w, h and optionally color
+                     (QColor.rgba()) fields, e.g. of roi_file.RECORD_DTYPE
+        :return: list of the new ROI items, in store mode an array of the new ROI ids
+        """
+        records = np.zeros(len(rois), roi_file.RECORD_DTYPE)
+        records["color"] = QColor(self._roi_color).rgba()
+        for name in roi_file.RECORD_DTYPE.names:
+            if name in rois.dtype.names:
+                records[name] = rois[name]
+
+        if self._store_mode:
+            ids = self._roi_store.append(records)
+            self.roi_batch_item.store_changed()
+            return ids
+        return self._add_roi_items(records)
+
     def remove_roi(self, roi: QGraphicsRoiItem):
-        self.scene.removeItem(roi)
-        self._rois.remove(roi)
+        self.remove_rois({roi})
 
     def remove_rois(self, rois: Set[QGraphicsRoiItem]):
+        ids = [roi.store_id for roi in rois if getattr(roi, "store_id", None) is not None]
+        if ids:
+            self._roi_store.remove(ids)
+            self.roi_batch_item.store_changed()
+        self._remove_roi_items(rois)
+
+    def _remove_roi_items(self, rois: Set[QGraphicsRoiItem]):
         for item in rois:
             self.scene.removeItem(item)
+            self._roi_index.remove(item)
         self._rois = self._rois - rois
 
     def clear_roi(self):
         for item in self._rois:
             self.scene.removeItem(item)
         self._rois.clear()
+        self._roi_index.clear()
+        self._roi_store.clear()
+        self.roi_batch_item.store_changed()
 
     def add_roi_matrix(self, roi_type: RoiType=RoiType.Ellipse, *,
                        rows: int=1, cols: int=1, dx: int=50, dy: int=50,
@@ -493,28 +1901,182 @@ class QImageViewer(ImageViewerUI):
         :param y: top left point y
         :param width: ROI width
         :param height:ROI height
-        :return:
+        :return: see add_rois()
+        """
+        rois = np.zeros(rows * cols, roi_file.RECORD_DTYPE)
+        rois["type"] = roi_type.value
+        ys, xs = np.mgrid[0:rows, 0:cols]
+        rois["x"] = x + xs.ravel() * dx
+        rois["y"] = y + ys.ravel() * dy
+        rois["w"] = width
+        rois["h"] = height
+        rois["color"] = QColor(self._roi_color).rgba()
+        return self.add_rois(rois)
+
+    def _roi_geometry(self, rois: RoiSelection) -> Tuple[List[QGraphicsRoiItem], np.ndarray, np.ndarray]:
+        """
+        Scene geometry of ROIs.
+        :param rois: ROI items, an array of ROI store ids or None for the selected ROI items
+        :return: (items, store rows, (n, 4) float64 x, y, w, h of the items followed by the rows)
         """
+        if rois is None:
+            items, rows = self._selected_rois(), np.empty(0, np.intp)
+        elif isinstance(rois, np.ndarray):
+            items, rows = [], self._roi_store.rows(rois)
+        else:
+            items, rows = list(rois), np.empty(0, np.intp)
 
-        for row in range(rows):
-            for col in range(cols):
-                self.add_roi(roi_type, x + col*dx, y + row*dy, width, height)
+        geometry = np.empty((len(items) + len(rows), 4), np.float64)
+        if items:
+            geometry[:len(items)] = [roi.mapRectToScene(roi.rect()).getRect() for roi in items]
+        data = self._roi_store.data
+        for i, name in enumerate(("x", "y", "w", "h")):
+            geometry[len(items):, i] = data[name][rows]
+        return items, rows, geometry
 
-    def save_rois(self, file_path: str):
-        rois = [(roi.roi_type,
-                 roi.sceneBoundingRect().x(), roi.sceneBoundingRect().y(),
-                 int(roi.rect().width()), int(roi.rect().height()))
-                for roi in self._rois]
-        print(rois)
-        with open(file_path, 'wb') as f:
-            pickle.dump(rois, f)
+    def _set_roi_geometry(self, items: List[QGraphicsRoiItem], rows: np.ndarray, geometry: np.ndarray):
+        """
+        Apply the geometry of _roi_geometry() in one batched update: the scene index is suspended,
+        the ROI index is updated once per item and the ROI store rows are written at once.
+        """
+        item_geometry = geometry[:len(items)]
+        with self._bulk_scene_update():
+            origin = QPointF(0, 0)
+            for roi, (x, y, w, h) in zip(items, item_geometry.tolist()):
+                # the item position is folded into the rect, like ROIs drawn by the tools
+                if roi.pos() != origin:
+                    roi.setPos(origin)
+                # bypass the per item geometry_changed callback, the index is updated below
+                QGraphicsRectItem.setRect(roi, x, y, w, h)
+                if roi.handleSize:
+                    roi.update_handles_pos()
+        margin = self._roi_margin()
+        bounds = np.column_stack([item_geometry[:, :2] - margin, item_geometry[:, :2] + item_geometry[:, 2:] + margin])
+        self._roi_index.insert_many(items, bounds.tolist())
+        if len(rows):
+            data = self._roi_store.data
+            for i, name in enumerate(("x", "y", "w", "h")):
+                data[name][rows] = geometry[len(items):, i]
+            self._roi_store.touch()
+            self.roi_batch_item.store_changed()
+
+    def transform_rois(self, rois: RoiSelection, matrix: Union[QTransform, np.ndarray]):
+        """
+        Transform many ROIs at once, much faster than moving or resizing each.
+        ROIs stay axis aligned, a rotated or sheared ROI becomes the bounding box of its corners.
+        :param rois: ROI items, an array of ROI store ids or None for the selected ROIs
+        :param matrix: QTransform or affine (2, 3) or (3, 3) matrix in scene coordinates
+        :return:
+        """
+        if isinstance(matrix, QTransform):
+            matrix = np.array([[matrix.m11(), matrix.m21(), matrix.dx()],
+                               [matrix.m12(), matrix.m22(), matrix.dy()]])
+        matrix = np.asarray(matrix, np.float64)
+        if matrix.shape not in ((2, 3), (3, 3)):
+            raise TypeError("Matrix must be a QTransform or a (2, 3) or (3, 3) array!")
+
+        items, rows, geometry = self._roi_geometry(rois)
+        if not len(geometry):
+            return
+        x, y, w, h = geometry.T
+        # corners (n, 4, 2) mapped by the linear part plus the translation
+        corners = np.stack([np.stack([x, y], -1), np.stack([x + w, y], -1),
+                            np.stack([x, y + h], -1), np.stack([x + w, y + h], -1)], 1)
+        mapped = corners @ matrix[:2, :2].T + matrix[:2, 2]
+        low = mapped.min(1)
+        high = mapped.max(1)
+        self._set_roi_geometry(items, rows, np.column_stack([low, high - low]))
+
+    def align_rois(self, rois: RoiSelection, edge: str):
+        """
+        Align ROIs to the bounding box of all of them.
+        :param rois: ROI items, an array of ROI store ids or None for the selected ROIs
+        :param edge: "left", "right", "top", "bottom", "hcenter" or "vcenter"
+        :return:
+        """
+        # (axis, part of the size the aligned point is away from x or y)
+        edges = {"left": (0, 0.0), "hcenter": (0, 0.5), "right": (0, 1.0),
+                 "top": (1, 0.0), "vcenter": (1, 0.5), "bottom": (1, 1.0)}
+        if edge not in edges:
+            raise ValueError("Edge must be one of %s!" % ", ".join(edges))
+        axis, part = edges[edge]
+
+        items, rows, geometry = self._roi_geometry(rois)
+        if not len(geometry):
+            return
+        pos, size = geometry[:, axis], geometry[:, axis + 2]
+        low, high = pos.min(), (pos + size).max()
+        geometry[:, axis] = low + (high - low) * part - size * part
+        self._set_roi_geometry(items, rows, geometry)
+
+    def distribute_rois(self, rois: RoiSelection, axis: str="horizontal"):
+        """
+        Space ROIs evenly, the first and the last ROI along the axis stay, the others are moved
+        so that the gaps between neighbours are equal.
+        :param rois: ROI items, an array of ROI store ids or None for the selected ROIs
+        :param axis: "horizontal" or "vertical"
+        :return:
+        """
+        if axis not in ("horizontal", "vertical"):
+            raise ValueError("Axis must be horizontal or vertical!")
+        axis = 0 if axis == "horizontal" else 1
+
+        items, rows, geometry = self._roi_geometry(rois)
+        if len(geometry) < 3:
+            return
+        pos, size = geometry[:, axis], geometry[:, axis + 2]
+        order = np.argsort(pos + size / 2, kind="stable")
+        sizes = size[order]
+        first, last = pos[order[0]], pos[order[-1]] + sizes[-1]
+        gap = (last - first - sizes.sum()) / (len(order) - 1)
+        # start of each ROI: the sizes of the ROIs before it plus one gap each
+        starts = first + np.concatenate([[0.0], np.cumsum(sizes[:-1] + gap)])
+        geometry[order, axis] = starts
+        self._set_roi_geometry(items, rows, geometry)
+
+    def _roi_records(self, rois: Iterable[QGraphicsRoiItem]=None) -> np.ndarray:
+        """
+        Type, scene geometry and colour of ROIs.
+        :param rois: ROI items, default is all ROIs: the items of the viewer followed by the rows of the ROI store
+        :return: array of roi_file.RECORD_DTYPE
+        """
+        if rois is None:
+            rois = list(self._rois)
+            stored = self._roi_store.data
+            stored = stored[~stored["selected"]]
+        else:
+            rois = list(rois)
+            stored = self._roi_store.data[:0]
+
+        records = np.zeros(len(rois) + len(stored), roi_file.RECORD_DTYPE)
+        for i, roi in enumerate(rois):
+            rect = roi.mapRectToScene(roi.rect())
+            records[i] = (roi.roi_type.value, rect.x(), rect.y(), rect.width(), rect.height(),
+                          roi.pen().color().rgba())
+        tail = records[len(rois):]
+        for name in roi_file.RECORD_DTYPE.names:
+            tail[name] = stored[name]
+        return records
+
+    def save_rois(self, file_path: str, *, append: bool=False):
+        """
+        Save all ROIs to a binary ROI file, see roi_file.
+        :param file_path:
+        :param append: append to the ROIs in the file instead of replacing them
+        :return:
+        """
+        if append:
+            roi_file.append_rois(file_path, self._roi_records())
+        else:
+            roi_file.save_rois(file_path, self._roi_records())
 
     def load_rois(self, file_path: str):
+        """
+        Replace the ROIs by the ones of a binary ROI file, see roi_file.
+        :param file_path:
+        :return:
+        """
+        records = roi_file.load_rois(file_path)
         self.clear_roi()
-        with open(file_path, 'rb') as f:
-            rois = pickle.load(f)
-            print(rois)
-
-        for roi in rois:
-            self.add_roi(*roi)
+        self.add_rois(records)
 
@@ -0,0 +1,140 @@
+"""
+Layer of plain text labels for high frequency updates
+"""
+
+from typing import Dict, Tuple
+
+from PySide.QtCore import Qt, QPointF, QRectF, QTimer
+from PySide.QtGui import QColor, QFont, QGraphicsItem, QGraphicsObject, QStaticText, QTransform
+
+Color = Tuple[int, int, int]
+
+
+class LabelLayer(QGraphicsObject):
+    """
+    Draws many plain text labels as one item.
+
+    Label text is laid out once into a QStaticText, which is cached by text, so a value
+    shown before is drawn again without a new layout. Changes are collected and applied
+    once per event loop iteration (i.e. per frame), only the regions of the changed
+    labels are invalidated. The bounding rect only grows, so moving a label within it
+    doesn't invalidate the whole layer.
+    """
+    # max number of cached text layouts
+    cache_size = 1024
+
+    def __init__(self, font: QFont=None, parent: QGraphicsItem=None):
+        super(LabelLayer, self).__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)   # for option.exposedRect
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self._font = QFont(font) if font is not None else QFont()
+        self._labels: Dict[str, dict] = {}      # name: {"text", "pos", "color", "static", "rect"}
+        self._changes: Dict[str, dict] = {}     # name: changed fields, None removes the label
+        self._statics: Dict[str, QStaticText] = {}
+        self._bounds = QRectF()
+        self._flush_timer = QTimer()
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(0)
+        self._flush_timer.timeout.connect(self.flush)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, name: str):
+        return name in self._labels
+
+    def set_label(self, name: str, text: str=None, *, position: Tuple[float, float]=None, color: Color=None):
+        """
+        Add a label or change it, the change is drawn with the next frame.
+        :param name: key of the label
+        :param text: plain text, None keeps the current text
+        :param position: (x, y) of the top left corner in scene coordinates, None keeps the current one
+        :param color: (r, g, b), None keeps the current one
+        :return:
+        """
+        change = self._changes.get(name) or {}
+        if text is not None:
+            change["text"] = str(text)
+        if position is not None:
+            change["pos"] = QPointF(position[0], position[1])
+        if color is not None:
+            change["color"] = QColor(color[0], color[1], color[2])
+        self._changes[name] = change
+        self._flush_timer.start()
+
+    def remove_label(self, name: str):
+        self._changes[name] = None
+        self._flush_timer.start()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self._labels.clear()
+        self._changes.clear()
+        self._bounds = QRectF()
+
+    def label_text(self, name: str) -> str:
+        """
+        Text of a label including changes which aren't drawn yet.
+        """
+        change = self._changes.get(name)
+        if change and "text" in change:
+            return change["text"]
+        return self._labels[name]["text"]
+
+    def _static_text(self, text: str) -> QStaticText:
+        static = self._statics.get(text)
+        if static is None:
+            if len(self._statics) >= self.cache_size:
+                self._statics.clear()
+            static = QStaticText(text)
+            static.setTextFormat(Qt.PlainText)
+            static.setPerformanceHint(QStaticText.AggressiveCaching)
+            static.prepare(QTransform(), self._font)
+            self._statics[text] = static
+        return static
+
+    def flush(self):
+        """
+        Apply the collected changes, called automatically once per event loop iteration.
+        """
+        self._flush_timer.stop()
+        if not self._changes:
+            return
+        dirty = []
+        for name, change in self._changes.items():
+            label = self._labels.get(name)
+            if label is not None:
+                dirty.append(label["rect"])
+            if change is None:
+                self._labels.pop(name, None)
+                continue
+            if label is None:
+                label = self._labels[name] = {"text": "", "pos": QPointF(), "color": QColor(Qt.black)}
+            label.update(change)
+            label["static"] = self._static_text(label["text"])
+            label["rect"] = QRectF(label["pos"], label["static"].size())
+            dirty.append(label["rect"])
+        self._changes.clear()
+
+        bounds = QRectF(self._bounds)
+        for rect in dirty:
+            bounds = bounds.united(rect) if not bounds.isNull() else QRectF(rect)
+        if bounds != self._bounds:
+            self.prepareGeometryChange()
+            self._bounds = bounds
+        for rect in dirty:
+            self.update(rect)
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect
+        painter.setFont(self._font)
+        color = None
+        for label in self._labels.values():
+            if label["rect"].intersects(exposed):
+                if label["color"] != color:
+                    color = label["color"]
+                    painter.setPen(color)
+                painter.drawStaticText(label["pos"], label["static"])
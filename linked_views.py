@@ -0,0 +1,148 @@
+"""
+Linked image viewers: shared image cache, synchronised pan/zoom, difference and blink comparison
+"""
+
+from functools import partial
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+from PySide.QtCore import QObject, QTimer
+
+from image_cache import SharedImageCache
+from imageviewer import QImageViewer
+
+
+def difference(reference: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """
+    Absolute difference of two images of the same shape.
+    :return: uint8 for 8 bit images, float32 otherwise, NaN (e.g. missing depth) where either is NaN
+    """
+    if reference.shape != current.shape:
+        raise ValueError("Images must have the same shape!")
+    if reference.dtype == np.uint8 and current.dtype == np.uint8:
+        # max - min doesn't wrap around and stays uint8
+        return np.maximum(reference, current) - np.minimum(reference, current)
+    return np.abs(np.subtract(reference, current, dtype=np.float32))
+
+
+class ViewLink(QObject):
+    """
+    Links several QImageViewers.
+
+    The viewers share a SharedImageCache, so an image shown in several of them is converted,
+    uploaded and resampled once. While synchronised, panning or zooming one viewer moves the
+    others to the same image point and zoom (in image pixels, so views of different sizes
+    match). A viewer can compare two images by their difference or by blinking between them,
+    blinking swaps cached pixmaps only.
+    """
+    def __init__(self, viewers: Sequence[QImageViewer]=(), cache: SharedImageCache=None, sync: bool=True):
+        super(ViewLink, self).__init__()
+        self.cache = cache if cache is not None else SharedImageCache()
+        self._viewers: List[QImageViewer] = []
+        self._slots: Dict[QImageViewer, Callable] = {}
+        self._sync = sync
+        self._syncing = False
+        self._blink_viewer: QImageViewer = None
+        self._blink_images: List[np.ndarray] = []
+        self._blink_index = 0
+        self._blink_timer = QTimer(self)
+        self._blink_timer.timeout.connect(self._blink)
+        for viewer in viewers:
+            self.add_viewer(viewer)
+
+    def viewers(self) -> List[QImageViewer]:
+        return list(self._viewers)
+
+    def add_viewer(self, viewer: QImageViewer):
+        if viewer in self._slots:
+            return
+        viewer.set_shared_cache(self.cache)
+        slot = self._slots[viewer] = partial(self._on_view_changed, viewer)
+        viewer.view_changed.connect(slot)
+        self._viewers.append(viewer)
+        if self._sync and len(self._viewers) > 1:
+            self._sync_from(self._viewers[0])
+
+    def remove_viewer(self, viewer: QImageViewer):
+        if viewer not in self._slots:
+            return
+        if viewer is self._blink_viewer:
+            self.stop_blink()
+        viewer.view_changed.disconnect(self._slots.pop(viewer))
+        self._viewers.remove(viewer)
+        viewer.set_shared_cache(None)
+
+    def set_sync(self, status: bool):
+        """
+        Synchronise pan and zoom of the viewers.
+        :param status:
+        :return:
+        """
+        if isinstance(status, bool):
+            self._sync = status
+            if status and self._viewers:
+                self._sync_from(self._viewers[0])
+        else:
+            raise TypeError("Status must be bool!")
+
+    def set_image(self, img: np.ndarray, viewers: Sequence[QImageViewer]=None, **kwargs):
+        """
+        Show an image in all (or the given) viewers, it is converted once per view size.
+        :param kwargs: see QImageViewer.set_image()
+        :return:
+        """
+        for viewer in (viewers if viewers is not None else self._viewers):
+            viewer.set_image(img, **kwargs)
+
+    def show_difference(self, viewer: QImageViewer, reference: np.ndarray, current: np.ndarray) -> np.ndarray:
+        """
+        Show the absolute difference of two images in a viewer.
+        :return: the difference image
+        """
+        diff = difference(reference, current)
+        viewer.set_image(diff)
+        return diff
+
+    def start_blink(self, viewer: QImageViewer, images: Sequence[np.ndarray], interval: int=500):
+        """
+        Show the images alternately in a viewer, e.g. a reference and the current frame.
+        Each image is converted once, blinking only swaps the cached pixmaps.
+        :param viewer: a viewer of the link, see add_viewer(), others have no shared cache
+        :param interval: ms each image is shown
+        :return:
+        """
+        if viewer not in self._slots:
+            raise ValueError("Viewer must be linked, see add_viewer()!")
+        if len(images) < 2:
+            raise ValueError("Blinking needs at least two images!")
+        self._blink_viewer = viewer
+        self._blink_images = list(images)
+        self._blink_index = 0
+        viewer.set_image(self._blink_images[0])
+        self._blink_timer.start(interval)
+
+    def stop_blink(self):
+        self._blink_timer.stop()
+        self._blink_viewer = None
+        self._blink_images = []
+
+    def _blink(self):
+        self._blink_index = (self._blink_index + 1) % len(self._blink_images)
+        self._blink_viewer.set_image(self._blink_images[self._blink_index])
+
+    def _on_view_changed(self, source: QImageViewer):
+        if self._sync and not self._syncing:
+            self._sync_from(source)
+
+    def _sync_from(self, source: QImageViewer):
+        """
+        Move the other viewers to the zoom and center of source.
+        """
+        self._syncing = True
+        try:
+            state = source.get_view_state()
+            for viewer in self._viewers:
+                if viewer is not source:
+                    viewer.set_view_state(*state)
+        finally:
+            self._syncing = False
@@ -0,0 +1,153 @@
+"""
+Colour mapped mask / heat map overlay
+"""
+
+import sys
+from functools import lru_cache
+from typing import Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from PySide.QtCore import Qt, QRectF
+from PySide.QtGui import QGraphicsItem, QImage, QPixmap
+
+from image_item import ImagePixmapItem
+
+# a cv2.COLORMAP_* value or a list of (r, g, b) colours indexed by the mask values
+Colormap = Union[int, Sequence[Tuple[int, int, int]]]
+
+
+@lru_cache(maxsize=32)
+def _lut(colormap: Union[int, tuple], alpha: float, zero_transparent: bool) -> np.ndarray:
+    if isinstance(colormap, int):
+        bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), colormap).reshape(256, 3)
+        a = np.full(256, round(alpha * 255), np.uint16)
+    else:
+        bgr = np.zeros((256, 3), np.uint8)
+        colors = np.array(colormap[:256], np.uint8).reshape(-1, 3)
+        bgr[:len(colors)] = colors[:, ::-1]
+        a = np.zeros(256, np.uint16)
+        a[:len(colors)] = round(alpha * 255)
+    if zero_transparent:
+        a[0] = 0
+    # premultiplied B, G, R, A, the byte order of Format_ARGB32_Premultiplied on little endian machines
+    lut = np.empty((256, 4), np.uint8)
+    lut[:, :3] = (bgr.astype(np.uint16) * a[:, None] + 127) // 255
+    lut[:, 3] = a
+    if sys.byteorder != "little":
+        lut = np.ascontiguousarray(lut[:, ::-1])
+    lut.setflags(write=False)
+    return lut
+
+
+def colormap_lut(colormap: Colormap, alpha: float, zero_transparent: bool=True) -> np.ndarray:
+    """
+    Premultiplied ARGB32 colours of the 256 mask values, cached by colormap and alpha.
+    :param colormap: a cv2.COLORMAP_* value or a list of (r, g, b) colours, values beyond the list are transparent
+    :param alpha: opacity 0 - 1
+    :param zero_transparent: value 0 (background) is transparent
+    :return: (256, 4) uint8
+    """
+    if not isinstance(colormap, int):
+        colormap = tuple(tuple(int(c) for c in color) for color in colormap)
+    return _lut(colormap, float(alpha), bool(zero_transparent))
+
+
+def mask_index(mask: np.ndarray) -> np.ndarray:
+    """
+    uint8 lookup indices of mask values: bool to 0/1, float 0 - 1 to 0 - 255, integers clipped to 0 - 255.
+    """
+    if mask.dtype == np.uint8:
+        return mask
+    if mask.dtype == np.bool_:
+        return mask.view(np.uint8)
+    if mask.dtype.kind == "f":
+        return (np.nan_to_num(np.clip(mask, 0, 1)) * 255 + 0.5).astype(np.uint8)
+    return np.clip(mask, 0, 255).astype(np.uint8)
+
+
+class OverlayItem(ImagePixmapItem):
+    """
+    Shows a mask colour mapped at display resolution over an image.
+
+    The mask is sampled (nearest) at the resolution the image is displayed at, so no full
+    resolution pixmap is made. The item is scaled onto the scene rect of the image.
+    update_region() maps and uploads only the display pixels of a changed mask region, see
+    ImagePixmapItem.paint_region().
+    """
+    def __init__(self, parent: QGraphicsItem=None):
+        super(OverlayItem, self).__init__(parent)
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self._mask: np.ndarray = None
+        self._lut: np.ndarray = None
+        self._rows: np.ndarray = None   # mask row of each display row
+        self._cols: np.ndarray = None
+        self._buffer: np.ndarray = None     # display sized premultiplied ARGB32
+
+    def mask(self) -> np.ndarray:
+        return self._mask
+
+    def set_mask(self, mask: np.ndarray, lut: np.ndarray, display_size: Tuple[int, int], scene_rect: QRectF):
+        """
+        :param mask: 2-D mask, it is referenced, not copied
+        :param lut: see colormap_lut()
+        :param display_size: (width, height) the mask is sampled at
+        :param scene_rect: the mask is stretched onto this rect
+        :return:
+        """
+        self._mask = mask
+        self._lut = lut
+        self._buffer = None
+        self.relayout(display_size, scene_rect)
+
+    def set_lut(self, lut: np.ndarray):
+        self._lut = lut
+        self.update_region(0, 0, self._mask.shape[1], self._mask.shape[0])
+
+    def clear(self):
+        self._mask = self._lut = self._rows = self._cols = self._buffer = None
+        self.setPixmap(QPixmap())
+
+    def relayout(self, display_size: Tuple[int, int], scene_rect: QRectF):
+        """
+        Follow the image to a new display size or scene rect, the mask is only sampled
+        again if the display size changed.
+        """
+        if self._mask is None:
+            return
+        mask_h, mask_w = self._mask.shape
+        width = max(1, min(mask_w, display_size[0]))
+        height = max(1, min(mask_h, display_size[1]))
+        if self._buffer is None or self._buffer.shape[:2] != (height, width):
+            self._cols = ((np.arange(width) + 0.5) * (mask_w / width)).astype(np.intp)
+            self._rows = ((np.arange(height) + 0.5) * (mask_h / height)).astype(np.intp)
+            self._buffer = self._map(self._rows, self._cols)
+            self.setPixmap(QPixmap.fromImage(self._qimage(self._buffer)))
+        self.setPos(scene_rect.topLeft())
+        self.setScale(scene_rect.width() / width if width else 1.0)
+
+    def update_region(self, x: int, y: int, width: int, height: int):
+        """
+        Map and upload the display pixels of a changed mask region.
+        :param x: left of the region in mask pixels
+        :param y: top of the region in mask pixels
+        """
+        if self._mask is None:
+            return
+        c0, c1 = np.searchsorted(self._cols, [x, x + width])
+        r0, r1 = np.searchsorted(self._rows, [y, y + height])
+        if c0 >= c1 or r0 >= r1:
+            return
+        region = self._map(self._rows[r0:r1], self._cols[c0:c1])
+        self._buffer[r0:r1, c0:c1] = region
+        self.paint_region(int(c0), int(r0), self._qimage(region))
+
+    def _map(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        return self._lut[mask_index(self._mask[rows[:, None], cols[None, :]])]
+
+    @staticmethod
+    def _qimage(argb: np.ndarray) -> QImage:
+        argb = np.ascontiguousarray(argb)
+        height, width = argb.shape[:2]
+        # copy, the QImage must not outlive the temporary array
+        return QImage(argb.data, width, height, argb.strides[0], QImage.Format_ARGB32_Premultiplied).copy()
@@ -0,0 +1,100 @@
+"""
+Timings and counters of the image viewer
+"""
+
+import time
+from collections import deque
+from typing import Dict
+
+from PySide.QtGui import QGraphicsView
+
+
+class RunningStat:
+    """
+    Count, last, mean and max of a repeated timing in ms.
+    """
+    __slots__ = ("count", "last", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.last = self.total = self.max = 0.0
+
+    def add(self, ms: float):
+        self.count += 1
+        self.last = ms
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def as_dict(self) -> Dict[str, float]:
+        return {"count": self.count,
+                "last_ms": self.last,
+                "mean_ms": self.total / self.count if self.count else 0.0,
+                "max_ms": self.max}
+
+
+class PerfStats:
+    """
+    Collects the timings of the viewer while enabled, recording is skipped by the callers otherwise.
+    """
+    def __init__(self, fps_window: float=1.0):
+        """
+        :param fps_window: frames painted within this many seconds are counted for the frame rate
+        """
+        self.fps_window = fps_window
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.paint = RunningStat()
+        self.ingest: Dict[str, RunningStat] = {}
+        self.tools: Dict[str, RunningStat] = {}
+        self._frames = deque()
+
+    def record_paint(self, ms: float):
+        now = time.perf_counter()
+        self.paint.add(ms)
+        self._frames.append(now)
+        while self._frames[0] < now - self.fps_window:
+            self._frames.popleft()
+
+    def record_ingest(self, timings: Dict[str, float]):
+        """
+        :param timings: ms of the stages of an image ingest, see StageTimer
+        """
+        for stage, ms in timings.items():
+            self.ingest.setdefault(stage, RunningStat()).add(ms)
+        self.ingest.setdefault("total", RunningStat()).add(sum(timings.values()))
+
+    def record_tool(self, tool: str, ms: float):
+        self.tools.setdefault(tool, RunningStat()).add(ms)
+
+    def fps(self) -> float:
+        now = time.perf_counter()
+        while self._frames and self._frames[0] < now - self.fps_window:
+            self._frames.popleft()
+        return len(self._frames) / self.fps_window
+
+    def as_dict(self) -> Dict:
+        return {"fps": self.fps(),
+                "paint": self.paint.as_dict(),
+                "ingest": {stage: stat.as_dict() for stage, stat in self.ingest.items()},
+                "tools": {tool: stat.as_dict() for tool, stat in self.tools.items()}}
+
+
+class TimedGraphicsView(QGraphicsView):
+    """
+    QGraphicsView which reports the time of each viewport paint to a PerfStats while it is enabled.
+    """
+    def __init__(self, *args):
+        super(TimedGraphicsView, self).__init__(*args)
+        self.stats: PerfStats = None
+
+    def paintEvent(self, event):
+        stats = self.stats
+        if stats is None or not stats.enabled:
+            super(TimedGraphicsView, self).paintEvent(event)
+            return
+        start = time.perf_counter()
+        super(TimedGraphicsView, self).paintEvent(event)
+        stats.record_paint((time.perf_counter() - start) * 1000)
@@ -5,8 +5,8 @@ ROI item
 from enum import Enum, unique
 
 from PySide.QtCore import Qt, QRectF, QPointF
-from PySide.QtGui import QBrush, QPainterPath, QPainter, QPen
-from PySide.QtGui import QGraphicsRectItem, QGraphicsItem
+from PySide.QtGui import QBrush, QColor, QPainterPath, QPainter, QPen
+from PySide.QtGui import QGraphicsRectItem, QGraphicsItem, QStyleOptionGraphicsItem
 
 
 @unique
@@ -39,9 +39,21 @@ class QGraphicsRoiItem(QGraphicsRectItem):
         handleBottomRight: Qt.SizeFDiagCursor,
     }
 
-    def __init__(self, roi_type: RoiType, *args):
+    mutableFlags = (QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemIsSelectable |
+                    QGraphicsItem.ItemSendsGeometryChanges | QGraphicsItem.ItemIsFocusable)
+
+    # level of detail, sizes on screen in pixels below which details are dropped
+    lodHandleSize = 24      # handles are not drawn
+    lodShapeSize = 6        # ellipses are drawn as rects
+    lodPointSize = 2        # the ROI is drawn as a point
+
+    # (outline pen, handle pen, handle brush) by colour, shared by all items
+    _paintTools = {}
+
+    def __init__(self, roi_type: RoiType, *args, mutable: bool=True):
         """
         Initialize the shape.
+        Handles are positioned when they are shown, see set_show_handle().
         """
         super(QGraphicsRoiItem, self).__init__(*args)
         self.roi_type = roi_type
@@ -50,8 +62,13 @@ class QGraphicsRoiItem(QGraphicsRectItem):
         self.handleSelected = None
         self.mousePressPos = None
         self.mousePressRect = None
-        self.set_mutable(True)
-        self.update_handles_pos()
+        self.geometry_changed = None    # callback(item) when the rect is changed
+        self.set_mutable(mutable)
+
+    def setRect(self, *args):
+        super(QGraphicsRoiItem, self).setRect(*args)
+        if self.geometry_changed is not None:
+            self.geometry_changed(self)
 
     def focusOutEvent(self, *args, **kwargs):
         self.set_show_handle(False)
@@ -252,20 +269,46 @@ class QGraphicsRoiItem(QGraphicsRectItem):
                 path.addEllipse(shape)
         return path
 
+    @classmethod
+    def paint_tools(cls, color) -> tuple:
+        """
+        Cached (outline pen, handle pen, handle brush) of a colour.
+        """
+        try:
+            return cls._paintTools[color]
+        except (KeyError, TypeError):
+            pass
+        key = color if isinstance(color, Qt.GlobalColor) else QColor(color).rgba()
+        tools = cls._paintTools.get(key)
+        if tools is None:
+            tools = cls._paintTools[key] = (QPen(color, 1.0, Qt.SolidLine),
+                                            QPen(color, 1.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin),
+                                            QBrush(color))
+        return tools
+
     def paint(self, painter, option, widget=None):
         """
         Paint the node in the graphic view.
+        Zoomed out, handles are dropped, ellipses are drawn as rects and tiny ROIs as points.
         """
-        # painter.setBrush(QBrush(QColor(255, 0, 0, 100)))
-        painter.setPen(QPen(self.color, 1.0, Qt.SolidLine))
-        if self.roi_type == RoiType.Rect:
-            painter.drawRect(self.rect())
+        outline, handle_pen, handle_brush = self.paint_tools(self.color)
+        rect = self.rect()
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        size = max(rect.width(), rect.height()) * lod
+        painter.setPen(outline)
+        if size < self.lodPointSize:
+            painter.drawPoint(rect.center())
+            return
+        if self.roi_type == RoiType.Rect or size < self.lodShapeSize:
+            painter.drawRect(rect)
         else:
-            painter.drawEllipse(self.rect())
+            painter.drawEllipse(rect)
 
+        if not self.handles or size < self.lodHandleSize or not self.handleSize:
+            return
         painter.setRenderHint(QPainter.Antialiasing)
-        painter.setBrush(QBrush(self.color))
-        painter.setPen(QPen(self.color, 1.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        painter.setBrush(handle_brush)
+        painter.setPen(handle_pen)
         for handle, rect in self.handles.items():
             if self.handleSelected is None or handle == self.handleSelected:
                 painter.drawEllipse(rect)
@@ -276,10 +319,10 @@ class QGraphicsRoiItem(QGraphicsRectItem):
         """
         self.setAcceptHoverEvents(status)
         self.setAcceptedMouseButtons(status)
-        self.setFlag(QGraphicsItem.ItemIsMovable, status)
-        self.setFlag(QGraphicsItem.ItemIsSelectable, status)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, status)
-        self.setFlag(QGraphicsItem.ItemIsFocusable, status)
+        if status:
+            self.setFlags(self.flags() | self.mutableFlags)
+        else:
+            self.setFlags(self.flags() & ~self.mutableFlags)
 
     def set_show_handle(self, status: bool):
         if status:
@@ -0,0 +1,90 @@
+"""
+Binary ROI file format
+
+A file is a 16 byte header followed by packed little endian records of RECORD_DTYPE.
+The number of records follows from the file size, so records can be appended
+without rewriting the header and a file can be loaded by one np.fromfile()
+or memory mapped.
+"""
+
+import os
+
+import numpy as np
+
+MAGIC = b"IVROI"
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([("magic", "S6"),
+                         ("version", "<u2"),
+                         ("record_size", "<u4"),
+                         ("reserved", "<u4")])
+
+RECORD_DTYPE = np.dtype([("type", "<u1"),
+                         ("x", "<f8"),
+                         ("y", "<f8"),
+                         ("w", "<f8"),
+                         ("h", "<f8"),
+                         ("color", "<u4")])     # QColor.rgba()
+
+
+def _header() -> np.ndarray:
+    return np.array([(MAGIC, VERSION, RECORD_DTYPE.itemsize, 0)], HEADER_DTYPE)
+
+
+def _check_header(file_path: str):
+    header = np.fromfile(file_path, HEADER_DTYPE, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError("%s is not an ROI file!" % file_path)
+    if header["version"][0] != VERSION or header["record_size"][0] != RECORD_DTYPE.itemsize:
+        raise ValueError("Unsupported ROI file version %d!" % header["version"][0])
+
+
+def to_records(rois: np.ndarray) -> np.ndarray:
+    """
+    Convert an array with type, x, y, w, h and color fields (e.g. of a RoiStore) to RECORD_DTYPE.
+    """
+    records = np.zeros(len(rois), RECORD_DTYPE)
+    for name in RECORD_DTYPE.names:
+        records[name] = rois[name]
+    return records
+
+
+def save_rois(file_path: str, rois: np.ndarray):
+    """
+    Write rois to a new file, an existing file is replaced.
+    :param rois: array with type, x, y, w, h and color fields
+    :return:
+    """
+    with open(file_path, "wb") as f:
+        _header().tofile(f)
+        to_records(rois).tofile(f)
+
+
+def append_rois(file_path: str, rois: np.ndarray):
+    """
+    Append rois to a file, the file is created if it doesn't exist.
+    :param rois: array with type, x, y, w, h and color fields
+    :return:
+    """
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        save_rois(file_path, rois)
+        return
+    _check_header(file_path)
+    with open(file_path, "ab") as f:
+        to_records(rois).tofile(f)
+
+
+def load_rois(file_path: str, mmap: bool=False) -> np.ndarray:
+    """
+    Read all records of a file.
+    :param mmap: memory map the records instead of reading them
+    :return: array of RECORD_DTYPE
+    """
+    _check_header(file_path)
+    offset = HEADER_DTYPE.itemsize
+    if mmap:
+        count = (os.path.getsize(file_path) - offset) // RECORD_DTYPE.itemsize
+        if not count:
+            return np.zeros(0, RECORD_DTYPE)
+        return np.memmap(file_path, RECORD_DTYPE, mode="r", offset=offset, shape=(count,))
+    return np.fromfile(file_path, RECORD_DTYPE, offset=offset)
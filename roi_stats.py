@@ -0,0 +1,168 @@
+"""
+Vectorized statistics of ROIs over an image
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from roi import RoiType
+
+# max number of pixels gathered at once for a group of equally sized ROIs
+CHUNK_PIXELS = 1 << 24
+
+
+@lru_cache(maxsize=256)
+def ellipse_mask(height: int, width: int) -> np.ndarray:
+    """
+    Boolean mask of the pixels whose centres are inside the ellipse inscribed in height x width.
+    """
+    yy, xx = np.ogrid[:height, :width]
+    ry, rx = height / 2, width / 2
+    mask = ((xx + 0.5 - rx) / rx) ** 2 + ((yy + 0.5 - ry) / ry) ** 2 <= 1
+    mask.setflags(write=False)
+    return mask
+
+
+def stats_dtype(channels: int) -> np.dtype:
+    shape = () if channels == 1 else (channels,)
+    return np.dtype([("type", np.uint8),
+                     ("x", np.int64), ("y", np.int64), ("w", np.int64), ("h", np.int64),
+                     ("count", np.int64),
+                     ("sum", np.float64, shape),
+                     ("mean", np.float64, shape),
+                     ("std", np.float64, shape),
+                     ("min", np.float64, shape),
+                     ("max", np.float64, shape)])
+
+
+def _windows(image: np.ndarray, height: int, width: int, ys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+    """
+    Gather the height x width blocks at (ys, xs) without copying the image first.
+    :return: (n, height, width[, channels])
+    """
+    strides = image.strides[:2] + image.strides
+    shape = (image.shape[0] - height + 1, image.shape[1] - width + 1, height, width) + image.shape[2:]
+    return as_strided(image, shape, strides, writeable=False)[ys, xs]
+
+
+def _reduce_group(image: np.ndarray, mask: np.ndarray, ys: np.ndarray, xs: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    min, max, sum and sum of squares of equally sized blocks, only pixels in mask are used.
+    """
+    height, width = mask.shape
+    block = _windows(image, height, width, ys, xs).astype(np.float64)
+    if image.ndim == 3:
+        mask = mask[:, :, None]
+    if mask.all():
+        values = block
+        low = high = block
+    else:
+        values = np.where(mask, block, 0)
+        low = np.where(mask, block, np.inf)
+        high = np.where(mask, block, -np.inf)
+    return {"sum": values.sum(axis=(1, 2)),
+            "sqsum": (values * values).sum(axis=(1, 2)),
+            "min": low.min(axis=(1, 2)),
+            "max": high.max(axis=(1, 2))}
+
+
+def roi_statistics(image: np.ndarray, types: np.ndarray, rects: np.ndarray, workers: int=None) -> np.ndarray:
+    """
+    Statistics of Rect and Ellipse ROIs.
+
+    ROIs are grouped by pixel size and every group is reduced in one NumPy pass,
+    ellipse masks are cached by size. Rect sums come from the integral image.
+    :param image: gray scale or multi channel image, any dtype
+    :param types: RoiType values, shape (n,)
+    :param rects: (x, y, w, h) in image pixels, shape (n, 4); they are rounded to pixels and clipped
+    :param workers: reduce the groups on a thread pool of this size
+    :return: structured array of stats_dtype(), ROIs without pixels have count 0 and nan stats
+    """
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    types = np.asarray(types, np.uint8)
+    rects = np.asarray(rects, np.float64).reshape(-1, 4)
+    im_h, im_w = image.shape[:2]
+
+    # unclipped pixel bounds
+    x0 = np.round(rects[:, 0]).astype(np.int64)
+    y0 = np.round(rects[:, 1]).astype(np.int64)
+    x1 = np.round(rects[:, 0] + rects[:, 2]).astype(np.int64)
+    y1 = np.round(rects[:, 1] + rects[:, 3]).astype(np.int64)
+    cx0, cy0 = np.clip(x0, 0, im_w), np.clip(y0, 0, im_h)
+    cx1, cy1 = np.clip(x1, 0, im_w), np.clip(y1, 0, im_h)
+
+    n = len(rects)
+    result = np.zeros(n, stats_dtype(channels))
+    result["type"] = types
+    result["x"], result["y"] = cx0, cy0
+    result["w"], result["h"] = cx1 - cx0, cy1 - cy0
+    sums = np.zeros((n, channels)) if channels > 1 else np.zeros(n)
+    sqsums = np.zeros_like(sums)
+    mins = np.full_like(sums, np.nan)
+    maxs = np.full_like(sums, np.nan)
+    counts = np.zeros(n, np.int64)
+
+    is_ellipse = types == RoiType.Ellipse.value
+    has_pixels = (result["w"] > 0) & (result["h"] > 0)
+
+    # rects: sums from the integral image, clipping doesn't matter
+    rect_rows = np.flatnonzero(~is_ellipse & has_pixels)
+    if len(rect_rows):
+        s, sq = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        a, b, c, d = (cy0[rect_rows], cx0[rect_rows]), (cy0[rect_rows], cx1[rect_rows]), \
+                     (cy1[rect_rows], cx0[rect_rows]), (cy1[rect_rows], cx1[rect_rows])
+        sums[rect_rows] = (s[d] - s[b] - s[c] + s[a]).reshape(sums[rect_rows].shape)
+        sqsums[rect_rows] = (sq[d] - sq[b] - sq[c] + sq[a]).reshape(sums[rect_rows].shape)
+        counts[rect_rows] = result["w"][rect_rows] * result["h"][rect_rows]
+
+    # ellipses crossing the image border are cut, their mask is cut alike
+    inside = (x0 == cx0) & (y0 == cy0) & (x1 == cx1) & (y1 == cy1)
+    jobs: List[Tuple[np.ndarray, np.ndarray, bool]] = []    # (rows, mask, need sums)
+    groups: Dict[Tuple[int, int, bool], List[int]] = {}
+    for row in np.flatnonzero(has_pixels).tolist():
+        if is_ellipse[row] and not inside[row]:
+            full = ellipse_mask(int(y1[row] - y0[row]), int(x1[row] - x0[row]))
+            mask = full[cy0[row] - y0[row]:cy1[row] - y0[row], cx0[row] - x0[row]:cx1[row] - x0[row]]
+            jobs.append((np.array([row]), mask, True))
+        else:
+            groups.setdefault((int(result["h"][row]), int(result["w"][row]), bool(is_ellipse[row])), []).append(row)
+    for (height, width, ellipse), rows in groups.items():
+        mask = ellipse_mask(height, width) if ellipse else np.ones((height, width), np.bool_)
+        rows = np.array(rows)
+        step = max(1, CHUNK_PIXELS // (height * width * channels))
+        for i in range(0, len(rows), step):
+            jobs.append((rows[i:i + step], mask, ellipse))
+
+    def run(job):
+        rows, mask, need_sums = job
+        return job, _reduce_group(image, mask, cy0[rows], cx0[rows])
+
+    if workers and workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reduced = list(executor.map(run, jobs))
+    else:
+        reduced = [run(job) for job in jobs]
+
+    for (rows, mask, need_sums), values in reduced:
+        mins[rows] = values["min"]
+        maxs[rows] = values["max"]
+        if need_sums:
+            sums[rows] = values["sum"]
+            sqsums[rows] = values["sqsum"]
+            counts[rows] = int(mask.sum())
+
+    result["count"] = counts
+    result["sum"] = sums
+    result["min"] = mins
+    result["max"] = maxs
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = counts.reshape((-1,) + (1,) * (sums.ndim - 1)).astype(np.float64)
+        mean = sums / count
+        result["mean"] = mean
+        result["std"] = np.sqrt(np.maximum(sqsums / count - mean * mean, 0))
+    return result
@@ -0,0 +1,209 @@
+"""
+Array backed ROI store and its batch renderer
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+from PySide.QtCore import Qt, QRectF
+from PySide.QtGui import QColor, QGraphicsItem, QPainterPath, QPen
+
+from roi import RoiType
+
+ROI_DTYPE = np.dtype([("id", np.uint32),
+                      ("type", np.uint8),
+                      ("x", np.float64),
+                      ("y", np.float64),
+                      ("w", np.float64),
+                      ("h", np.float64),
+                      ("color", np.uint32),     # QColor.rgba()
+                      ("selected", np.bool_)])
+
+
+class RoiStore:
+    """
+    ROIs kept as rows of a NumPy structured array (see ROI_DTYPE).
+
+    Rows are identified by their id, which stays the same when other rows are removed.
+    Queries are vectorized and use the same strict overlap test as QImageViewer.is_overlap().
+    version is increased on every change, so renderers can cache what they build from the rows.
+    """
+    def __init__(self, capacity: int=1024):
+        self._data = np.zeros(capacity, ROI_DTYPE)
+        self._count = 0
+        self._next_id = 0
+        self.version = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def data(self) -> np.ndarray:
+        """
+        View of the used rows, changes made through it must be followed by touch().
+        """
+        return self._data[:self._count]
+
+    def touch(self):
+        self.version += 1
+
+    def append(self, rois: np.ndarray) -> np.ndarray:
+        """
+        Append rows, the id field is assigned by the store.
+        :param rois: array of ROI_DTYPE (or with a subset of its fields)
+        :return: ids of the new rows
+        """
+        count = len(rois)
+        if self._count + count > len(self._data):
+            capacity = max(2 * len(self._data), self._count + count)
+            data = np.zeros(capacity, ROI_DTYPE)
+            data[:self._count] = self._data[:self._count]
+            self._data = data
+
+        new = self._data[self._count:self._count + count]
+        new[...] = 0
+        for name in rois.dtype.names:
+            new[name] = rois[name]
+        ids = np.arange(self._next_id, self._next_id + count, dtype=np.uint32)
+        new["id"] = ids
+        self._next_id += count
+        self._count += count
+        self.touch()
+        return ids
+
+    def add(self, roi_type: RoiType, x: float, y: float, width: float, height: float, color: int) -> int:
+        row = np.array([(0, roi_type.value, x, y, width, height, color, False)], ROI_DTYPE)
+        return int(self.append(row)[0])
+
+    def rows(self, ids) -> np.ndarray:
+        """
+        Row indices of the given ids, unknown ids are ignored.
+        """
+        return np.flatnonzero(np.isin(self.data["id"], ids))
+
+    def remove(self, ids):
+        keep = ~np.isin(self.data["id"], ids)
+        count = int(keep.sum())
+        self._data[:count] = self.data[keep]
+        self._count = count
+        self.touch()
+
+    def clear(self):
+        self._count = 0
+        self.touch()
+
+    def set_selected(self, ids, status: bool):
+        self.data["selected"][self.rows(ids)] = status
+        self.touch()
+
+    def query_point(self, x: float, y: float, margin: float=0) -> np.ndarray:
+        """
+        Ids of the not selected ROIs strictly containing the point.
+        :param margin: grow every ROI by margin on each side
+        """
+        d = self.data
+        hit = ((d["x"] - margin < x) & (x < d["x"] + d["w"] + margin) &
+               (d["y"] - margin < y) & (y < d["y"] + d["h"] + margin) & ~d["selected"])
+        return d["id"][hit]
+
+    def query_rect(self, x0: float, y0: float, x1: float, y1: float, margin: float=0) -> np.ndarray:
+        """
+        Ids of the not selected ROIs overlapping the rect (x0, y0, x1, y1).
+        :param margin: grow every ROI by margin on each side
+        """
+        d = self.data
+        hit = ((d["x"] + d["w"] + margin > x0) & (x1 > d["x"] - margin) &
+               (d["y"] + d["h"] + margin > y0) & (y1 > d["y"] - margin) & ~d["selected"])
+        return d["id"][hit]
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """
+        (x0, y0, x1, y1) of all rows, zeros if empty.
+        """
+        d = self.data
+        if not len(d):
+            return 0.0, 0.0, 0.0, 0.0
+        return (float(d["x"].min()), float(d["y"].min()),
+                float((d["x"] + d["w"]).max()), float((d["y"] + d["h"]).max()))
+
+
+class RoiBatchItem(QGraphicsItem):
+    """
+    Draws all not selected ROIs of a RoiStore.
+
+    Rows are grouped by type and colour, every group is one cached QPainterPath
+    which is rebuilt only when the store version changes. When only a small part
+    of the rows is exposed, e.g. zoomed in, just the exposed rows are drawn.
+    The item doesn't take mouse events, interactive ROIs are real QGraphicsRoiItems above it.
+    """
+    # draw the exposed rows one by one if they are less than this part of all rows
+    cull_ratio = 0.25
+
+    def __init__(self, store: RoiStore, parent: QGraphicsItem=None):
+        super(RoiBatchItem, self).__init__(parent)
+        self.store = store
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)   # for option.exposedRect
+        self._version = -1
+        self._paths: Dict[Tuple[int, int], QPainterPath] = {}
+        self._bounds = QRectF()
+
+    def store_changed(self):
+        """
+        Call after the store was changed to repaint the item.
+        """
+        self.prepareGeometryChange()
+        x0, y0, x1, y1 = self.store.bounds()
+        # leave room for the pen
+        self._bounds = QRectF(x0, y0, x1 - x0, y1 - y0).adjusted(-1, -1, 1, 1)
+        self.update()
+
+    def boundingRect(self):
+        return self._bounds
+
+    def _build_paths(self):
+        self._paths.clear()
+        d = self.store.data
+        d = d[~d["selected"]]
+        for roi_type in np.unique(d["type"]):
+            of_type = d[d["type"] == roi_type]
+            for color in np.unique(of_type["color"]):
+                rows = of_type[of_type["color"] == color]
+                path = QPainterPath()
+                add = path.addRect if roi_type == RoiType.Rect.value else path.addEllipse
+                for x, y, w, h in zip(rows["x"].tolist(), rows["y"].tolist(),
+                                      rows["w"].tolist(), rows["h"].tolist()):
+                    add(x, y, w, h)
+                self._paths[(int(roi_type), int(color))] = path
+        self._version = self.store.version
+
+    def _exposed_rows(self, rect: QRectF) -> np.ndarray:
+        d = self.store.data
+        # grow by the pen width
+        x0, y0, x1, y1 = rect.left() - 1, rect.top() - 1, rect.right() + 1, rect.bottom() + 1
+        hit = ((d["x"] + d["w"] > x0) & (x1 > d["x"]) &
+               (d["y"] + d["h"] > y0) & (y1 > d["y"]) & ~d["selected"])
+        return d[hit]
+
+    def paint(self, painter, option, widget=None):
+        painter.setBrush(Qt.NoBrush)
+        rows = self._exposed_rows(option.exposedRect)
+        if len(rows) < self.cull_ratio * len(self.store):
+            pens = {}
+            for roi_type, x, y, w, h, color in zip(rows["type"].tolist(), rows["x"].tolist(), rows["y"].tolist(),
+                                                   rows["w"].tolist(), rows["h"].tolist(), rows["color"].tolist()):
+                pen = pens.get(color)
+                if pen is None:
+                    pen = pens[color] = QPen(QColor.fromRgba(color), 1.0, Qt.SolidLine)
+                painter.setPen(pen)
+                if roi_type == RoiType.Rect.value:
+                    painter.drawRect(QRectF(x, y, w, h))
+                else:
+                    painter.drawEllipse(QRectF(x, y, w, h))
+            return
+
+        if self._version != self.store.version:
+            self._build_paths()
+        for (_, color), path in self._paths.items():
+            painter.setPen(QPen(QColor.fromRgba(color), 1.0, Qt.SolidLine))
+            painter.drawPath(path)
@@ -0,0 +1,123 @@
+"""
+Uniform grid spatial index for hit testing of scene items
+"""
+
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+Rect = Tuple[float, float, float, float]    # (x0, y0, x1, y1)
+
+
+class GridIndex:
+    """
+    Buckets items by the grid cells their bounding rect covers.
+
+    Point and rect queries only look at the items of the covered cells. The tests
+    are strict like QImageViewer.is_overlap(), touching edges don't overlap.
+    """
+    def __init__(self, cell_size: float=64):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Set[Hashable]] = {}
+        self._rects: Dict[Hashable, Rect] = {}
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, item: Hashable):
+        return item in self._rects
+
+    def _cell_range(self, x0: float, y0: float, x1: float, y1: float):
+        s = self.cell_size
+        return int(x0 // s), int(y0 // s), int(x1 // s), int(y1 // s)
+
+    def insert(self, item: Hashable, rect: Rect):
+        """
+        Add an item or update its rect.
+        :param item: hashable key, e.g. the graphics item itself
+        :param rect: (x0, y0, x1, y1) in scene coordinates
+        :return:
+        """
+        if item in self._rects:
+            self.remove(item)
+        self._rects[item] = rect
+        cx0, cy0, cx1, cy1 = self._cell_range(*rect)
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                self._cells.setdefault((cx, cy), set()).add(item)
+
+    update = insert
+
+    def insert_many(self, items: Iterable[Hashable], rects: Iterable[Rect]):
+        """
+        Add items or update their rects at once.
+        Items which stay in the same cells, e.g. moved a little, keep their buckets.
+        """
+        s = self.cell_size
+        cells = self._cells
+        for item, rect in zip(items, rects):
+            rect = tuple(rect)
+            cell_range = (int(rect[0] // s), int(rect[1] // s), int(rect[2] // s), int(rect[3] // s))
+            old = self._rects.get(item)
+            if old is not None:
+                if (int(old[0] // s), int(old[1] // s), int(old[2] // s), int(old[3] // s)) == cell_range:
+                    self._rects[item] = rect
+                    continue
+                self.remove(item)
+            self._rects[item] = rect
+            cx0, cy0, cx1, cy1 = cell_range
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    cells.setdefault((cx, cy), set()).add(item)
+
+    def remove(self, item: Hashable):
+        rect = self._rects.pop(item, None)
+        if rect is None:
+            return
+        cx0, cy0, cx1, cy1 = self._cell_range(*rect)
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(item)
+                    if not cell:
+                        del self._cells[(cx, cy)]
+
+    def clear(self):
+        self._cells.clear()
+        self._rects.clear()
+
+    def rect(self, item: Hashable) -> Rect:
+        return self._rects[item]
+
+    def query_point(self, x: float, y: float) -> List[Hashable]:
+        """
+        Items whose rect strictly contains the point.
+        """
+        s = self.cell_size
+        result = []
+        for item in self._cells.get((int(x // s), int(y // s)), ()):
+            x0, y0, x1, y1 = self._rects[item]
+            if x0 < x < x1 and y0 < y < y1:
+                result.append(item)
+        return result
+
+    def query_rect(self, x0: float, y0: float, x1: float, y1: float) -> Set[Hashable]:
+        """
+        Items whose rect overlaps the rect (x0, y0, x1, y1).
+        """
+        cx0, cy0, cx1, cy1 = self._cell_range(x0, y0, x1, y1)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # a large query rect covers more cells than there are filled ones
+            candidates = self._rects.keys()
+        else:
+            candidates = set()
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    candidates.update(self._cells.get((cx, cy), ()))
+
+        result = set()
+        rects = self._rects
+        for item in candidates:
+            r = rects[item]
+            if r[2] > x0 and x1 > r[0] and r[3] > y0 and y1 > r[1]:
+                result.add(item)
+        return result
@@ -0,0 +1,425 @@
+"""
+Tiled multi-resolution image item
+"""
+
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Set, Tuple, Union
+
+import cv2
+import numpy as np
+from PySide.QtCore import Qt, QRectF, Signal
+from PySide.QtGui import QGraphicsObject, QGraphicsPixmapItem, QGraphicsView, QImage, QPixmap
+from PySide.QtGui import QStyleOptionGraphicsItem
+
+from display_lut import apply_window
+from image_convert import wrap_ndarray
+from image_source import ImageSource
+
+TileKey = Tuple[int, int, int]     # (level, tile x, tile y)
+Window = Tuple[float, float, float]     # (low, high, gamma), see display_lut.apply_window()
+
+
+class TilePyramid:
+    """
+    Lazily built mip pyramid of an image, cut into square tiles.
+    Level n is the source image down sampled by 2**n, the top level fits in a single tile.
+    The source is an ndarray or an ImageSource, only the regions of requested tiles are read.
+    """
+    def __init__(self, source: Union[np.ndarray, ImageSource], tile_size: int=256):
+        self.source = source
+        self.tile_size = tile_size
+        self.height, self.width = source.shape[:2]
+        self.max_level = max(0, math.ceil(math.log2(max(self.width, self.height) / tile_size)))
+
+    def tile_span(self, level: int) -> int:
+        """
+        Size of a tile of the given level in source pixels.
+        """
+        return self.tile_size << level
+
+    def tile_range(self, level: int, rect: QRectF) -> Tuple[range, range]:
+        """
+        Tiles of the given level which intersect rect (in source pixels).
+        :return: (range of tile x, range of tile y)
+        """
+        span = self.tile_span(level)
+        x0 = max(0, int(rect.left() // span))
+        y0 = max(0, int(rect.top() // span))
+        x1 = min((self.width - 1) // span, int(rect.right() // span))
+        y1 = min((self.height - 1) // span, int(rect.bottom() // span))
+        return range(x0, x1 + 1), range(y0, y1 + 1)
+
+    def tile_rect(self, key: TileKey) -> Tuple[int, int, int, int]:
+        """
+        :return: (x0, y0, x1, y1) of the tile in source pixels
+        """
+        level, tx, ty = key
+        span = self.tile_span(level)
+        x0, y0 = tx * span, ty * span
+        return x0, y0, min(x0 + span, self.width), min(y0 + span, self.height)
+
+    def read_tile(self, key: TileKey) -> np.ndarray:
+        """
+        Read and down sample the pixels of a tile in the dtype of the source.
+        Only every (2**level / 2)th line and column is read, the last halving is done by area interpolation.
+        """
+        level = key[0]
+        x0, y0, x1, y1 = self.tile_rect(key)
+        if level == 0:
+            return np.ascontiguousarray(self.source[y0:y1, x0:x1])
+
+        step = 1 << level
+        pre = step >> 1
+        region = np.ascontiguousarray(self.source[y0:y1:pre, x0:x1:pre])
+        size = (-(-(x1 - x0) // step), -(-(y1 - y0) // step))
+        return cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+
+    def build_tile(self, key: TileKey, window: Window=None) -> np.ndarray:
+        """
+        Read a tile and map it to uint8 for display.
+        :param window: window/level of the tile, None leaves the pixels as read, see read_tile()
+        """
+        tile = self.read_tile(key)
+        if window is not None:
+            tile = apply_window(tile, *window)
+        return tile
+
+
+class TileCache:
+    """
+    LRU of built tiles bounded by their bytes, keyed by pyramid and tile.
+    A tile is kept for the window/level it was built with last.
+    Several TiledImageItems can share a cache, they then share the pyramid of a source and the
+    builds in flight, too, so a tile of an image shown in several views is built and kept once.
+    """
+    def __init__(self, max_bytes: int=256 * 1024 * 1024, sources: int=8):
+        """
+        :param max_bytes: memory bound of the tiles
+        :param sources: number of pyramids kept for pyramid(), older ones are dropped with their tiles
+        """
+        self.max_bytes = max_bytes
+        self.sources = sources
+        self._tiles: OrderedDict = OrderedDict()       # (pyramid, key): (QImage, buffer)
+        self._bytes = 0
+        self._pyramids: OrderedDict = OrderedDict()    # (id(source), tile size): TilePyramid
+        self._building: Dict = {}                      # (pyramid, key): (window, Future)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def pyramid(self, source: Union[np.ndarray, ImageSource], tile_size: int) -> TilePyramid:
+        """
+        The pyramid of a source, the same object for the same source and tile size.
+        """
+        key = (id(source), tile_size)
+        pyramid = self._pyramids.get(key)
+        # the pyramid references its source, so the id isn't reused while it is kept
+        if pyramid is None or pyramid.source is not source:
+            pyramid = self._pyramids[key] = TilePyramid(source, tile_size)
+        self._pyramids.move_to_end(key)
+        while len(self._pyramids) > self.sources:
+            _, old = self._pyramids.popitem(last=False)
+            self.drop(old)
+        return pyramid
+
+    def get(self, pyramid: TilePyramid, key: TileKey, window: Window=None) -> Tuple[QImage, np.ndarray]:
+        """
+        :return: (QImage, buffer) of the tile built with window or None, a hit makes the tile the most recently used
+        """
+        tile = self._tiles.get((pyramid, key))
+        if tile is None or tile[2] != window:
+            return None
+        self._tiles.move_to_end((pyramid, key))
+        return tile[:2]
+
+    def put(self, pyramid: TilePyramid, key: TileKey, q_image: QImage, buffer: np.ndarray, window: Window=None):
+        old = self._tiles.pop((pyramid, key), None)
+        if old is not None:
+            self._bytes -= old[1].nbytes
+        self._tiles[(pyramid, key)] = (q_image, buffer, window)
+        entry = self._building.get((pyramid, key))
+        if entry is not None and entry[1].done():
+            del self._building[(pyramid, key)]
+        self._bytes += buffer.nbytes
+        # evict least recently used tiles, the shown ones stay alive through their pixmaps
+        while self._bytes > self.max_bytes and len(self._tiles) > 1:
+            _, (_, old_buffer, _) = self._tiles.popitem(last=False)
+            self._bytes -= old_buffer.nbytes
+
+    def pop(self, pyramid: TilePyramid, key: TileKey):
+        """
+        Remove a tile whose source pixels changed, a build in flight isn't shared any more.
+        """
+        tile = self._tiles.pop((pyramid, key), None)
+        if tile is not None:
+            self._bytes -= tile[1].nbytes
+        self._building.pop((pyramid, key), None)
+
+    def building(self, pyramid: TilePyramid, key: TileKey, window: Window=None) -> Optional[Future]:
+        """
+        :return: the unfinished build of a tile for window by any item sharing the cache or None
+        """
+        entry = self._building.get((pyramid, key))
+        if entry is None:
+            return None
+        if entry[1].done():
+            # finished builds are handed to the cache by put()
+            del self._building[(pyramid, key)]
+            return None
+        return entry[1] if entry[0] == window else None
+
+    def set_building(self, pyramid: TilePyramid, key: TileKey, window: Window, future: Future):
+        self._building[(pyramid, key)] = (window, future)
+
+    def drop(self, pyramid: TilePyramid):
+        """
+        Remove the tiles of a pyramid.
+        """
+        for tile_key in [tile_key for tile_key in self._tiles if tile_key[0] is pyramid]:
+            self._bytes -= self._tiles.pop(tile_key)[1].nbytes
+        for tile_key in [tile_key for tile_key in self._building if tile_key[0] is pyramid]:
+            del self._building[tile_key]
+
+    def clear(self):
+        self._tiles.clear()
+        self._pyramids.clear()
+        self._building.clear()
+        self._bytes = 0
+
+
+class TiledImageItem(QGraphicsObject):
+    """
+    Graphics item showing a TilePyramid in source pixel coordinates.
+
+    Only the tiles which intersect the view at the level matching the current zoom
+    are shown. Tiles are built on a worker pool and kept in a LRU cache bounded
+    by cache_bytes. The top level tile is always shown below as a placeholder.
+    Tiles are mapped to 8 bit by the window/level, see set_window().
+    """
+    tile_ready = Signal(int, object, object)     # generation, key, Future of (QImage, buffer) or None
+
+    def __init__(self, tile_size: int=256, cache_bytes: int=256 * 1024 * 1024, workers: int=None):
+        super(TiledImageItem, self).__init__()
+        self.tile_size = tile_size
+        self.cache_bytes = cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4)
+        executor = self._executor
+        self.destroyed.connect(lambda *args: executor.shutdown(wait=False))
+        self._pyramid: TilePyramid = None
+        self._window: Optional[Window] = None
+        self._generation = 0
+        self._cache = TileCache(cache_bytes)
+        self._shared_cache = False
+        self._pending: Set[TileKey] = set()
+        self._stale: Set[TileKey] = set()   # pending tiles whose source changed while they were built
+        self._wanted: Set[TileKey] = set()
+        self._items: Dict[TileKey, QGraphicsPixmapItem] = {}
+        self.failed_tiles = 0   # tiles whose build raised
+        # queued as well when a shared build finished before it was waited for
+        self.tile_ready.connect(self._on_tile_ready, Qt.QueuedConnection)
+
+    def boundingRect(self):
+        if self._pyramid is None:
+            return QRectF()
+        return QRectF(0, 0, self._pyramid.width, self._pyramid.height)
+
+    def paint(self, painter, option, widget=None):
+        # tiles are child items
+        pass
+
+    def pyramid(self) -> TilePyramid:
+        return self._pyramid
+
+    def set_source(self, source: Union[np.ndarray, ImageSource]):
+        """
+        Show a new image, cached and pending tiles of the old one are dropped.
+        """
+        self.clear()
+        self.prepareGeometryChange()
+        self._pyramid = self._cache.pyramid(source, self.tile_size)
+        self._wanted = {(self._pyramid.max_level, 0, 0)}
+        self._request((self._pyramid.max_level, 0, 0))
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self._generation += 1
+        self._pyramid = None
+        if not self._shared_cache:
+            self._cache.clear()
+        self._pending.clear()
+        self._stale.clear()
+        self._wanted.clear()
+        for item in self._items.values():
+            item.setParentItem(None)
+            if item.scene():
+                item.scene().removeItem(item)
+        self._items.clear()
+
+    def set_window(self, window: Optional[Window]):
+        """
+        Window/level of the tiles, the shown tiles are built again and replaced when they are ready.
+        :param window: (low, high, gamma), see display_lut.apply_window(), None shows 8 bit sources as they are
+        """
+        if window == self._window:
+            return
+        self._window = window
+        if self._pyramid is None:
+            return
+        # tiles in flight were built with the old window
+        self._generation += 1
+        self._pending.clear()
+        self._stale.clear()
+        for key in self._wanted:
+            tile = self._cache.get(self._pyramid, key, window)
+            if tile is None:
+                self._request(key)
+            elif key in self._items:
+                self._items[key].setPixmap(QPixmap.fromImage(tile[0]))
+            else:
+                self._show_tile(key, tile[0])
+
+    def set_cache(self, cache: TileCache=None):
+        """
+        Share a tile cache with other items, None gives the item a cache of its own again.
+        """
+        source = self._pyramid.source if self._pyramid is not None else None
+        self.clear()
+        self._shared_cache = cache is not None
+        self._cache = cache if cache is not None else TileCache(self.cache_bytes)
+        if source is not None:
+            self.set_source(source)
+
+    def level_for_scale(self, scale: float) -> int:
+        """
+        Pyramid level for a view scale (view pixels per source pixel).
+        """
+        if scale <= 0 or scale >= 1:
+            return 0
+        return min(self._pyramid.max_level, int(math.floor(math.log2(1 / scale))))
+
+    def level_for_view(self, view: QGraphicsView) -> int:
+        """
+        Pyramid level shown in view at its current zoom.
+        """
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.sceneTransform() * view.transform())
+        return self.level_for_scale(lod)
+
+    def update_visible(self, view: QGraphicsView):
+        """
+        Show the tiles intersecting the visible area of view, request missing ones.
+        """
+        if self._pyramid is None:
+            return
+        scene_rect = view.mapToScene(view.viewport().rect()).boundingRect()
+        rect = self.mapFromScene(scene_rect).boundingRect() & self.boundingRect()
+        level = self.level_for_view(view)
+
+        top = (self._pyramid.max_level, 0, 0)
+        wanted = {top}
+        if not rect.isEmpty():
+            xs, ys = self._pyramid.tile_range(level, rect)
+            wanted.update((level, tx, ty) for ty in ys for tx in xs)
+        self._wanted = wanted
+
+        for key in list(self._items):
+            if key not in wanted:
+                self.scene().removeItem(self._items.pop(key))
+        for key in wanted:
+            if key in self._items:
+                continue
+            tile = self._cache.get(self._pyramid, key, self._window)
+            if tile is not None:
+                self._show_tile(key, tile[0])
+            else:
+                self._request(key)
+
+    def update_region(self, x: int, y: int, width: int, height: int):
+        """
+        The source changed in a region, tiles of all levels intersecting it are built again.
+        Shown tiles are rebuilt at once and only their items are repainted, cached ones are dropped.
+        """
+        if self._pyramid is None:
+            return
+        rect = QRectF(x, y, width, height)
+        for level in range(self._pyramid.max_level + 1):
+            xs, ys = self._pyramid.tile_range(level, rect)
+            for key in ((level, tx, ty) for ty in ys for tx in xs):
+                if key in self._pending:
+                    self._stale.add(key)
+                if key in self._items:
+                    q_image, buffer = self._build_tile(self._pyramid, key, self._window)
+                    self._cache.put(self._pyramid, key, q_image, buffer, self._window)
+                    self._items[key].setPixmap(QPixmap.fromImage(q_image))
+                else:
+                    self._cache.pop(self._pyramid, key)
+
+    def _request(self, key: TileKey):
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        # wait for the same tile built for another item sharing the cache
+        future = self._cache.building(self._pyramid, key, self._window)
+        if future is None:
+            future = self._executor.submit(self._load_tile, self._generation, self._pyramid, key, self._window)
+            self._cache.set_building(self._pyramid, key, self._window, future)
+        future.add_done_callback(partial(self._tile_built, self._generation, key))
+
+    @staticmethod
+    def _build_tile(pyramid: TilePyramid, key: TileKey, window: Optional[Window]) -> Tuple[QImage, np.ndarray]:
+        q_image, buffer, swapped = wrap_ndarray(pyramid.build_tile(key, window))
+        if swapped:
+            q_image = q_image.rgbSwapped()
+        return q_image, buffer
+
+    def _load_tile(self, generation: int, pyramid: TilePyramid, key: TileKey,
+                   window: Optional[Window]) -> Optional[Tuple[QImage, np.ndarray]]:
+        # runs on a worker thread, QImage is thread safe contrary to QPixmap
+        if generation != self._generation:
+            # superseded, items sharing the build request it again
+            return None
+        return self._build_tile(pyramid, key, window)
+
+    def _tile_built(self, generation: int, key: TileKey, future: Future):
+        # runs on the worker thread which finished the build
+        self.tile_ready.emit(generation, key, future)
+
+    def _on_tile_ready(self, generation: int, key: TileKey, future: Future):
+        if generation != self._generation:
+            return
+        self._pending.discard(key)
+        if future.exception() is not None:
+            # e.g. a read error of the source, the tile is requested again when it is shown next time
+            self._stale.discard(key)
+            self.failed_tiles += 1
+            return
+        tile = future.result()
+        if tile is None or key in self._stale:
+            self._stale.discard(key)
+            if key in self._wanted:
+                self._request(key)
+            return
+        q_image, buffer = tile
+        self._cache.put(self._pyramid, key, q_image, buffer, self._window)
+        if key in self._items:
+            # rebuilt for a new window/level
+            self._items[key].setPixmap(QPixmap.fromImage(q_image))
+        elif key in self._wanted:
+            self._show_tile(key, q_image)
+
+    def _show_tile(self, key: TileKey, q_image: QImage):
+        level = key[0]
+        x0, y0, _, _ = self._pyramid.tile_rect(key)
+        item = QGraphicsPixmapItem(QPixmap.fromImage(q_image), self)
+        item.setPos(x0, y0)
+        item.setScale(1 << level)
+        # finer tiles above coarser ones
+        item.setZValue(-level)
+        self._items[key] = item
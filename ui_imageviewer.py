@@ -5,6 +5,10 @@ UI of ImageViewer
 from PySide.QtGui import *
 from PySide.QtCore import Qt
 
+from analysis_panels import HistogramPanel, ProfilePanel
+from image_item import ImagePixmapItem
+from perf_stats import TimedGraphicsView
+
 
 class ImageViewerUI(QWidget):
     def __init__(self):
@@ -14,12 +18,12 @@ class ImageViewerUI(QWidget):
         self.setLayout(self.v_box)
 
         # image view
-        self.pix_map_item = QGraphicsPixmapItem()
+        self.pix_map_item = ImagePixmapItem()
         self.scene = QGraphicsScene()
         self.scene.setSceneRect(0, 0, 0, 0)
         self.scene.addItem(self.pix_map_item)
 
-        self.view = QGraphicsView(self.scene)
+        self.view = TimedGraphicsView(self.scene)
         self.v_box.addWidget(self.view)
         self.view.setMinimumSize(400, 300)
         self.view.setAlignment(Qt.AlignCenter)
@@ -31,10 +35,21 @@ class ImageViewerUI(QWidget):
         self.roi_group = QGraphicsItemGroup()
         self.roi_group.setHandlesChildEvents(False)
         self.overlay_group = QGraphicsItemGroup()
+        self.overlay_group.setHandlesChildEvents(False)
         self.scene.addItem(self.text_group)
         self.scene.addItem(self.roi_group)
         self.scene.addItem(self.overlay_group)
 
+        # optional histogram and line profile panels, hidden until shown by the viewer
+        self.panel_box = QHBoxLayout()
+        self.v_box.addLayout(self.panel_box)
+        self.histogram_panel = HistogramPanel()
+        self.histogram_panel.setVisible(False)
+        self.panel_box.addWidget(self.histogram_panel)
+        self.profile_panel = ProfilePanel()
+        self.profile_panel.setVisible(False)
+        self.panel_box.addWidget(self.profile_panel)
+
         # cursors
         self.zoom_in_cursor = QCursor(QPixmap(r"pictures\zi.png"))
         self.zoom_out_cursor = QCursor(QPixmap(r"pictures\zo.png"))
@@ -67,6 +82,13 @@ class ImageViewerUI(QWidget):
         self.btn_ellipse.setCheckable(True)
         self.toolbar.addWidget(self.btn_ellipse)
 
+        self.btn_line = QPushButton("Line")
+        self.btn_line.setObjectName("Line")
+        self.btn_line.setToolTip("Profile line(L)")
+        self.btn_line.setShortcut("L")
+        self.btn_line.setCheckable(True)
+        self.toolbar.addWidget(self.btn_line)
+
         self.toolbar.addSeparator()
 
         self.btn_zoom = QPushButton("Zoom")
@@ -0,0 +1,64 @@
+"""
+Cache of images rendered at zoom levels
+"""
+
+import math
+from collections import OrderedDict
+from typing import Hashable
+
+from PySide.QtGui import QPixmap
+
+
+def zoom_step(scale: float, steps_per_octave: int=4) -> int:
+    """
+    Smallest zoom step whose scale 2 ** (step / steps_per_octave) is not below scale.
+    Rendering at quantized steps lets nearby zoom factors share a cached level.
+    """
+    return math.ceil(math.log2(scale) * steps_per_octave - 1e-9)
+
+
+def step_scale(step: int, steps_per_octave: int=4) -> float:
+    return 2 ** (step / steps_per_octave)
+
+
+class ZoomCache:
+    """
+    LRU of pixmaps rendered at zoom levels, bounded by the number of levels and by bytes.
+    """
+    def __init__(self, levels: int=4, max_bytes: int=256 << 20):
+        self.levels = levels
+        self.max_bytes = max_bytes
+        self._pixmaps: "OrderedDict[Hashable, QPixmap]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._pixmaps)
+
+    def __contains__(self, key: Hashable):
+        return key in self._pixmaps
+
+    @staticmethod
+    def _size(pix_map: QPixmap) -> int:
+        return pix_map.width() * pix_map.height() * 4
+
+    def get(self, key: Hashable) -> QPixmap:
+        """
+        :return: the cached pixmap or None, a hit makes the level the most recently used
+        """
+        pix_map = self._pixmaps.get(key)
+        if pix_map is not None:
+            self._pixmaps.move_to_end(key)
+        return pix_map
+
+    def put(self, key: Hashable, pix_map: QPixmap):
+        if key in self._pixmaps:
+            self._bytes -= self._size(self._pixmaps.pop(key))
+        self._pixmaps[key] = pix_map
+        self._bytes += self._size(pix_map)
+        while len(self._pixmaps) > 1 and (len(self._pixmaps) > self.levels or self._bytes > self.max_bytes):
+            _, old = self._pixmaps.popitem(last=False)
+            self._bytes -= self._size(old)
+
+    def clear(self):
+        self._pixmaps.clear()
+        self._bytes = 0